@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from oddslingers.settings import CURRENT_SEASON
+
+from banker.utils import (
+    reconcile_ledger_balances,
+    rebuild_ledger_balances,
+    create_ledger_checkpoints,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Verify the materialized LedgerBalance rows against the raw '
+        'BalanceTransfer ledger (and optionally rebuild them or write new '
+        'balance checkpoints)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--season', type=int, default=CURRENT_SEASON)
+        parser.add_argument('--fix', action='store_true',
+                            help='rebuild the season\'s balances if they '
+                                 'don\'t match the ledger')
+        parser.add_argument('--checkpoint', action='store_true',
+                            help='write checkpoints for the balances that '
+                                 'changed since the last checkpoint')
+
+    def handle(self, *args, season=CURRENT_SEASON, fix=False,
+               checkpoint=False, **options):
+        mismatches = reconcile_ledger_balances(season=season)
+        for mismatch in mismatches:
+            print('[X] {holder_id} vs {counterparty_id}: ledger has '
+                  '{expected}, materialized balance is {actual}'
+                  .format(**mismatch))
+
+        if checkpoint:
+            num_checkpoints = create_ledger_checkpoints(season=season)
+            print(f'[√] Wrote {num_checkpoints} balance checkpoints')
+
+        if mismatches and fix:
+            num_rows = rebuild_ledger_balances(season=season)
+            print(f'[√] Rebuilt {num_rows} balances for season {season}')
+        elif mismatches:
+            raise CommandError(
+                f'{len(mismatches)} balances in season {season} don\'t '
+                f'match the ledger, run with --fix to rebuild them'
+            )
+        else:
+            print(f'[√] All balances in season {season} match the ledger')
+
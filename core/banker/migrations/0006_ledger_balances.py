@@ -0,0 +1,41 @@
+# Generated by Django 2.2.11 on 2026-10-19 06:16
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banker', '0005_auto_20180926_0613'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('holder_id', models.UUIDField()),
+                ('counterparty_id', models.UUIDField(default=uuid.UUID('00000000-0000-0000-0000-000000000000'))),
+                ('season', models.IntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'index_together': {('holder_id', 'counterparty_id', 'season', 'timestamp')},
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerBalance',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('holder_id', models.UUIDField()),
+                ('counterparty_id', models.UUIDField(default=uuid.UUID('00000000-0000-0000-0000-000000000000'))),
+                ('season', models.IntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'unique_together': {('holder_id', 'counterparty_id', 'season')},
+            },
+        ),
+    ]
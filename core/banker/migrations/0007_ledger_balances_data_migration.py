@@ -0,0 +1,64 @@
+# Generated by Django 2.2.11 on 2026-10-19 06:20
+import uuid
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+import pytz
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+# frozen copies of poker.constants.SEASONS & LedgerBalance.TOTAL
+SEASON_SWITCH = datetime(2019, 1, 2, 21, 8, 17, tzinfo=pytz.utc)
+SEASONS = {
+    0: (datetime(year=2016, month=1, day=3, tzinfo=pytz.utc), SEASON_SWITCH),
+    1: (SEASON_SWITCH, datetime(year=2021, month=1, day=1, tzinfo=pytz.utc)),
+}
+TOTAL = uuid.UUID('00' * 16)
+
+
+def create_ledger_balances(apps, schema_editor):
+    """Materialize the balances of all existing transfers"""
+    BalanceTransfer = apps.get_model('banker', 'BalanceTransfer')
+    LedgerBalance = apps.get_model('banker', 'LedgerBalance')
+
+    for season, (season_start, season_end) in SEASONS.items():
+        pair_totals = BalanceTransfer.objects\
+                                     .filter(timestamp__gte=season_start,
+                                             timestamp__lt=season_end)\
+                                     .values_list('source_id', 'dest_id')\
+                                     .annotate(total=Sum('amt'))\
+                                     .order_by()
+
+        balances = defaultdict(Decimal)
+        for source_id, dest_id, total in pair_totals:
+            balances[(source_id, TOTAL)] -= total
+            balances[(dest_id, TOTAL)] += total
+            balances[(source_id, dest_id)] -= total
+            balances[(dest_id, source_id)] += total
+
+        LedgerBalance.objects.filter(season=season).delete()
+        LedgerBalance.objects.bulk_create(
+            LedgerBalance(
+                holder_id=holder_id,
+                counterparty_id=counterparty_id,
+                season=season,
+                balance=amt,
+            )
+            for (holder_id, counterparty_id), amt in balances.items()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banker', '0006_ledger_balances'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_ledger_balances,
+                             migrations.RunPython.noop)
+    ]
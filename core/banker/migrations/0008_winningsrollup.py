@@ -0,0 +1,27 @@
+# Generated by Django 2.2.11 on 2026-10-19 08:31
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banker', '0007_ledger_balances_data_migration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WinningsRollup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('user_id', models.UUIDField()),
+                ('day', models.DateField(db_index=True)),
+                ('credits', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('debits', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'unique_together': {('user_id', 'day')},
+            },
+        ),
+    ]
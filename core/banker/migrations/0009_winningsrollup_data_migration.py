@@ -0,0 +1,69 @@
+# Generated by Django 2.2.11 on 2026-10-19 08:33
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def create_winnings_rollups(apps, schema_editor):
+    """Roll up the winnings of all existing transfers"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    BalanceTransfer = apps.get_model('banker', 'BalanceTransfer')
+    WinningsRollup = apps.get_model('banker', 'WinningsRollup')
+
+    game_types = ContentType.objects.filter(app_label='poker',
+                                            model__in=('pokertable',
+                                                       'freezeout'))
+    usertype = ContentType.objects.filter(app_label='oddslingers',
+                                          model='user').first()
+    if usertype is None:
+        # fresh db, there are no transfers yet
+        return
+    day = TruncDate('timestamp')
+
+    rollups = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    credits = BalanceTransfer.objects\
+                             .filter(source_type__in=game_types,
+                                     dest_type=usertype)\
+                             .annotate(day=day)\
+                             .values_list('dest_id', 'day')\
+                             .annotate(total=Sum('amt'))\
+                             .order_by()
+    for user_id, transfer_day, total in credits:
+        rollups[(user_id, transfer_day)][0] += total
+    debits = BalanceTransfer.objects\
+                            .filter(source_type=usertype,
+                                    dest_type__in=game_types)\
+                            .annotate(day=day)\
+                            .values_list('source_id', 'day')\
+                            .annotate(total=Sum('amt'))\
+                            .order_by()
+    for user_id, transfer_day, total in debits:
+        rollups[(user_id, transfer_day)][1] += total
+
+    WinningsRollup.objects.all().delete()
+    WinningsRollup.objects.bulk_create(
+        WinningsRollup(
+            user_id=user_id,
+            day=transfer_day,
+            credits=user_credits,
+            debits=user_debits,
+        )
+        for (user_id, transfer_day), (user_credits, user_debits)
+            in rollups.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('banker', '0008_winningsrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_winnings_rollups,
+                             migrations.RunPython.noop)
+    ]
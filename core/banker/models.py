@@ -1,12 +1,25 @@
 import uuid
 
-from django.db import models
+import pytz
+
+from uuid import UUID
+from decimal import Decimal
+from datetime import datetime
+from threading import local
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from django.db import models, connection
+from django.db.models.signals import post_save, post_delete
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
 from oddslingers.model_utils import BaseModel
 from oddslingers.managers import SeasonLogLikeManager
 
+from poker.constants import SEASONS
+
 
 class Cashier(BaseModel):
     ID = '10' * 16
@@ -67,3 +80,261 @@ class BalanceTransfer(BaseModel):
     def __repr__(self):
         source, dest = (self.source_type, self.dest_type)
         return f'<Transfer {self.amt} from {source} to {dest}>'
+
+
+def season_for_timestamp(timestamp: datetime) -> Optional[int]:
+    """the season a transfer made at timestamp counts towards (if any)"""
+    for season, (season_start, season_end) in SEASONS.items():
+        if season_start <= timestamp < season_end:
+            return season
+    return None
+
+
+# (transfer, sign) of the transfers saved or deleted in this thread since
+#   the outermost deferred_ledger_updates() block was entered, if any
+_deferred = local()
+
+TransferList = List[Tuple[BalanceTransfer, int]]
+
+
+class LedgerBalanceManager(models.Manager):
+    def apply_transfers(self, transfers: TransferList):
+        """
+        Add transfers (with sign -1 for deleted ones) to the materialized
+        balances of both sides, in a single upsert per season:
+            (source, TOTAL) -= amt      (source, dest) -= amt
+            (dest, TOTAL)   += amt      (dest, source) += amt
+        """
+        deltas = defaultdict(lambda: defaultdict(Decimal))
+        for transfer, sign in transfers:
+            season = season_for_timestamp(transfer.timestamp)
+            if season is None or not transfer.amt:
+                continue
+
+            amt = Decimal(transfer.amt) * sign
+            # ids may be UUIDs or strings (e.g. Cashier.ID)
+            source_id = UUID(str(transfer.source_id))
+            dest_id = UUID(str(transfer.dest_id))
+            season_deltas = deltas[season]
+            season_deltas[(source_id, LedgerBalance.TOTAL)] -= amt
+            season_deltas[(dest_id, LedgerBalance.TOTAL)] += amt
+            season_deltas[(source_id, dest_id)] -= amt
+            season_deltas[(dest_id, source_id)] += amt
+
+        for season in sorted(deltas.keys()):
+            self.add_deltas(deltas[season], season)
+
+    def add_deltas(self, deltas: Dict[Tuple[UUID, UUID], Decimal],
+                   season: int):
+        # rows are locked in a fixed order, and transfers saved inside a
+        #   deferred_ledger_updates() block are applied together at its end,
+        #   so transactions that pay the same holders in different orders
+        #   can't deadlock, and busy rows (e.g. the Cashier's TOTAL) are
+        #   only locked from the end of a transaction until it commits
+        rows = sorted(
+            (str(holder_id), str(counterparty_id), amt)
+            for (holder_id, counterparty_id), amt in deltas.items()
+        )
+        if not rows:
+            return
+
+        table = self.model._meta.db_table
+        values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))
+        params = []
+        for holder_id, counterparty_id, amt in rows:
+            params += [
+                str(uuid.uuid4()), holder_id, counterparty_id, season, amt,
+            ]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} '
+                f'(id, holder_id, counterparty_id, season, balance) '
+                f'VALUES {values} '
+                f'ON CONFLICT (holder_id, counterparty_id, season) '
+                f'DO UPDATE SET balance = {table}.balance + EXCLUDED.balance',
+                params,
+            )
+
+
+class LedgerBalance(BaseModel):
+    """
+    Running balance of every BalanceTransfer holder per season, and per
+    (holder, counterparty) pair, kept up to date whenever a transfer is
+    created so banker.utils.balance() is a single row lookup.
+    Verify or rebuild them from the raw ledger with reconcile_balances.
+    """
+    objects = LedgerBalanceManager()
+
+    # counterparty_id of the row holding the holder's total balance
+    TOTAL = uuid.UUID('00' * 16)
+
+    holder_id = models.UUIDField(null=False)
+    counterparty_id = models.UUIDField(null=False, default=TOTAL)
+    season = models.IntegerField(null=False)
+    balance = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = (('holder_id', 'counterparty_id', 'season'),)
+
+    def __repr__(self):
+        return (f'<LedgerBalance {self.holder_id} vs {self.counterparty_id} '
+                f'S{self.season}: {self.balance}>')
+
+
+class LedgerCheckpoint(BaseModel):
+    """
+    Snapshot of a LedgerBalance: the sum of all of the holder's transfers
+    in the season with a timestamp before this checkpoint's timestamp.
+    Balances at any point in time are the latest checkpoint + the transfers
+    made since then.  Written periodically by reconcile_balances --checkpoint.
+    """
+    holder_id = models.UUIDField(null=False)
+    counterparty_id = models.UUIDField(null=False,
+                                       default=LedgerBalance.TOTAL)
+    season = models.IntegerField(null=False)
+    timestamp = models.DateTimeField(null=False)
+    balance = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        index_together = (
+            ('holder_id', 'counterparty_id', 'season', 'timestamp'),
+        )
+
+    def __repr__(self):
+        return (f'<LedgerCheckpoint {self.holder_id} vs '
+                f'{self.counterparty_id} S{self.season} '
+                f'@{self.timestamp}: {self.balance}>')
+
+
+class WinningsRollupManager(models.Manager):
+    # (app_label, model) of the holders users win chips from / buy into
+    GAME_MODELS = (('poker', 'pokertable'), ('poker', 'freezeout'))
+    USER_MODEL = ('oddslingers', 'user')
+
+    def apply_transfers(self, transfers: TransferList):
+        """
+        Add the transfers between a user and a table or freezeout to the
+        user's rollup for the day of the transfer, in a single upsert:
+            game -> user    credits += amt
+            user -> game    debits += amt
+        """
+        # (user_id, day): [credits, debits]
+        deltas = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        for transfer, sign in transfers:
+            if not transfer.amt:
+                continue
+
+            source = natural_key(transfer.source_type_id)
+            dest = natural_key(transfer.dest_type_id)
+            amt = Decimal(transfer.amt) * sign
+            if source in self.GAME_MODELS and dest == self.USER_MODEL:
+                user_id, side = transfer.dest_id, 0
+            elif source == self.USER_MODEL and dest in self.GAME_MODELS:
+                user_id, side = transfer.source_id, 1
+            else:
+                continue
+
+            day = transfer.timestamp.astimezone(pytz.utc).date()
+            deltas[(str(UUID(str(user_id))), day)][side] += amt
+
+        # rows are locked in a fixed order, see LedgerBalanceManager
+        rows = sorted(deltas.items())
+        if not rows:
+            return
+
+        table = self.model._meta.db_table
+        values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))
+        params = []
+        for (user_id, day), (credits, debits) in rows:
+            params += [str(uuid.uuid4()), user_id, day, credits, debits]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} '
+                f'(id, user_id, day, credits, debits) '
+                f'VALUES {values} '
+                f'ON CONFLICT (user_id, day) '
+                f'DO UPDATE SET '
+                f'credits = {table}.credits + EXCLUDED.credits, '
+                f'debits = {table}.debits + EXCLUDED.debits',
+                params,
+            )
+
+
+class WinningsRollup(BaseModel):
+    """
+    Chips each user won from (credits) and bought into (debits) tables and
+    freezeouts per UTC day, kept up to date whenever a transfer is created
+    so the leaderboard sums a handful of rows per user instead of scanning
+    the whole ledger.  See banker.utils.winnings_totals.
+    """
+    objects = WinningsRollupManager()
+
+    user_id = models.UUIDField(null=False)
+    day = models.DateField(null=False, db_index=True)
+    credits = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    debits = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = (('user_id', 'day'),)
+
+    def __repr__(self):
+        return (f'<WinningsRollup {self.user_id} {self.day}: '
+                f'+{self.credits} -{self.debits}>')
+
+
+def natural_key(content_type_id: int) -> Tuple[str, str]:
+    # get_for_id is cached by the ContentType manager, no query
+    content_type = ContentType.objects.get_for_id(content_type_id)
+    return (content_type.app_label, content_type.model)
+
+
+def apply_transfers(transfers: TransferList):
+    LedgerBalance.objects.apply_transfers(transfers)
+    WinningsRollup.objects.apply_transfers(transfers)
+
+
+@contextmanager
+def deferred_ledger_updates():
+    """
+    Collect the transfers saved or deleted inside the block, and apply
+    them to LedgerBalance & WinningsRollup in sorted upserts when the block
+    exits, so they're the last rows its transaction locks.  Use it inside
+    the transaction.atomic() block that the transfers are made in.
+    Nested blocks hand their transfers to the outer block, unless they
+    exit with an exception (their savepoint is rolled back).
+    """
+    parent = getattr(_deferred, 'transfers', None)
+    _deferred.transfers = []
+    try:
+        yield
+        transfers = _deferred.transfers
+    finally:
+        _deferred.transfers = parent
+
+    if parent is not None:
+        parent.extend(transfers)
+    else:
+        apply_transfers(transfers)
+
+
+def transfer_changed(transfer: BalanceTransfer, sign: int):
+    pending = getattr(_deferred, 'transfers', None)
+    if pending is not None:
+        pending.append((transfer, sign))
+    else:
+        apply_transfers([(transfer, sign)])
+
+
+def transfer_saved_handler(sender, instance, created, **kwargs):
+    if created:
+        transfer_changed(instance, 1)
+
+
+def transfer_deleted_handler(sender, instance, **kwargs):
+    transfer_changed(instance, -1)
+
+
+post_save.connect(transfer_saved_handler, sender=BalanceTransfer)
+post_delete.connect(transfer_deleted_handler, sender=BalanceTransfer)
@@ -33,18 +33,18 @@ def create_transfer(src: BalanceHolder, dst: BalanceHolder, amt: Decimal,
                 error_msg=f"User {src.username} does not have the required balance"
             ),
             Mutation(
-                qs=UserBalance.objects.current_season().filter(user=src),
+                qs=UserBalance.objects.current_season(),
                 method_name='update',
-                kwargs={'balance': F('balance') - amt}
+                kwargs={'balance': F('balance') - amt},
+                key={'user': src},
             )
         ]
     if dst_is_user:
         mutations.append(Mutation(
-            qs=UserBalance.objects.current_season()
-                                  .filter(user=dst)
-                                  .select_for_update(),
+            qs=UserBalance.objects.current_season().select_for_update(),
             method_name='update',
-            kwargs={'balance': F('balance') + amt}
+            kwargs={'balance': F('balance') + amt},
+            key={'user': dst},
         ))
     mutations.append(Mutation(
         qs=BalanceTransfer.objects,
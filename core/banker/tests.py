@@ -1,13 +1,35 @@
+from datetime import datetime, timedelta
 from decimal import Decimal
+from threading import Barrier, Thread, local
+
+import pytz
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase
 
-from banker.models import BalanceTransfer
+from banker.models import (
+    BalanceTransfer, Cashier, LedgerBalance, WinningsRollup,
+)
 from banker.mutations import create_transfer, buy_chips
+from banker.utils import (
+    balance,
+    ledger_balance,
+    reconcile_ledger_balances,
+    rebuild_ledger_balances,
+    create_ledger_checkpoints,
+    ledger_winnings,
+    winnings_totals,
+    rebuild_winnings_rollups,
+)
 
 from oddslingers.mutations import execute_mutations, MutationError
 
+from poker.models import PokerTable
+from poker.dispatch_timing import DispatchTimer
+from oddslingers.tests.test_utils import TimezoneMocker
+
 
 class CashierTest(TestCase):
     def setUp(self):
@@ -61,3 +83,215 @@ class TransfersTest(CashierTest):
             execute_mutations(
                 create_transfer(self.pirate, self.cowpig, Decimal(1337))
             )
+
+    def test_balance_updates_are_coalesced(self):
+        # pin the clock inside a season, so transfers update LedgerBalances
+        with TimezoneMocker(datetime(2019, 7, 25, tzinfo=pytz.utc)):
+            self.check_balance_updates_are_coalesced()
+
+    def check_balance_updates_are_coalesced(self):
+        mutations = []
+        for idx, user in enumerate(self.users):
+            mutations += buy_chips(user, Decimal(100) * (idx + 1))
+        # pirate's balance check runs after the buy-ins are applied
+        mutations += create_transfer(self.pirate, self.cowpig, Decimal(100))
+
+        timer = DispatchTimer()
+        with timer.measure():
+            execute_mutations(mutations)
+
+        balances = [user.userbalance().balance for user in self.users]
+        assert balances == [0, 200, 400, 400]
+        # one batch for the buy-ins, one for the transfer
+        assert timer.phases['mutations.UserBalance.update'][0] > 0
+        assert timer.summary()['mutations.UserBalance.get']['queries'] == 1
+
+        # 4 buy-ins: 4 INSERTs + 1 lock + 1 UPDATE instead of 4 UPDATEs
+        #   + 1 LedgerBalance upsert for all of them
+        mutations = []
+        for user in self.users:
+            mutations += buy_chips(user, Decimal(10))
+        with self.assertNumQueries(2 + 4 + 2 + 1):
+            execute_mutations(mutations)
+        balances = [user.userbalance().balance for user in self.users]
+        assert balances == [10, 210, 410, 410]
+        assert balance(Cashier.load(), season=1) == -1040
+
+
+class LedgerTest(CashierTest):
+    # a date in season 1
+    start = datetime(year=2019, month=7, day=25, tzinfo=pytz.utc)
+
+    def transfer_at(self, timestamp, src, dst, amt):
+        with TimezoneMocker(timestamp):
+            execute_mutations(create_transfer(src, dst, Decimal(amt)))
+
+
+class LedgerBalanceTest(LedgerTest):
+    def assert_matches_ledger(self, *holders):
+        cashier = Cashier.load()
+        for holder in (cashier, *holders):
+            assert balance(holder, season=1) == ledger_balance(holder.id,
+                                                               season=1)
+            for other in (cashier, *holders):
+                assert balance(holder, other, season=1) == ledger_balance(
+                    holder.id, other.id, season=1
+                )
+        assert reconcile_ledger_balances(season=1) == []
+
+    def test_balances_follow_transfers(self):
+        cashier = Cashier.load()
+        self.transfer_at(self.start, cashier, self.pirate, 1000)
+        self.transfer_at(self.start, self.pirate, self.cowpig, 300)
+        self.transfer_at(self.start, self.cowpig, self.pirate, 100)
+
+        assert balance(self.pirate, season=1) == 800
+        assert balance(self.cowpig, season=1) == 200
+        assert balance(self.pirate, self.cowpig, season=1) == -200
+        assert balance(cashier, season=1) == -1000
+        assert balance(self.pirate, season=0) == 0
+        self.assert_matches_ledger(self.pirate, self.cowpig)
+
+        BalanceTransfer.objects.filter(dest_id=self.cowpig.id).delete()
+        assert balance(self.cowpig, season=1) == -100
+        self.assert_matches_ledger(self.pirate, self.cowpig)
+
+    def test_reconcile_and_rebuild(self):
+        cashier = Cashier.load()
+        self.transfer_at(self.start, cashier, self.pirate, 1000)
+        self.transfer_at(self.start, self.pirate, self.ajfenix, 250)
+
+        LedgerBalance.objects.filter(holder_id=self.pirate.id,
+                                     counterparty_id=LedgerBalance.TOTAL)\
+                             .update(balance=Decimal(5))
+        mismatches = reconcile_ledger_balances(season=1)
+        assert len(mismatches) == 1
+        assert mismatches[0]['holder_id'] == self.pirate.id
+        assert mismatches[0]['expected'] == 750
+        assert mismatches[0]['actual'] == 5
+
+        rebuild_ledger_balances(season=1)
+        self.assert_matches_ledger(self.pirate, self.ajfenix)
+
+    def test_historical_balances_from_checkpoints(self):
+        cashier = Cashier.load()
+        timestamps = [self.start + timedelta(hours=hour) for hour in range(6)]
+        self.transfer_at(timestamps[0], cashier, self.pirate, 1000)
+        self.transfer_at(timestamps[1], self.pirate, self.cowpig, 100)
+        assert create_ledger_checkpoints(timestamps[2], season=1) > 0
+        self.transfer_at(timestamps[3], self.cowpig, self.pirate, 40)
+        assert create_ledger_checkpoints(timestamps[4], season=1) > 0
+        self.transfer_at(timestamps[5], self.pirate, self.cuttlefish, 10)
+
+        for timestamp in timestamps:
+            as_of = timestamp + timedelta(minutes=1)
+            for holder in (self.pirate, self.cowpig, cashier):
+                assert balance(holder, season=1, as_of=as_of) == \
+                    ledger_balance(holder.id, end_date=as_of, season=1)
+            assert balance(self.pirate, self.cowpig, season=1,
+                           as_of=as_of) == \
+                ledger_balance(self.pirate.id, self.cowpig.id,
+                               end_date=as_of, season=1)
+
+        # nothing happened since the last checkpoint
+        assert create_ledger_checkpoints(timestamps[4], season=1) == 0
+
+
+class WinningsRollupTest(LedgerTest):
+    def test_winnings_totals_match_the_ledger(self):
+        cashier = Cashier.load()
+        table = PokerTable.objects.create_table(name='Rollup Table')
+        self.transfer_at(self.start, cashier, self.pirate, 1000)
+        self.transfer_at(self.start, cashier, self.cowpig, 1000)
+
+        days = [self.start + timedelta(days=day, hours=6) for day in range(4)]
+        for day in days:
+            self.transfer_at(day, self.pirate, table, 100)
+            self.transfer_at(day, self.cowpig, table, 100)
+            self.transfer_at(day + timedelta(hours=12), table, self.pirate, 150)
+        # chips sent to other users aren't winnings
+        self.transfer_at(days[0], self.pirate, self.cuttlefish, 10)
+
+        assert WinningsRollup.objects.count() == 8
+        periods = [
+            (None, None),
+            (days[0], None),
+            (None, days[2]),
+            (days[0], days[3]),
+            (days[1].date(), days[3].date()),
+            (days[1], days[1] + timedelta(hours=9)),
+        ]
+        for start_date, end_date in periods:
+            assert winnings_totals(start_date, end_date) == \
+                ledger_winnings(start_date, end_date)
+
+        credits, debits = winnings_totals()
+        assert credits == {self.pirate.id: 600}
+        assert debits == {self.pirate.id: 400, self.cowpig.id: 400}
+
+        WinningsRollup.objects.all().delete()
+        assert rebuild_winnings_rollups() == 8
+        assert winnings_totals() == ledger_winnings()
+
+
+class ConcurrentTransfersTest(TransactionTestCase):
+    # a date in season 1
+    start = datetime(year=2019, month=7, day=25, tzinfo=pytz.utc)
+
+    def setUp(self):
+        User = get_user_model()
+        self.pirate = User.objects.create_user(username='pirate',
+                                               email='nick@hello.com',
+                                               password='banana')
+        self.cowpig = User.objects.create_user(username='cowpig',
+                                               email='maxy@hello.com',
+                                               password='banana')
+        self.tables = [
+            PokerTable.objects.create_table(name=f'Payout Table {idx}')
+            for idx in range(2)
+        ]
+
+        # each transaction waits for the other after its first transfer
+        self.barrier = Barrier(2, timeout=10)
+        self.paused = local()
+        post_save.connect(self.pause_once, sender=BalanceTransfer)
+
+    def tearDown(self):
+        post_save.disconnect(self.pause_once, sender=BalanceTransfer)
+
+    def pause_once(self, sender, instance, created, **kwargs):
+        if created and not getattr(self.paused, 'done', False):
+            self.paused.done = True
+            self.barrier.wait()
+
+    def pay_out(self, table, winners, errors):
+        try:
+            mutations = []
+            for winner in winners:
+                mutations += create_transfer(table, winner, Decimal(100))
+            execute_mutations(mutations)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_opposite_payout_orders_dont_deadlock(self):
+        errors = []
+        threads = [
+            Thread(target=self.pay_out,
+                   args=(self.tables[0], (self.pirate, self.cowpig), errors)),
+            Thread(target=self.pay_out,
+                   args=(self.tables[1], (self.cowpig, self.pirate), errors)),
+        ]
+        with TimezoneMocker(self.start):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert errors == []
+        for user in (self.pirate, self.cowpig):
+            assert balance(user, season=1) == 200
+            for table in self.tables:
+                assert balance(user, table, season=1) == 100
+        assert reconcile_ledger_balances(season=1) == []
@@ -1,8 +1,15 @@
-from datetime import datetime
+from uuid import UUID
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
-from typing import Dict
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 
-from django.db.models import Sum, Q, QuerySet
+import pytz
+
+from django.db import connection, transaction
+from django.db.models import Sum, Max, Q, QuerySet
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 from django.core.cache import cache
 from django.contrib.contenttypes.models import ContentType
 
@@ -10,10 +17,15 @@ from oddslingers.models import User
 from oddslingers.model_utils import BaseModel
 from oddslingers.settings import CURRENT_SEASON
 
-from banker.models import BalanceTransfer, Cashier
+from banker.models import (
+    BalanceTransfer, Cashier, LedgerBalance, LedgerCheckpoint, WinningsRollup,
+)
 
 from poker.models import PokerTable, Freezeout
+from poker.constants import SEASONS
+
 
+CHECKPOINT_LAG = timedelta(minutes=5)
 
 
 def get_timing_kwargs(start_date: datetime=None,
@@ -110,29 +122,338 @@ def freezeout_transfer_history(user: User,
     ).order_by('-timestamp')
 
 
-def balance(obj: BaseModel, other_obj: BaseModel=None,
-            season: int=CURRENT_SEASON) -> Decimal:
-    assert obj is not None, 'Tried to check the balance of a None object'
+def ledger_balance(obj_id: UUID, other_id: UUID=None,
+                   start_date: datetime=None, end_date: datetime=None,
+                   season: int=CURRENT_SEASON) -> Decimal:
+    """balance summed straight from the raw BalanceTransfer ledger"""
+    timing_kwargs = get_timing_kwargs(start_date, end_date)
+    transfers = BalanceTransfer.objects.season(season).filter(**timing_kwargs)
 
-    if other_obj is None:
-        credits = BalanceTransfer.objects.season(season).filter(
-            dest_id=obj.id
+    if other_id is None:
+        credits = transfers.filter(
+            dest_id=obj_id
         ).aggregate(Sum('amt'))['amt__sum'] or Decimal(0)
-        debits = BalanceTransfer.objects.season(season).filter(
-            source_id=obj.id
+        debits = transfers.filter(
+            source_id=obj_id
         ).aggregate(Sum('amt'))['amt__sum'] or Decimal(0)
     else:
-        credits = BalanceTransfer.objects.season(season).filter(
-            dest_id=obj.id,
-            source_id=other_obj.id
+        credits = transfers.filter(
+            dest_id=obj_id,
+            source_id=other_id
         ).aggregate(Sum('amt'))['amt__sum'] or Decimal(0)
-        debits = BalanceTransfer.objects.season(season).filter(
-            source_id=obj.id,
-            dest_id=other_obj.id
+        debits = transfers.filter(
+            source_id=obj_id,
+            dest_id=other_id
         ).aggregate(Sum('amt'))['amt__sum'] or Decimal(0)
     return credits - debits
 
 
+def balance(obj: BaseModel, other_obj: BaseModel=None,
+            season: int=CURRENT_SEASON, as_of: datetime=None) -> Decimal:
+    """
+    obj's balance (with other_obj only, if given) from the materialized
+    LedgerBalance rows, or at a point in time using the latest checkpoint
+    before as_of plus the transfers made since
+    """
+    assert obj is not None, 'Tried to check the balance of a None object'
+
+    counterparty_id = other_obj.id if other_obj else LedgerBalance.TOTAL
+    key = {
+        'holder_id': obj.id,
+        'counterparty_id': counterparty_id,
+        'season': season,
+    }
+
+    if as_of is None:
+        return LedgerBalance.objects.filter(**key)\
+                                    .values_list('balance', flat=True)\
+                                    .first() or Decimal(0)
+
+    checkpoint = LedgerCheckpoint.objects\
+                                 .filter(timestamp__lte=as_of, **key)\
+                                 .order_by('-timestamp')\
+                                 .first()
+    start_date = checkpoint.timestamp if checkpoint else None
+    checkpoint_balance = checkpoint.balance if checkpoint else Decimal(0)
+    return checkpoint_balance + ledger_balance(
+        obj.id,
+        other_obj.id if other_obj else None,
+        start_date=start_date,
+        end_date=as_of,
+        season=season,
+    )
+
+
+LedgerKey = Tuple[UUID, UUID]
+
+
+def ledger_balances(start_date: datetime=None, end_date: datetime=None,
+                    season: int=CURRENT_SEASON) -> Dict[LedgerKey, Decimal]:
+    """
+    {(holder_id, counterparty_id): balance} of every holder with transfers
+    in the given period, computed from the raw ledger in a single query
+    """
+    timing_kwargs = get_timing_kwargs(start_date, end_date)
+    pair_totals = BalanceTransfer.objects\
+                                 .season(season)\
+                                 .filter(**timing_kwargs)\
+                                 .values_list('source_id', 'dest_id')\
+                                 .annotate(total=Sum('amt'))\
+                                 .order_by()
+
+    balances = defaultdict(Decimal)
+    for source_id, dest_id, total in pair_totals:
+        balances[(source_id, LedgerBalance.TOTAL)] -= total
+        balances[(dest_id, LedgerBalance.TOTAL)] += total
+        balances[(source_id, dest_id)] -= total
+        balances[(dest_id, source_id)] += total
+    return balances
+
+
+def reconcile_ledger_balances(season: int=CURRENT_SEASON) -> List[Dict]:
+    """list every LedgerBalance that doesn't match the raw ledger"""
+    with transaction.atomic():
+        # hold off new transfers so both reads see the same ledger
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {BalanceTransfer._meta.db_table} '
+                f'IN SHARE MODE'
+            )
+        expected = ledger_balances(season=season)
+        actual = {
+            (holder_id, counterparty_id): amt
+            for holder_id, counterparty_id, amt in LedgerBalance.objects
+                .filter(season=season)
+                .values_list('holder_id', 'counterparty_id', 'balance')
+        }
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        expected_amt = expected.get(key, Decimal(0))
+        actual_amt = actual.get(key, Decimal(0))
+        if expected_amt != actual_amt:
+            mismatches.append({
+                'holder_id': key[0],
+                'counterparty_id': key[1],
+                'expected': expected_amt,
+                'actual': actual_amt,
+            })
+    return mismatches
+
+
+def rebuild_ledger_balances(season: int=CURRENT_SEASON) -> int:
+    """recompute all of a season's LedgerBalance rows from the raw ledger"""
+    with transaction.atomic():
+        # block new transfers until the rebuilt rows are committed
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {BalanceTransfer._meta.db_table} '
+                f'IN SHARE MODE'
+            )
+        LedgerBalance.objects.filter(season=season).delete()
+        rows = LedgerBalance.objects.bulk_create(
+            LedgerBalance(
+                holder_id=holder_id,
+                counterparty_id=counterparty_id,
+                season=season,
+                balance=amt,
+            )
+            for (holder_id, counterparty_id), amt
+                in ledger_balances(season=season).items()
+        )
+    return len(rows)
+
+
+def create_ledger_checkpoints(timestamp: datetime=None,
+                              season: int=CURRENT_SEASON) -> int:
+    """
+    Checkpoint the balance at timestamp of every holder (and pair) that had
+    transfers since the previous checkpoint of the season.  Others are
+    unchanged so their latest checkpoint stays valid.
+    """
+    season_start, season_end = SEASONS[season]
+    if timestamp is None:
+        # leave time for in-flight transactions to commit their transfers
+        timestamp = timezone.now() - CHECKPOINT_LAG
+    timestamp = min(timestamp, season_end)
+
+    last_checkpoint = LedgerCheckpoint.objects\
+                                      .filter(season=season)\
+                                      .aggregate(Max('timestamp'))
+    start_date = last_checkpoint['timestamp__max'] or season_start
+    if start_date >= timestamp:
+        return 0
+
+    deltas = ledger_balances(start_date, timestamp, season=season)
+    if not deltas:
+        return 0
+
+    holder_ids = {holder_id for holder_id, _ in deltas.keys()}
+    previous = {
+        (checkpoint.holder_id, checkpoint.counterparty_id): checkpoint.balance
+        for checkpoint in LedgerCheckpoint.objects
+            .filter(season=season, holder_id__in=holder_ids)
+            .order_by('holder_id', 'counterparty_id', '-timestamp')
+            .distinct('holder_id', 'counterparty_id')
+    }
+    checkpoints = LedgerCheckpoint.objects.bulk_create(
+        LedgerCheckpoint(
+            holder_id=holder_id,
+            counterparty_id=counterparty_id,
+            season=season,
+            timestamp=timestamp,
+            balance=previous.get((holder_id, counterparty_id), 0) + delta,
+        )
+        for (holder_id, counterparty_id), delta in deltas.items()
+    )
+    return len(checkpoints)
+
+
+UserTotals = Dict[UUID, Decimal]
+
+
+def start_of_day(timestamp: datetime) -> datetime:
+    return timestamp.astimezone(pytz.utc)\
+                    .replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def as_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time(), tzinfo=pytz.utc)
+
+
+def ledger_winnings(start_date: datetime=None,
+                    end_date: datetime=None) -> Tuple[UserTotals, UserTotals]:
+    """
+    ({user_id: credits}, {user_id: debits}) of the chips every user won
+    from and bought into tables and freezeouts, from the raw ledger
+    """
+    timing_kwargs = get_timing_kwargs(as_datetime(start_date),
+                                      as_datetime(end_date))
+    game_types = [
+        ContentType.objects.get_for_model(PokerTable),
+        ContentType.objects.get_for_model(Freezeout),
+    ]
+    usertype = ContentType.objects.get_for_model(User)
+
+    debits = BalanceTransfer.objects\
+                            .filter(dest_type__in=game_types,
+                                    source_type=usertype,
+                                    **timing_kwargs)\
+                            .values_list('source_id')\
+                            .annotate(total=Sum('amt'))\
+                            .order_by()
+    credits = BalanceTransfer.objects\
+                             .filter(source_type__in=game_types,
+                                     dest_type=usertype,
+                                     **timing_kwargs)\
+                             .values_list('dest_id')\
+                             .annotate(total=Sum('amt'))\
+                             .order_by()
+    return dict(credits), dict(debits)
+
+
+def winnings_totals(start_date: datetime=None,
+                    end_date: datetime=None) -> Tuple[UserTotals, UserTotals]:
+    """
+    Same as ledger_winnings, but the whole days in the period are summed
+    from the WinningsRollup rows (one grouped query), only the partial days
+    at either end of it are read from the ledger.
+    """
+    start_date, end_date = as_datetime(start_date), as_datetime(end_date)
+    first_day = start_date and start_of_day(start_date)
+    if first_day and first_day < start_date:
+        first_day += timedelta(days=1)
+    last_day = end_date and start_of_day(end_date)
+
+    if first_day and last_day and first_day >= last_day:
+        # less than a whole day
+        return ledger_winnings(start_date, end_date)
+
+    rollups = WinningsRollup.objects.all()
+    if first_day:
+        rollups = rollups.filter(day__gte=first_day.date())
+    if last_day:
+        rollups = rollups.filter(day__lt=last_day.date())
+
+    credits, debits = defaultdict(Decimal), defaultdict(Decimal)
+    partial_days = [
+        ledger_winnings(start_date, first_day)
+        if first_day and start_date < first_day else ({}, {}),
+        ledger_winnings(last_day, end_date)
+        if last_day and last_day < end_date else ({}, {}),
+    ]
+    for user_id, user_credits, user_debits in rollups\
+            .values_list('user_id')\
+            .annotate(Sum('credits'), Sum('debits'))\
+            .order_by():
+        credits[user_id] += user_credits
+        debits[user_id] += user_debits
+    for partial_credits, partial_debits in partial_days:
+        for user_id, amt in partial_credits.items():
+            credits[user_id] += amt
+        for user_id, amt in partial_debits.items():
+            debits[user_id] += amt
+
+    # like in the ledger, users only have credits if they won something
+    return (
+        {user_id: amt for user_id, amt in credits.items() if amt},
+        {user_id: amt for user_id, amt in debits.items() if amt},
+    )
+
+
+def rebuild_winnings_rollups() -> int:
+    """recompute all the WinningsRollup rows from the raw ledger"""
+    game_types = [
+        ContentType.objects.get_for_model(PokerTable),
+        ContentType.objects.get_for_model(Freezeout),
+    ]
+    usertype = ContentType.objects.get_for_model(User)
+    day = TruncDate('timestamp')
+
+    rollups: Dict[Tuple[UUID, date], List[Decimal]] = defaultdict(
+        lambda: [Decimal(0), Decimal(0)]
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {BalanceTransfer._meta.db_table} '
+                f'IN SHARE MODE'
+            )
+        credits = BalanceTransfer.objects\
+                                 .filter(source_type__in=game_types,
+                                         dest_type=usertype)\
+                                 .annotate(day=day)\
+                                 .values_list('dest_id', 'day')\
+                                 .annotate(total=Sum('amt'))\
+                                 .order_by()
+        for user_id, transfer_day, total in credits:
+            rollups[(user_id, transfer_day)][0] += total
+        debits = BalanceTransfer.objects\
+                                .filter(source_type=usertype,
+                                        dest_type__in=game_types)\
+                                .annotate(day=day)\
+                                .values_list('source_id', 'day')\
+                                .annotate(total=Sum('amt'))\
+                                .order_by()
+        for user_id, transfer_day, total in debits:
+            rollups[(user_id, transfer_day)][1] += total
+
+        WinningsRollup.objects.all().delete()
+        rows = WinningsRollup.objects.bulk_create(
+            WinningsRollup(
+                user_id=user_id,
+                day=transfer_day,
+                credits=user_credits,
+                debits=user_debits,
+            )
+            for (user_id, transfer_day), (user_credits, user_debits)
+                in rollups.items()
+        )
+    return len(rows)
+
+
 def cashier_balance(cached=False):
     if cached:
         return cache.get_or_set('cashier_balance', cashier_balance)
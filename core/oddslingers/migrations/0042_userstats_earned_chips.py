@@ -0,0 +1,28 @@
+# Generated by Django 2.2.11 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oddslingers', '0041_user_muck_after_winning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='earned_chips',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='earned_chips_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='earned_chips_transfer_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
@@ -84,6 +84,10 @@ class DispatchHandlerModel:
     functions with the same name
     """
 
+    # bumped whenever a dispatch changes any model, values derived from
+    #   model fields (see poker.accessors.memoized) are stale after it
+    dispatch_version = 0
+
     def dispatch(self, event, **kwargs):
         """
         Take an $EVENT and call the function with that on_$EVENT function
@@ -99,6 +103,9 @@ class DispatchHandlerModel:
         for attr, new_val in changes:
             setattr(self, attr, new_val)
 
+        if changes:
+            DispatchHandlerModel.dispatch_version += 1
+
         return changes
 
 
@@ -17,6 +17,8 @@ from django.conf import settings
 
 from banker.models import BalanceTransfer
 
+from sockets.models import uncache_sockets
+
 from poker.constants import (
     TAKE_SEAT_BEHAVIOURS, PlayingState,
     CASH_GAME_BBS, TOURNEY_BUYIN_AMTS,
@@ -433,7 +435,9 @@ class UserSession(BaseModel):
         if request:
             request.session.flush()
         if self.session:
-            self.session.socket_set.all().delete()
+            sockets = self.session.socket_set.all()
+            uncache_sockets(sockets.values_list('channel_name', flat=True))
+            sockets.delete()
             self.session_store.delete()
             self.session.delete()
         self.delete()
@@ -471,6 +475,14 @@ class UserStats(BaseModel):
         ),
     )
 
+    # running total of poker.level_utils.earned_chips, up to and including
+    #   the transfer (earned_chips_timestamp, earned_chips_transfer_id)
+    earned_chips = models.DecimalField(max_digits=20,
+                                       decimal_places=2,
+                                       default=0)
+    earned_chips_timestamp = models.DateTimeField(null=True, blank=True)
+    earned_chips_transfer_id = models.UUIDField(null=True, blank=True)
+
     def __repr__(self):
         return f'<UserStats: {self.user.username}>'
 
@@ -1,16 +1,22 @@
 import logging
-from typing import List, NamedTuple, Union, Dict, Tuple, Any
+from decimal import Decimal
+from collections import OrderedDict
+from typing import List, NamedTuple, Union, Dict, Tuple, Any, Optional
 
 from django.db.models.query import QuerySet
 from django.db.models.manager import Manager
-from django.db.models import Model
+from django.db.models import Model, ForeignKey
 from django.db import transaction
-from django.db.models import F
+from django.db.models import F, Value, Case, When
+from django.db.models.expressions import CombinedExpression
 
 from poker.models import Player
+from poker.dispatch_timing import current_timer
 
 from oddslingers.models import UserStats, User
 
+from banker.models import deferred_ledger_updates
+
 
 logger = logging.getLogger('oddslingers')
 
@@ -33,6 +39,10 @@ class Mutation(NamedTuple):
     method_name: str
     kwargs: Dict[str, Any]
     error_msg: str = None
+    # {pk or fk: value} of the single row of qs that an increment update
+    #   applies to, lets execute_mutations coalesce it with the increments
+    #   of other rows of the same qs
+    key: Dict[str, Any] = None
 
 
 MutationList = List[Mutation]
@@ -42,37 +52,187 @@ class MutationError(Exception):
     pass
 
 
+def _increment_key(mutation: Mutation) -> Optional[tuple]:
+    """
+    Updates of the form update(field=F(field)+n) with a key={<pk or fk>: v}
+    can be coalesced with other increments of the same fields in the same
+    queryset.  Returns (batch_key, scope, key_field, key, {field: n}) for
+    those, where scope is the queryset the key applies to.
+    """
+    qs, method_name, kwargs, _, key = mutation
+    if (method_name != 'update' or not isinstance(qs, QuerySet)
+            or not kwargs or not key or len(key) != 1):
+        return None
+
+    (key_name, key_value), = key.items()
+    key_field = qs.model._meta.get_field(key_name)
+    if not (key_field.primary_key or isinstance(key_field, ForeignKey)):
+        return None
+    if isinstance(key_value, Model):
+        key_value = key_value.pk
+
+    deltas = {}
+    for field, value in kwargs.items():
+        if not (isinstance(value, CombinedExpression)
+                and value.connector in ('+', '-')
+                and isinstance(value.lhs, F)
+                and value.lhs.name == field
+                and isinstance(value.rhs, Value)
+                and isinstance(value.rhs.value, (int, Decimal))):
+            return None
+        sign = 1 if value.connector == '+' else -1
+        deltas[field] = sign * value.rhs.value
+
+    # the batch locks its rows itself
+    scope = qs.all()
+    scope.query.select_for_update = False
+    batch_key = (
+        qs.model._meta.db_table,
+        str(scope.query),
+        tuple(sorted(deltas.keys())),
+    )
+    return batch_key, scope, key_field.attname, key_value, deltas
+
+
+class IncrementBatch:
+    """Increments of the same fields on many rows of the same queryset"""
+
+    def __init__(self, scope: QuerySet, key_field: str):
+        self.scope = scope
+        self.key_field = key_field
+        self.deltas: Dict[Any, Dict[str, Any]] = OrderedDict()
+        self.mutations: MutationList = []
+
+    @property
+    def model_name(self) -> str:
+        return self.scope.model.__name__
+
+    def add(self, mutation: Mutation, key, deltas: Dict[str, Any]):
+        self.mutations.append(mutation)
+        row_deltas = self.deltas.setdefault(key, {})
+        for field, delta in deltas.items():
+            row_deltas[field] = row_deltas.get(field, 0) + delta
+
+    def execute(self):
+        # rows are locked in key order so that concurrent batches touching
+        #   the same rows can't deadlock each other
+        keys = sorted(self.deltas.keys(), key=str)
+        rows = self.scope.filter(**{f'{self.key_field}__in': keys})
+        if len(keys) == 1:
+            rows.update(**{
+                field: F(field) + delta
+                for field, delta in self.deltas[keys[0]].items()
+            })
+            return
+
+        list(rows.select_for_update()
+                 .order_by(self.key_field)
+                 .values_list(self.key_field, flat=True))
+
+        first_deltas = self.deltas[keys[0]]
+        if all(self.deltas[key] == first_deltas for key in keys):
+            rows.update(**{
+                field: F(field) + delta
+                for field, delta in first_deltas.items()
+            })
+            return
+
+        rows.update(**{
+            field: F(field) + Case(
+                *(
+                    When(**{self.key_field: key},
+                         then=Value(self.deltas[key].get(field, 0)))
+                    for key in keys
+                ),
+                default=Value(0),
+                output_field=self.scope.model._meta.get_field(field),
+            )
+            for field in first_deltas.keys()
+        })
+
+
+def _mutation_error(mutations: MutationList, e: Exception):
+    error_msg = next((m.error_msg for m in mutations if m.error_msg), None)
+    logger.exception(error_msg or str(e), extra={
+        'exception': f'{e.__class__.__name__}: {e}',
+        'error_msg': error_msg,
+        'mutations': [
+            {
+                'qs': qs,
+                'method_name': method_name,
+                'kwargs': kwargs
+            }
+            for qs, method_name, kwargs, _, _ in mutations
+        ],
+    })
+    return MutationError(error_msg or str(e))
+
+
 def execute_mutations(mutations: MutationList):
-    with transaction.atomic():
-        for qs, method_name, kwargs, error_msg in mutations:
-            assert isinstance(qs, QuerySet)\
-                   or isinstance(qs, Manager), QS_ERROR_MSG
-            assert method_name in SUPPORTED_METHODS,\
-                   METHOD_ERROR_MSG.format(method_name)
-
-            method = getattr(qs, method_name)
-            try:
-                method(**kwargs)
-            except Exception as e:
-                logger.exception(error_msg or str(e), extra={
-                    'exception': f'{e.__class__.__name__}: {e}',
-                    'error_msg': error_msg,
-                    'mutation': {
-                        'qs': qs,
-                        'method_name': method_name,
-                        'kwargs': kwargs
-                    }
-                })
-                raise MutationError(error_msg or str(e)) from e
+    """
+    Execute the mutations in order in a single transaction.
+
+    Increments of the same fields on different rows of the same queryset
+    (e.g. balance=F('balance') + amt for each winner of a hand) are
+    coalesced into a single UPDATE per batch.  Batches are held until a
+    different mutation touches the same table (so it sees their effects)
+    or all mutations are done, then executed in table & key order to keep
+    the locking order deterministic.  Each batch is timed as a
+    mutations.<Model>.<method> phase of the current dispatch.  The ledger
+    balances of the transfers made are updated last, see
+    banker.models.deferred_ledger_updates.
+    """
+    for qs, method_name, kwargs, error_msg, _ in mutations:
+        assert isinstance(qs, QuerySet)\
+               or isinstance(qs, Manager), QS_ERROR_MSG
+        assert method_name in SUPPORTED_METHODS,\
+               METHOD_ERROR_MSG.format(method_name)
+
+    timer = current_timer()
+    batches: Dict[tuple, IncrementBatch] = OrderedDict()
+
+    def flush(db_table: str=None):
+        for batch_key in sorted(batches.keys()):
+            if db_table is not None and batch_key[0] != db_table:
+                continue
+            batch = batches.pop(batch_key)
+            with timer.phase(f'mutations.{batch.model_name}.update'):
+                try:
+                    batch.execute()
+                except Exception as e:
+                    raise _mutation_error(batch.mutations, e) from e
+
+    with transaction.atomic(), deferred_ledger_updates():
+        for mutation in mutations:
+            increment = _increment_key(mutation)
+            if increment is not None:
+                batch_key, scope, key_field, key, deltas = increment
+                if batch_key not in batches:
+                    batches[batch_key] = IncrementBatch(scope, key_field)
+                batches[batch_key].add(mutation, key, deltas)
+                continue
+
+            qs, method_name, kwargs, error_msg, key = mutation
+            if key:
+                qs = qs.filter(**key)
+            flush(qs.model._meta.db_table)
+
+            model_name = qs.model.__name__
+            with timer.phase(f'mutations.{model_name}.{method_name}'):
+                try:
+                    getattr(qs, method_name)(**kwargs)
+                except Exception as e:
+                    raise _mutation_error([mutation], e) from e
+
+        flush()
 
 
 def increase_hands_played(player: Player) -> MutationList:
     return [Mutation(
-        qs=UserStats.objects.current_season()
-                            .filter(user=player.user)
-                            .select_for_update(),
+        qs=UserStats.objects.current_season().select_for_update(),
         method_name='update',
         kwargs={'hands_played': F('hands_played') + 1},
+        key={'user': player.user},
     )]
 
 
@@ -118,6 +118,12 @@ SEND_ZULIP_ALERTS = not DEBUG
 ENABLE_PIWIK = not DEBUG
 ENABLE_SENTRY = not DEBUG
 STDOUT_IO_SUMMARY = DEBUG
+SOCKET_IO_LOG_ENABLED = True                    # write data/logs/socket_io_*.log
+SOCKET_IO_LOG_SAMPLE_RATE = 1.0                 # fraction of messages to log
+SOCKET_IO_LOG_MAX_BYTES = 50 * 1024 * 1024      # rotate to .1 past this size
+SOCKET_IO_LOG_QUEUE_SIZE = 10000                # drop lines past this backlog
+SOCKET_IO_LOG_BATCH_SIZE = 500
+SOCKET_IO_LOG_FLUSH_INTERVAL = 0.5              # seconds to wait for a batch
 
 
 ################################################################################
@@ -133,6 +139,7 @@ SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
+SOCKET_LAST_PING_FLUSH_INTERVAL = 60    # secs between Socket.last_ping writes
 LOGIN_URL = '/accounts/login/'
 LOGOUT_REDIRECT_URL = '/'
 
@@ -199,6 +206,14 @@ SUPPORT_GIVERS = [
 REDIS_BOTBEAT_KEY = 'botbeat'
 REDIS_TABLEBEAT_KEY = 'tablebeat'
 HEARTBEAT_POLL = 5                          # polling delay in seconds
+DISPATCH_TIMING_ENABLED = True              # record per-phase dispatch timing histograms in redis
+DISPATCH_TIMING_SAMPLE_RATE = 0.05          # fraction of dispatches whose timing is recorded
+OUTBOX_BATCH_SIZE = 500                     # subscriber outbox events processed per batch
+OUTBOX_MAX_ATTEMPTS = 5                     # give up on outbox events that failed this many times
+OUTBOX_RETENTION_DAYS = 7                   # keep processed outbox events (idempotency keys) this long
+CHAT_HISTORY_CACHE_LENGTH = 100             # recent chat lines of each table kept in redis
+HAND_ARCHIVE_AFTER_DAYS = 90                # move finished hands older than this to HAND_ARCHIVE_DIR
+HAND_SUMMARIES_CACHE_LENGTH = 500           # rendered hand history summaries of each table kept in redis
 
 
 ################################################################################
@@ -280,6 +295,7 @@ SUPPORT_TICKET_DIR = os.path.join(DATA_DIR, 'support_tickets')
 GEOIP_DIR = os.path.join(DATA_DIR, 'geoip')
 DEBUG_DUMP_DIR = os.path.join(DATA_DIR, 'debug_dumps')
 CACHES_DIR = os.path.join(DATA_DIR, 'caches')
+HAND_ARCHIVE_DIR = os.path.join(DATA_DIR, 'hand_archive')
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 STATICFILES_DIR = os.path.join(BASE_DIR, 'static')
@@ -299,6 +315,7 @@ DATA_DIRS = [
     SUPPORT_TICKET_DIR,
     DEBUG_DUMP_DIR,
     CACHES_DIR,
+    HAND_ARCHIVE_DIR,
 ]
 
 ################################################################################
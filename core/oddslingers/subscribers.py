@@ -1,11 +1,11 @@
-from poker.subscribers import MutationSubscriber
+from poker.subscribers import OutboxSubscriber
 from poker.constants import Event
 from poker.models import PokerTable
 
-from oddslingers.mutations import increase_hands_played
 
-
-class UserStatsSubscriber(MutationSubscriber):
+class UserStatsSubscriber(OutboxSubscriber):
+    events = frozenset((Event.END_HAND,))
+    subject_types = (PokerTable,)
 
     @property
     def players(self):
@@ -13,5 +13,10 @@ class UserStatsSubscriber(MutationSubscriber):
 
     def dispatch(self, subj, event, changes=None, **kwargs):
         if isinstance(subj, PokerTable) and event == Event.END_HAND:
-            for player in self.players:
-                self.mutations += increase_hands_played(player)
+            # hands_played is increased in batches by the outbox worker
+            user_ids = [plyr.user.id for plyr in self.players if plyr.user]
+            if user_ids:
+                self.queue('hands_played', user_ids=user_ids)
+
+    def updates_for_broadcast(self, player=None, spectator=None):
+        return {}
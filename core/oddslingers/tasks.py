@@ -3,7 +3,7 @@ import logging
 from typing import Optional
 from collections import defaultdict
 
-from django.db.models import Sum
+from django.db.models import Q, Sum
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.http import urlencode
@@ -15,7 +15,7 @@ from oddslingers.system import load_summary, MAX_LOAD, kill_all_heartbeats
 from support.models import SupportTicket
 from oddslingers.utils import notify_zulip
 from oddslingers.models import User, UserSession
-from poker.models import PokerTable, HandHistory
+from poker.models import PokerTable, HandHistory, ArchivedHandHistory
 from poker.bot_personalities import PERSONALITIES
 
 logger = logging.getLogger('dramatiq')
@@ -146,6 +146,9 @@ def daily_report(send_zulip=True):
     new_signups = get_user_model().objects.filter(created__gt=yesterday)
     active_sessions = UserSession.objects.filter(last_activity__gt=yesterday)
     total_hands = HandHistory.objects.exclude(table__is_tutorial=True).exclude(table__is_mock=True).count()
+    # hands moved out of the db by archive_hand_history
+    excluded_tables = PokerTable.objects.filter(Q(is_tutorial=True) | Q(is_mock=True)).values('id')
+    total_hands += ArchivedHandHistory.objects.exclude(table_id__in=excluded_tables).aggregate(Sum('num_hands'))['num_hands__sum'] or 0
     total_users = User.objects.exclude(is_robot=True).exclude(is_staff=True).count()
     total_tables = PokerTable.objects.exclude(is_mock=True).exclude(is_tutorial=True).count()
 
@@ -241,6 +244,15 @@ def async_start_tablebeat(table_id: str):
     table = PokerTable.objects.get(id=table_id)
     start_tablebeat(table)
 
+
+@dramatiq.actor(priority=2)
+def process_outbox():
+    from poker.outbox import process_outbox_events
+
+    # keep going until the backlog of pending events is drained
+    while process_outbox_events() == settings.OUTBOX_BATCH_SIZE:
+        pass
+
 @dramatiq.actor(priority=1)
 def check_server_load(warn_zulip=True, restart_heartbeats=True) -> tuple:
 
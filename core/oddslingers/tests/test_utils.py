@@ -1,7 +1,10 @@
+import os
+import tempfile
+
 from datetime import timedelta
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from oddslingers.utils import deep_diff
+from oddslingers.utils import deep_diff, SocketIOLogWriter
 from django.utils import timezone
 
 
@@ -128,3 +131,50 @@ class MonkeyPatch:
 
     def __exit__(self, *args):
         setattr(self.klass, self.method_name, self.original_method)
+
+
+class SocketIOLogWriterTest(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmpdir.name, 'socket_io_test_in.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_batched_writes_and_flush(self):
+        writer = SocketIOLogWriter(max_queue=100, batch_size=10,
+                                   max_bytes=0, flush_interval=0.01)
+        for i in range(25):
+            writer.put(self.log_path, f'{{"line": {i}}}')
+        writer.flush()
+
+        with open(self.log_path) as f:
+            lines = f.read().splitlines()
+        assert lines == [f'{{"line": {i}}}' for i in range(25)]
+
+    def test_rotation_by_size(self):
+        writer = SocketIOLogWriter(max_queue=100, batch_size=1,
+                                   max_bytes=16, flush_interval=0.01)
+        for i in range(4):
+            writer.put(self.log_path, 'x' * 15)
+            writer.flush()
+
+        assert os.path.exists(f'{self.log_path}.1')
+        assert os.path.getsize(self.log_path) == 16
+
+    def test_bounded_queue_drops_lines(self):
+        writer = SocketIOLogWriter(max_queue=2, batch_size=10,
+                                   max_bytes=0, flush_interval=0.01)
+        # don't start the thread, so nothing drains the queue
+        writer._ensure_started = lambda: None
+        for _ in range(5):
+            writer.put(self.log_path, 'line')
+        assert writer.dropped == 3
+
+    def test_settings_are_read_when_used(self):
+        writer = SocketIOLogWriter(max_queue=100)
+        with override_settings(SOCKET_IO_LOG_BATCH_SIZE=3,
+                               SOCKET_IO_LOG_MAX_BYTES=16):
+            assert writer.batch_size == 3
+            assert writer.max_bytes == 16
+        assert writer.max_queue == 100
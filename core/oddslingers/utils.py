@@ -8,6 +8,9 @@ import shutil
 import zulip
 import random
 import secrets
+import queue
+import logging
+import threading
 
 from typing import Tuple, Optional
 from fnmatch import fnmatch
@@ -30,6 +33,8 @@ from django.db.models import (DecimalField, CharField, IntegerField,
 from django.utils import timezone
 
 
+logger = logging.getLogger('sockets')
+
 # ANSI Terminal escape sequences for printing colored log messages to shell
 ANSI = {
     'reset': '\033[00;00m',
@@ -331,11 +336,169 @@ def debug_print_info(content: str=None):
     if settings.DEBUG:
         print(message)
 
+
+class SocketIOLogWriter:
+    """
+    Background writer for the per-path socket IO logs.
+
+    Lines are queued by log_io_message and appended in batches by a single
+    daemon thread, so websocket handlers never wait on the filesystem.
+    The queue is bounded: when the writer falls behind, new lines are
+    dropped (and counted) instead of growing memory without limit.
+    Each log file is rotated to <path>.1 once it exceeds max_bytes.
+
+    Options that aren't passed are read from the SOCKET_IO_LOG_* settings
+    when they're used, so override_settings applies to the shared writer.
+    """
+
+    def __init__(self, max_queue: int=None, batch_size: int=None,
+                 max_bytes: int=None, flush_interval: float=None):
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._max_bytes = max_bytes
+        self._flush_interval = flush_interval
+        self.queue = None
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def max_queue(self) -> int:
+        if self._max_queue is None:
+            return settings.SOCKET_IO_LOG_QUEUE_SIZE
+        return self._max_queue
+
+    @property
+    def batch_size(self) -> int:
+        if self._batch_size is None:
+            return settings.SOCKET_IO_LOG_BATCH_SIZE
+        return self._batch_size
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is None:
+            return settings.SOCKET_IO_LOG_MAX_BYTES
+        return self._max_bytes
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is None:
+            return settings.SOCKET_IO_LOG_FLUSH_INTERVAL
+        return self._flush_interval
+
+    def put(self, io_log_path: str, line: str):
+        self._ensure_started()
+        if self.queue is None:
+            self.queue = queue.Queue(maxsize=self.max_queue)
+        try:
+            self.queue.put_nowait((io_log_path, line))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float=5.0):
+        """block until every line queued so far has been written to disk"""
+        if not self._is_running():
+            return
+        done = threading.Event()
+        try:
+            self.queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def _is_running(self):
+        return (self._thread is not None
+                and self._thread.is_alive()
+                and self._pid == os.getpid())
+
+    def _ensure_started(self):
+        # the thread doesn't survive a fork, so restart it in the child
+        if self._is_running():
+            return
+        with self._start_lock:
+            if self._is_running():
+                return
+            if self.queue is None or self._pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='socket-io-log-writer',
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            lines_by_path = {}
+            flush_events = []
+            for io_log_path, line in batch:
+                if io_log_path is None:
+                    flush_events.append(line)
+                else:
+                    lines_by_path.setdefault(io_log_path, []).append(line)
+            for io_log_path, lines in lines_by_path.items():
+                try:
+                    self._write_lines(io_log_path, lines)
+                except Exception:
+                    # never let a bad disk or path kill the writer thread
+                    logger.exception('Failed to write socket IO log',
+                                     extra={'io_log_path': io_log_path})
+            for done in flush_events:
+                done.set()
+
+    def _write_lines(self, io_log_path: str, lines: list):
+        self._rotate_if_needed(io_log_path)
+        with open(io_log_path, 'a+') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+
+    def _rotate_if_needed(self, io_log_path: str):
+        if not self.max_bytes:
+            return
+        try:
+            size = os.path.getsize(io_log_path)
+        except OSError:
+            return
+        if size >= self.max_bytes:
+            os.replace(io_log_path, f'{io_log_path}.1')
+
+
+SOCKET_IO_LOG_WRITER = SocketIOLogWriter()
+
+
+def socket_io_log_path(path: str, direction: str) -> str:
+    """e.g. '/table/abc124234/' to LOGS_DIR/socket_io_table-abc124234_in.log"""
+    assert path and path[0] == '/' and path[-1] == '/', (
+                f'expected path w/pattern: "/.../" but got {path}')
+    path_to_hyphens = '-'.join(path.split('/')[1:-1])
+
+    return settings.SOCKET_IO_LOG.format(path_to_hyphens, direction)
+
+
 def log_io_message(socket, direction: str, content: dict):
-    """write a socket IO log message to the io log for that socket's path"""
+    """queue a socket IO log message for the io log of that socket's path"""
     assert direction in ('in', 'out')
     if not socket: return
 
+    if not settings.SOCKET_IO_LOG_ENABLED:
+        return
+
+    sample_rate = settings.SOCKET_IO_LOG_SAMPLE_RATE
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+
     if hasattr(socket, 'user'):
         path = socket.path      # single socket
     else:
@@ -343,18 +506,20 @@ def log_io_message(socket, direction: str, content: dict):
         assert all(s.path == path for s in socket), (
             'When sending messages to a group, all must have the same path')
 
-    # e.g. '/table/abc124234/' to table-abc124234
-    assert path and path[0] == '/' and path[-1] == '/', (
-                f'expected path w/pattern: "/.../" but got {path}')
-    path_to_hyphens = '-'.join(path.split('/')[1:-1])
+    # serialize now, the content dict may be mutated after we return
+    SOCKET_IO_LOG_WRITER.put(
+        socket_io_log_path(path, direction),
+        to_json_str(content, sort_keys=True),
+    )
 
-    io_log_path = settings.SOCKET_IO_LOG.format(path_to_hyphens, direction)
 
-    with open(io_log_path, 'a+') as f:
-        # TODO: this has a performance cost on every websocket message as it
-        # requires a full disk write and commit before doing anything else
-        f.write(to_json_str(content, sort_keys=True))
-        f.write('\n')
+def flush_io_log(timeout: float=5.0):
+    """
+    wait for the socket IO log lines queued by this process to be written
+    to disk.  Other processes have their own writer, which writes lines
+    shortly after they're queued but can't be flushed from here.
+    """
+    SOCKET_IO_LOG_WRITER.flush(timeout=timeout)
 
 
 class StrBasedEnum(Enum):
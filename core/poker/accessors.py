@@ -2,6 +2,8 @@ import logging
 
 from decimal import Decimal
 from datetime import timedelta
+from functools import wraps
+from contextlib import contextmanager
 
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -9,6 +11,7 @@ from django.utils import timezone
 from oddslingers.utils import (rotated, ExtendedEncoder, idx_dict,
                           autocast, decimal_floor, fnv_hash,
                           secure_random_number)
+from oddslingers.model_utils import DispatchHandlerModel
 
 from poker.bot_personalities import bot_personality, DEFAULT_BIO
 from poker.constants import (
@@ -42,7 +45,44 @@ def filter_nonactors(players):
     ]
 
 
+def memoized(method):
+    """
+    While the accessor is memoizing (see PokerAccessor.memoizing), keep
+    the value derived from the table & players until the next dispatch
+    changes any of them.  Lists are copied so callers can modify them.
+    """
+    key = method.__qualname__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._memo is None:
+            return method(self, *args, **kwargs)
+
+        stamp = (DispatchHandlerModel.dispatch_version, len(self.players))
+        if self._memo_stamp != stamp:
+            self._memo = {}
+            self._memo_stamp = stamp
+
+        call_key = (key, args, tuple(sorted(kwargs.items())))
+        if call_key not in self._memo:
+            self._memo[call_key] = method(self, *args, **kwargs)
+        value = self._memo[call_key]
+        return list(value) if isinstance(value, list) else value
+
+    return wrapper
+
+
 class PokerAccessor:
+    # derived values cached by @memoized, None when not memoizing
+    _memo = None
+    _memo_stamp = None
+    # seated player at each position, kept by seat_changed while memoizing
+    _seats = None
+    _seats_stamp = None
+    # {index name: {key: [players]}} for the player_by_* lookups
+    _indexes = None
+    _indexes_stamp = None
+
     def __init__(self, table, players=None):
         self.table = table
         # smartly load players into memory if they aren't passed
@@ -51,6 +91,96 @@ class PokerAccessor:
         # used by the BankerSubscriber
         self.pending_transfers = []
 
+    @contextmanager
+    def memoizing(self):
+        """cache the @memoized values for the duration of a dispatch"""
+        if self._memo is not None:
+            yield
+            return
+        self._memo, self._memo_stamp = {}, None
+        self._seats, self._seats_stamp = None, None
+        try:
+            yield
+        finally:
+            self._memo, self._memo_stamp = None, None
+            self._seats, self._seats_stamp = None, None
+
+    def _players_stamp(self):
+        # holds on to the list itself so its id can't be reused
+        return (self.players, len(self.players))
+
+    def _players_changed(self, stamp):
+        return (stamp is None
+                or stamp[0] is not self.players
+                or stamp[1] != len(self.players))
+
+    def _seat_array(self):
+        """
+        the seated player at each position of the table, or None.
+        While memoizing, the array is only rebuilt when players are
+        added and is otherwise kept up to date by seat_changed.  Outside
+        of a dispatch it's rebuilt on every call, since tests & the
+        replayer seat players by changing their fields directly.
+        """
+        if self._seats is not None \
+                and not self._players_changed(self._seats_stamp):
+            return self._seats
+
+        seats = [None] * self.table.num_seats
+        for plyr in self.players:
+            if plyr.seated and plyr.position in range(len(seats)):
+                assert seats[plyr.position] is None, \
+                    'Sanity check fail: more than one player seated at '\
+                    'a position'
+                seats[plyr.position] = plyr
+
+        if self._memo is not None:
+            self._seats = seats
+            self._seats_stamp = self._players_stamp()
+        return seats
+
+    def seat_changed(self, player):
+        """update the seat array after a TAKE_SEAT or LEAVE_SEAT"""
+        if self._seats is None:
+            return
+        seats = self._seats
+        for pos, plyr in enumerate(seats):
+            if plyr is player and not (player.seated
+                                       and player.position == pos):
+                seats[pos] = None
+        if player.seated and player.position in range(len(seats)):
+            assert seats[player.position] in (None, player), \
+                'Sanity check fail: more than one player seated at '\
+                'a position'
+            seats[player.position] = player
+
+    def seats(self):
+        return list(self._seat_array())
+
+    def seats_from(self, position: int):
+        """
+        (position, seated player or None) for every seat, going around
+        the table starting at position
+        """
+        seats = self._seat_array()
+        num_seats = len(seats)
+        for offset in range(num_seats):
+            pos = (position + offset) % num_seats
+            yield pos, seats[pos]
+
+    def _player_index(self, name, key):
+        """{key(player): [players]}, rebuilt when players are added"""
+        if self._players_changed(self._indexes_stamp):
+            self._indexes = {}
+            self._indexes_stamp = self._players_stamp()
+
+        if name not in self._indexes:
+            index = {}
+            for plyr in self.players:
+                index.setdefault(key(plyr), []).append(plyr)
+            self._indexes[name] = index
+        return self._indexes[name]
+
     def commit(self):
         if self.table.tournament:
             self.table.tournament.save()
@@ -298,17 +428,9 @@ class PokerAccessor:
 
         return not player.is_active()
 
+    @memoized
     def seated_players(self):
-        players = []
-        for pos in range(self.table.num_seats):
-            plyr = self.players_at_position(
-                pos,
-                active_only=False,
-                include_unseated=False
-            )
-            if plyr:
-                players.append(plyr)
-        return players
+        return [plyr for plyr in self._seat_array() if plyr]
 
     def seated_humans(self):
         return [
@@ -316,32 +438,25 @@ class PokerAccessor:
             if not plyr.is_robot and plyr.seated
         ]
 
+    @memoized
     def active_players(self, rotate=None,
                              include_pending_at_idx=None):
         if rotate is None:
             rotate = self.first_to_act_pos() or 0
 
-        player_idxs = rotated(list(range(self.table.num_seats)), rotate)
-
-        if include_pending_at_idx is not None:
-            players = []
-            for i in player_idxs:
-                plyr = self.players_at_position(i)
-                if (i == include_pending_at_idx
-                        and self.player_is_active_or_pending(plyr)):
-                    players.append(plyr)
-                elif plyr is not None and plyr.is_active():
-                    players.append(plyr)
-        else:
-            players = [
-                self.players_at_position(i, active_only=True)
-                for i in player_idxs
-            ]
-
-        return [plyr for plyr in players if plyr is not None]
+        players = []
+        for pos, plyr in self.seats_from(rotate):
+            if plyr is None:
+                continue
+            if (pos == include_pending_at_idx
+                    and self.player_is_active_or_pending(plyr)):
+                players.append(plyr)
+            elif plyr.is_active():
+                players.append(plyr)
 
         return players
 
+    @memoized
     def showdown_players(self, rotate=None):
         return filter_nonactors(self.active_players(rotate))
 
@@ -366,25 +481,17 @@ class PokerAccessor:
                                   active_only=False,
                                   include_unseated=False):
         """
-        returns a single player at the position, or a list if more than
-        one player
+        returns a single player at the position, or a list of every
+        player who sat there if include_unseated
         """
-        players = [plyr for plyr in self.players if plyr.position == position]
-
-        if active_only:
-            active = [plyr for plyr in players if plyr.is_active()]
-            assert len(active) <= 1, \
-                'Sanity check fail: more than one player active at '\
-                'a position'
-            return active.pop() if active else None
-        elif not include_unseated:
-            seated = [plyr for plyr in players if plyr.seated]
-            assert len(seated) <= 1, \
-                'Sanity check fail: more than one player seated at '\
-                'a position'
-            return seated.pop() if seated else None
+        if include_unseated and not active_only:
+            return [plyr for plyr in self.players if plyr.position == position]
 
-        return players
+        seats = self._seat_array()
+        plyr = seats[position] if position in range(len(seats)) else None
+        if active_only and not (plyr and plyr.is_active()):
+            return None
+        return plyr
 
     def winners(self, showdown_players):
         losers = list(showdown_players)
@@ -635,6 +742,7 @@ class PokerAccessor:
     def bb_player(self):
         return self.players_at_position(self.table.bb_idx, active_only=True)
 
+    @memoized
     def current_pot(self):
         return sum(player.total_contributed()
                     for player in self._filter_active_players())
@@ -652,6 +760,7 @@ class PokerAccessor:
     def btn_is_locked(self):
         return self.table.bb_idx is None and self.table.btn_idx is not None
 
+    @memoized
     def first_to_act_pos(self):
         # note that this can return a seat position that has no player
         #   in those cases, the first_to_act will be the next active
@@ -682,6 +791,7 @@ class PokerAccessor:
     def user_sidebets_for_player(self, user, player):
         return Sidebet.objects.filter(user=user, player=player)
 
+    @memoized
     def players_in_acting_order(self):
         first = self.first_to_act_pos()
         return filter_nonactors(self.active_players(first))
@@ -697,10 +807,10 @@ class PokerAccessor:
         return get_user_model().objects.get(id=user_id)
 
     def player_by_user_id(self, user_id):
-        players = [
-            p for p in self.players
-            if (p.user and str(p.user.id) == str(user_id))
-        ]
+        players = self._player_index(
+            'user_id',
+            lambda p: str(p.user_id) if p.user_id else None,
+        ).get(str(user_id))
         if not players:
             try:
                 return Player.objects.get(user__id=user_id,
@@ -714,10 +824,8 @@ class PokerAccessor:
         return players[0]
 
     def player_by_player_id(self, player_id):
-        players = [
-            p for p in self.players
-            if p.id == player_id or str(p.id) == str(player_id)
-        ]
+        players = self._player_index('id', lambda p: str(p.id))\
+                      .get(str(player_id))
         if not players:
             return None
         assert len(players) == 1, (
@@ -726,7 +834,8 @@ class PokerAccessor:
         return players[0]
 
     def player_by_username(self, username):
-        players = [p for p in self.players if p.username == username]
+        players = self._player_index('username', lambda p: p.username)\
+                      .get(username)
         if not players:
             return None
         assert len(players) == 1, (
@@ -795,6 +904,7 @@ class PokerAccessor:
     def last_raise_size(self):
         return max(p.uncollected_bets for p in self._filter_active_players())
 
+    @memoized
     def next_to_act(self):
         players = self.players_in_acting_order()
 
@@ -910,18 +1020,14 @@ class PokerAccessor:
 
     def next_bb_location_info(self, curr_bb_idx):
         skipped_positions = []
-        next_bb = (curr_bb_idx + 1) % self.table.num_seats
-        next_player = self.players_at_position(next_bb)
 
         # move the bb to the first player who can post it.
-        while not self.player_is_active_or_pending(next_player):
-            skipped_positions.append(next_bb)
-            next_bb = (next_bb + 1) % self.table.num_seats
+        for next_bb, next_player in self.seats_from(curr_bb_idx + 1):
             assert next_bb != curr_bb_idx, \
                 "Sanity check fail: bb rotated back onto itself"
-            next_player = self.players_at_position(next_bb)
-
-        return (next_bb, skipped_positions)
+            if self.player_is_active_or_pending(next_player):
+                return (next_bb, skipped_positions)
+            skipped_positions.append(next_bb)
 
     def next_sb_location_info(self, curr_sb_idx, next_bb_idx):
         next_sb = (curr_sb_idx + 1) % self.table.num_seats
@@ -998,6 +1104,7 @@ class PokerAccessor:
 
         return player.user.userbalance().balance >= amt
 
+    @memoized
     def sidepot_summary(self, exclude_uncollected_bets=False):
         '''
             returns a list of the sidepots in order of the
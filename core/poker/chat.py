@@ -0,0 +1,140 @@
+"""
+Recent chat lines of each ChatHistory, cached in redis.
+
+Clients load the last CHAT_HISTORY_CACHE_LENGTH lines of a table's (or
+tournament's) chat every time they open the table page.  Instead of
+querying ChatLine (and each line's user) on every page load, the rendered
+lines are kept in a bounded redis list per chat history:
+
+    chat-history-<chat_history_id>  (redis list, oldest first)
+        {"timestamp": ..., "speaker": ..., "message": ..., "is_staff": ...}
+    chat-history-gen-<chat_history_id>  (redis counter)
+        incremented every time lines are pushed
+
+The list is filled from the db on the first read and trimmed to the last
+CHAT_HISTORY_CACHE_LENGTH lines on every write.  New lines are only
+appended once their transaction commits, and only to lists that already
+exist.  A read skips the fill if the counter changed since before it read
+the db (a line it may have missed was pushed meanwhile, with nothing to
+append to), so a list always holds a contiguous tail of the committed chat.
+
+The species of a line (player, observer, dealer, staff) depends on who is
+seated when it's read, so it's added by render_chatline, not cached.
+"""
+import json
+
+from typing import List, Optional
+
+import redis
+
+from django.conf import settings
+from django.db import transaction
+
+from oddslingers.utils import to_json_str
+
+
+REDIS_CHAT_KEY = 'chat-history-{0}'
+REDIS_CHAT_GEN_KEY = 'chat-history-gen-{0}'
+CHAT_CACHE_TTL = 60 * 60 * 24               # drop the lines of idle chats
+
+redis_chat = redis.Redis(**settings.REDIS_CONF)
+
+
+def chatline_json(chatline) -> dict:
+    """the cached part of a ChatLine's json, see render_chatline"""
+    output = chatline.__json__()
+    user = output.pop('user')
+    output['is_staff'] = bool(user and user.is_staff)
+    return output
+
+
+def render_chatline(line: dict, accessor=None, tourney_entrants=None) -> dict:
+    output = {
+        key: val
+        for key, val in line.items()
+        if key != 'is_staff'
+    }
+    speaker = line['speaker']
+    is_player = accessor and speaker in (
+        p.username for p in accessor.seated_players()
+    )
+    is_entrant = tourney_entrants and speaker in tourney_entrants
+
+    if line['is_staff']:
+        species = 'staff'
+    elif is_player or is_entrant:
+        species = 'player'
+    elif speaker.lower() in ['dealer', 'winner_info']:
+        species = 'dealer'
+    else:
+        species = 'observer'
+
+    output['species'] = species
+    return output
+
+
+def cache_chatlines(chat_history_id, lines: List[dict]):
+    """append newly saved lines to the chat's cached tail, if it's cached"""
+    if not lines:
+        return
+    # a rolled back line must never reach the cache
+    transaction.on_commit(lambda: push_chatlines(chat_history_id, lines))
+
+
+def push_chatlines(chat_history_id, lines: List[dict]):
+    key = REDIS_CHAT_KEY.format(chat_history_id)
+    gen_key = REDIS_CHAT_GEN_KEY.format(chat_history_id)
+    pipe = redis_chat.pipeline()
+    pipe.incr(gen_key)
+    pipe.expire(gen_key, CHAT_CACHE_TTL)
+    for line in lines:
+        pipe.rpushx(key, to_json_str(line))
+    pipe.ltrim(key, -settings.CHAT_HISTORY_CACHE_LENGTH, -1)
+    pipe.expire(key, CHAT_CACHE_TTL)
+    pipe.execute()
+
+
+def recent_chatlines(chat_history) -> List[dict]:
+    """last CHAT_HISTORY_CACHE_LENGTH lines of a chat, oldest first"""
+    key = REDIS_CHAT_KEY.format(chat_history.id)
+    cached = redis_chat.lrange(key, 0, -1)
+    if cached:
+        return [json.loads(line) for line in cached]
+
+    generation = chat_generation(chat_history.id)
+    lines = [
+        chatline_json(chatline)
+        for chatline in chat_history.get_recent(
+            settings.CHAT_HISTORY_CACHE_LENGTH
+        )
+    ]
+    if lines:
+        fill_chatlines(chat_history.id, lines, generation)
+    return lines
+
+
+def chat_generation(chat_history_id) -> Optional[bytes]:
+    """the push counter of a chat, read before reading its lines from the db"""
+    return redis_chat.get(REDIS_CHAT_GEN_KEY.format(chat_history_id))
+
+
+def fill_chatlines(chat_history_id, lines: List[dict],
+                   generation: Optional[bytes]):
+    """
+    cache lines read from the db, unless lines were pushed since the
+    generation was read, or the list was filled meanwhile
+    """
+    key = REDIS_CHAT_KEY.format(chat_history_id)
+    gen_key = REDIS_CHAT_GEN_KEY.format(chat_history_id)
+    with redis_chat.pipeline() as pipe:
+        try:
+            pipe.watch(key, gen_key)
+            if pipe.exists(key) or pipe.get(gen_key) != generation:
+                return
+            pipe.multi()
+            pipe.rpush(key, *(to_json_str(line) for line in lines))
+            pipe.ltrim(key, -settings.CHAT_HISTORY_CACHE_LENGTH, -1)
+            pipe.expire(key, CHAT_CACHE_TTL)
+            pipe.execute()
+        except redis.WatchError:
+            pass
@@ -159,6 +159,12 @@ class AnimationEvent(StrBasedEnum):
             raise ValueError(f"No AnimationEvent for Event.{event.name}")
 
 
+# kind of subject of a HandHistoryEvent, stored with the event
+class SubjectKind(StrBasedEnum):
+    PLAYER = 1
+    TABLE = 2
+    SIDE_EFFECT = 3
+
 class PlayingState(StrBasedEnum):
     SITTING_IN = 1  # sitting into the game, ready to play
     SITTING_OUT = 2  # sitting out; inactive
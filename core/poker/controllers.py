@@ -10,12 +10,14 @@ from django.conf import settings
 from django.db import transaction
 
 from oddslingers.utils import (
-    autocast, rotated, get_next_filename, timezone, to_json_str,
+    autocast, get_next_filename, timezone, to_json_str,
     secure_random_number,
 )
 
 from sockets.models import Socket
 
+from banker.models import deferred_ledger_updates
+
 from poker import rankings
 from poker.accessors import PokerAccessor, accessor_type_for_table
 from poker.constants import (
@@ -25,10 +27,11 @@ from poker.constants import (
     HANDS_TO_INCREASE_BLINDS, SIDEBET_ACTIONS, VISIBLE_ACTIONS
 )
 from poker.handhistory import HandHistoryLog, DBLog, fmt_eventline
+from poker.dispatch_timing import DispatchTimer, NULL_TIMER, dispatch_timer
 from poker.megaphone import broadcast_to_sockets
 from poker.models import PokerTable, Player, ChangeList, Freezeout
 from poker.subscribers import (
-    Subscriber, NotificationSubscriber, ChatSubscriber,
+    Subscriber, SubscriberList, NotificationSubscriber, ChatSubscriber,
     LogSubscriber, AnimationSubscriber, BankerSubscriber,
     TableStatsSubscriber, TournamentResultsSubscriber,
     TournamentChatSubscriber, LevelSubscriber, AnalyticsEventSubscriber,
@@ -60,7 +63,10 @@ class GameController:
     # you must set these in the __init__ when you inherit from GameController
     accessor: PokerAccessor = None
     log: HandHistoryLog = None
-    subscribers: List[Subscriber] = None
+    _subscribers: SubscriberList = None
+
+    # per-phase timing of the dispatch in progress, see poker.dispatch_timing
+    timer: DispatchTimer = NULL_TIMER
 
     # this should be set statically (according to the controller type)
     #   to something from poker.constants
@@ -137,27 +143,46 @@ class GameController:
     def step(self, *args, **kwargs):
         raise NotImplementedError('step must be defined by a subclass.')
 
-    def dispatch(self, action_name: str, **kwargs) -> None:
+    def dispatch(self, action_name: str, queued_timestamp: float=None,
+                 **kwargs) -> None:
         # print('dispatching', action_name, 'args:', kwargs)
         self._start_dispatch_timestamp = timezone.now().timestamp()
         should_broadcast = False
         broadcast_only_to_player = None
 
-        if action_name.lower() in ('noop', 'latency_test'):
-            pass
-        elif action_name.lower() == 'join_table':
-            self.join_table(**kwargs)
-            should_broadcast = self.broadcast
-        elif '_sidebet' in action_name.lower():
-            should_broadcast = self.broadcast
-            self.sidebet_dispatch(action_name, **kwargs)
-        else:
-            should_broadcast = self.broadcast
-            plyr, public = self.player_dispatch(action_name, **kwargs)
-            broadcast_only_to_player = None if public else plyr
+        self.timer = dispatch_timer(self.accessor.table.id, action_name)
+        self.timer.add_queue_wait(queued_timestamp)
+        try:
+            # derived game state is cached until a dispatch changes it
+            with self.timer.measure(), self.accessor.memoizing():
+                if action_name.lower() in ('noop', 'latency_test'):
+                    pass
+                elif action_name.lower() == 'join_table':
+                    with self.timer.phase('join_table'):
+                        self.join_table(**kwargs)
+                    should_broadcast = self.broadcast
+                elif '_sidebet' in action_name.lower():
+                    should_broadcast = self.broadcast
+                    with self.timer.phase('sidebet_dispatch'):
+                        self.sidebet_dispatch(action_name, **kwargs)
+                else:
+                    should_broadcast = self.broadcast
+                    with self.timer.phase('player_dispatch'):
+                        plyr, public = self.player_dispatch(action_name,
+                                                            **kwargs)
+                    broadcast_only_to_player = None if public else plyr
 
-        self.step()
-        self.commit(should_broadcast, broadcast_only_to_player)
+                with self.timer.phase('step'):
+                    self.step()
+                self.commit(should_broadcast, broadcast_only_to_player)
+
+            try:
+                self.timer.save()
+            except Exception:
+                # the dispatch is already committed, timing is best-effort
+                logger.exception('Failed to save the dispatch timing')
+        finally:
+            self.timer = NULL_TIMER
 
         self._end_dispatch_timestamp = timezone.now().timestamp()
 
@@ -251,32 +276,37 @@ class GameController:
 
                 else:
                     assert isinstance(subj, (PokerTable, Player, Freezeout))  # for mypy
-                    changes = subj.dispatch(event, **kwargs)
+                    with self.timer.phase('dispatch.subject'):
+                        changes = subj.dispatch(event, **kwargs)
+                    if event in (Event.TAKE_SEAT, Event.LEAVE_SEAT):
+                        self.accessor.seat_changed(subj)
 
                 if self.verbose:
                     print(f"writef: @{subj} [{event}] {kwargs}")
                     self.accessor.describe()
 
-                # TODO: remove BadgeSubscriber dependency on LogSubscriber
-                #   and then remove this check
-                logsub_first = False
-                for sub in self.subscribers:
-                    if isinstance(sub, LogSubscriber):
-                        logsub_first = True
-                    elif isinstance(sub, BadgeSubscriber) and not logsub_first:
-                        msg = 'Cannot dispatch to BadgeSubscriber before '\
-                              'LogSubscriber because of BadgeSubscriber '\
-                              'dependency on the HandHistoryLog.'
-                        raise Exception(msg)
-                    sub.dispatch(subj, event, changes=changes, **kwargs)
+                for sub in self.subscribers.for_event(subj, event):
+                    with self.timer.phase(f'dispatch.{type(sub).__name__}'):
+                        sub.dispatch(subj, event, changes=changes, **kwargs)
 
             except Exception as err:
                 msg = f'{err} at dispatch with: @{subj}: [{event}] {kwargs}'
                 raise type(err)(msg).with_traceback(err.__traceback__)
 
+    @property
+    def subscribers(self) -> SubscriberList:
+        return self._subscribers
+
+    @subscribers.setter
+    def subscribers(self, subscribers: List[Subscriber]):
+        # builds the event routing table and checks the subscriber order
+        self._subscribers = SubscriberList(subscribers or ())
+
     def commit(self, broadcast=True, broadcast_only_to_player=None) -> None:
-        with transaction.atomic():
-            self.accessor.commit()
+        with self.timer.phase('commit'), transaction.atomic(), \
+                deferred_ledger_updates():
+            with self.timer.phase('commit.accessor'):
+                self.accessor.commit()
 
             for sub in self.subscribers:
                 if isinstance(sub, LogSubscriber):
@@ -284,12 +314,15 @@ class GameController:
                         'if the sub.log and self.log are different, '\
                         'then events and actions are being logged to '\
                         'different places (and only events are saved)'
-                sub.commit()
+                with self.timer.phase(f'commit.{type(sub).__name__}'):
+                    sub.commit()
 
         if broadcast:
-            broadcast_to_sockets(self.accessor,
-                                self.subscribers,
-                                broadcast_only_to_player)
+            with self.timer.phase('broadcast'):
+                broadcast_to_sockets(self.accessor,
+                                    self.subscribers,
+                                    broadcast_only_to_player,
+                                    timer=self.timer)
 
 
 class HoldemController(GameController):
@@ -1430,7 +1463,12 @@ class HoldemController(GameController):
         }
 
     def positions_from_locked_btn(self, btn_idx):
-        actives = self.accessor.players_who_can_play()
+        acc = self.accessor
+        # players who can play, going around the table from the btn
+        actives = [
+            plyr for _, plyr in acc.seats_from(btn_idx)
+            if plyr and acc.can_play(plyr)
+        ]
         if len(actives) == 1:
             # if settings.DEBUG:
             # import ipdb; ipdb.set_trace()
@@ -1439,9 +1477,7 @@ class HoldemController(GameController):
                 'got active_players=1'
             )
 
-        actives = self.accessor.players_who_can_play()
-
-        assert len([p for p in actives if p.position == btn_idx]) == 1, \
+        assert actives and actives[0].position == btn_idx, \
                 'Sanity check fail: no player sitting at the locked '\
                 'button position. Hint: this could happen if '\
                 'lock_btn_to_active_player() is called, then that '\
@@ -1451,21 +1487,13 @@ class HoldemController(GameController):
                 'a game might start?'
 
         if len(actives) == 2:
-            other_position = [
-                p.position for p in actives
-                if p.position != btn_idx
-            ].pop()
-
             return {
                 'btn_pos': btn_idx,
                 'sb_pos': btn_idx,
-                'bb_pos': other_position
+                'bb_pos': actives[1].position
             }
 
         else:
-            btn_player = [p for p in actives if p.position == btn_idx].pop()
-            actives = list(rotated(actives, actives.index(btn_player)))
-
             return {
                 'btn_pos': btn_idx,
                 'sb_pos': actives[1].position,
@@ -0,0 +1,238 @@
+"""
+Per-phase timing and SQL query counts for GameController.dispatch.
+
+Every dispatch is split up into phases (queue wait, player_dispatch, each
+subscriber's dispatch & commit, accessor commit, broadcast, etc.).  The
+wall time and the number of SQL queries run during each phase are added to
+a histogram in redis, per table and for all tables together:
+
+    dispatch-timing-<table_id | all>  (redis hash)
+        <phase>:count       number of dispatches that ran the phase
+        <phase>:sum_ms      total time spent in the phase
+        <phase>:queries     total SQL queries run during the phase
+        <phase>:le_<ms>     number of dispatches where it took <= ms
+
+Phases nest (e.g. internal_dispatch runs inside player_dispatch), the time
+and queries of a phase include those of the phases nested inside it.
+
+Only DISPATCH_TIMING_SAMPLE_RATE of the dispatches are measured, so the
+counts are a sample of all dispatches (means and percentiles are unaffected).
+
+The histograms of a table expire once it hasn't dispatched for
+TABLE_TIMING_TTL, the one for all tables is kept until it's reset.
+
+./manage.py dispatch_timing <table_id> to look at the results.
+"""
+from time import perf_counter, time
+from random import random
+from threading import local
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import redis
+
+from django.conf import settings
+from django.db import connection
+
+
+REDIS_TIMING_KEY = 'dispatch-timing-{0}'
+ALL_TABLES = 'all'
+TABLE_TIMING_TTL = 60 * 60 * 24 * 7         # drop the histograms of idle tables
+
+# upper bound (in ms) of each histogram bucket, the last one is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 'inf')
+
+redis_timing = redis.Redis(**settings.REDIS_CONF)
+
+# the timer of the dispatch running in this thread, see current_timer()
+_active = local()
+
+
+def bucket_for(ms: float):
+    for bucket in BUCKETS_MS[:-1]:
+        if ms <= bucket:
+            return bucket
+    return BUCKETS_MS[-1]
+
+
+class QueryCounter:
+    """django db execute_wrapper that counts all the queries it sees"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class DispatchTimer:
+    """Collects the time and query count of each phase of one dispatch"""
+
+    def __init__(self, table_id=None, action_name: str=None,
+                 enabled: bool=True):
+        self.table_id = table_id
+        self.action_name = action_name
+        self.enabled = enabled
+        self.queries = QueryCounter()
+        # phase_name: [seconds, queries]
+        self.phases = OrderedDict()
+
+    @contextmanager
+    def measure(self):
+        """count queries for the lifetime of the dispatch"""
+        if not self.enabled:
+            yield self
+            return
+
+        previous = getattr(_active, 'timer', None)
+        _active.timer = self
+        try:
+            with connection.execute_wrapper(self.queries):
+                with self.phase('total'):
+                    yield self
+        finally:
+            _active.timer = previous
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        start_time = perf_counter()
+        start_queries = self.queries.count
+        try:
+            yield
+        finally:
+            self.add(name,
+                     perf_counter() - start_time,
+                     self.queries.count - start_queries)
+
+    def add(self, name: str, seconds: float, queries: int=0):
+        if not self.enabled:
+            return
+        totals = self.phases.setdefault(name, [0, 0])
+        totals[0] += seconds
+        totals[1] += queries
+
+    def add_queue_wait(self, queued_timestamp: float=None):
+        """time between a message being queued and it being dispatched"""
+        if queued_timestamp:
+            self.add('queue_wait', max(time() - queued_timestamp, 0))
+
+    def summary(self) -> dict:
+        return {
+            name: {'ms': round(seconds * 1000, 3), 'queries': queries}
+            for name, (seconds, queries) in self.phases.items()
+        }
+
+    def save(self):
+        """add the timings of this dispatch to the redis histograms"""
+        if not (self.enabled and self.phases):
+            return
+
+        keys = [REDIS_TIMING_KEY.format(ALL_TABLES)]
+        if self.table_id:
+            keys.append(REDIS_TIMING_KEY.format(self.table_id))
+
+        pipe = redis_timing.pipeline(transaction=False)
+        for key in keys:
+            for name, (seconds, queries) in self.phases.items():
+                ms = seconds * 1000
+                pipe.hincrby(key, f'{name}:count', 1)
+                pipe.hincrbyfloat(key, f'{name}:sum_ms', ms)
+                pipe.hincrby(key, f'{name}:queries', queries)
+                pipe.hincrby(key, f'{name}:le_{bucket_for(ms)}', 1)
+        if self.table_id:
+            pipe.expire(REDIS_TIMING_KEY.format(self.table_id),
+                        TABLE_TIMING_TTL)
+        pipe.execute()
+
+
+# used outside of GameController.dispatch, so nothing is measured or saved
+NULL_TIMER = DispatchTimer(enabled=False)
+
+
+def current_timer() -> DispatchTimer:
+    """
+    the timer of the dispatch being measured in this thread (if any), for
+    code that isn't passed the controller's timer (e.g. execute_mutations)
+    """
+    return getattr(_active, 'timer', None) or NULL_TIMER
+
+
+def dispatch_timer(table_id, action_name: str) -> DispatchTimer:
+    if not settings.DISPATCH_TIMING_ENABLED:
+        return NULL_TIMER
+    if random() >= settings.DISPATCH_TIMING_SAMPLE_RATE:
+        return NULL_TIMER
+    return DispatchTimer(table_id, action_name)
+
+
+def _percentile_from_buckets(buckets: dict, count: int, percent: int):
+    """upper bound of the bucket that contains the given percentile"""
+    target = count * percent / 100
+    seen = 0
+    for bucket in BUCKETS_MS:
+        seen += buckets.get(bucket, 0)
+        if seen >= target:
+            return bucket
+    return BUCKETS_MS[-1]
+
+
+def dispatch_timing_histograms(table_id=None) -> dict:
+    """
+    get the timing histograms for a table (or all tables), e.g.:
+    {
+        'player_dispatch': {
+            'count': 120,
+            'mean_ms': 14.2,
+            'total_ms': 1704.0,
+            'queries_per_call': 9.5,
+            'p50_ms': 25,
+            'p90_ms': 50,
+            'p99_ms': 100,
+            'buckets': {1: 0, 2: 0, 5: 3, ...},
+        },
+        ...
+    }
+    """
+    key = REDIS_TIMING_KEY.format(table_id or ALL_TABLES)
+    raw = {
+        field.decode(): float(val)
+        for field, val in redis_timing.hgetall(key).items()
+    }
+
+    phases = OrderedDict()
+    for field in sorted(raw.keys()):
+        phase = field.rsplit(':', 1)[0]
+        phases.setdefault(phase, None)
+
+    histograms = {}
+    for phase in phases.keys():
+        count = int(raw.get(f'{phase}:count', 0))
+        if not count:
+            continue
+        total_ms = raw.get(f'{phase}:sum_ms', 0)
+        buckets = {
+            bucket: int(raw.get(f'{phase}:le_{bucket}', 0))
+            for bucket in BUCKETS_MS
+        }
+        histograms[phase] = {
+            'count': count,
+            'mean_ms': round(total_ms / count, 3),
+            'total_ms': round(total_ms, 3),
+            'queries_per_call': round(
+                raw.get(f'{phase}:queries', 0) / count, 2
+            ),
+            'p50_ms': _percentile_from_buckets(buckets, count, 50),
+            'p90_ms': _percentile_from_buckets(buckets, count, 90),
+            'p99_ms': _percentile_from_buckets(buckets, count, 99),
+            'buckets': buckets,
+        }
+    return histograms
+
+
+def reset_dispatch_timing(table_id=None):
+    redis_timing.delete(REDIS_TIMING_KEY.format(table_id or ALL_TABLES))
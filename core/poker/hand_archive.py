@@ -0,0 +1,180 @@
+"""
+Monthly archives of old hand histories, kept outside of the database.
+
+Finished hands older than HAND_ARCHIVE_AFTER_DAYS are moved out of the
+HandHistory table by the archive_hand_history command, into one gzipped
+file per table per month:
+
+    HAND_ARCHIVE_DIR/<YYYY-MM>/<table_id>.jsonl.gz
+        {"ts": ..., "table": {"hand_number": 12, ...}, "players": [...],
+         "events": [...], "actions": [...]}             (one hand per line)
+
+Every file is indexed by an ArchivedHandHistory row with the range of hand
+numbers and timestamps it holds, so readers only open the months they ask
+for.  Later runs append another gzip member to the month's file, runs
+hold a lock on the month while they write it, so concurrent runs don't
+archive (and count) the same hands twice.  A hand is only deleted from
+the db after it was written to its file, if a run dies in between the
+hand is archived again and read back once.
+
+DBLog.get_log merges archived hands in with the ones still in the db, so
+replayers, the table debugger and support ticket artifacts still see the
+full history of a table.
+"""
+import os
+import gzip
+import json
+
+from datetime import date, datetime
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from oddslingers.utils import to_json_str
+
+from poker.models import HandHistory, ArchivedHandHistory
+from poker.hand_encoding import lines_between
+from poker.outbox import compact_hands
+
+
+ARCHIVE_FILE = '{month:%Y-%m}/{table_id}.jsonl.gz'
+
+
+def month_of(timestamp: datetime) -> date:
+    return timestamp.date().replace(day=1)
+
+
+def archive_path(path: str) -> str:
+    return os.path.join(settings.HAND_ARCHIVE_DIR, path)
+
+
+### Writing
+
+def append_to_archive(path: str, hands: List[dict]):
+    full_path = archive_path(path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'ab') as archive:
+        archive.write(gzip.compress(''.join(
+            to_json_str(hand) + '\n'
+            for hand in hands
+        ).encode()))
+        archive.flush()
+        os.fsync(archive.fileno())
+
+
+def lock_month(path: str):
+    """block other archive runs from writing the same month's file"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [path])
+
+
+def update_index(table_id, month: date, path: str, hands: List[HandHistory]):
+    hand_numbers = [hand.hand_number for hand in hands]
+    timestamps = [hand.timestamp for hand in hands]
+
+    index, created = ArchivedHandHistory.objects\
+                                        .select_for_update()\
+                                        .get_or_create(
+                                            table_id=table_id,
+                                            month=month,
+                                            defaults={
+                                                'path': path,
+                                                'first_hand': min(hand_numbers),
+                                                'last_hand': max(hand_numbers),
+                                                'first_ts': min(timestamps),
+                                                'last_ts': max(timestamps),
+                                                'num_hands': len(hands),
+                                            },
+                                        )
+    if not created:
+        index.first_hand = min(index.first_hand, *hand_numbers)
+        index.last_hand = max(index.last_hand, *hand_numbers)
+        index.first_ts = min(index.first_ts, *timestamps)
+        index.last_ts = max(index.last_ts, *timestamps)
+        index.num_hands += len(hands)
+        index.save()
+
+
+def archive_hands(hand_ids) -> int:
+    """move finished hands from the db to their monthly archive files"""
+    compact_hands(hand_ids)
+
+    by_file: Dict[Tuple, List] = defaultdict(list)
+    for hand_id, table_id, timestamp in HandHistory.objects\
+                                                   .filter(id__in=hand_ids)\
+                                                   .values_list('id',
+                                                                'table_id',
+                                                                'timestamp'):
+        by_file[(table_id, month_of(timestamp))].append(hand_id)
+
+    archived = 0
+    for (table_id, month), month_hand_ids in by_file.items():
+        path = ARCHIVE_FILE.format(month=month, table_id=table_id)
+        with transaction.atomic():
+            lock_month(path)
+            # hands archived by another run while we waited are gone
+            hands = list(HandHistory.objects
+                                    .filter(id__in=month_hand_ids)
+                                    .order_by('hand_number'))
+            if not hands:
+                continue
+            append_to_archive(path, [hand.filtered_json() for hand in hands])
+            update_index(table_id, month, path, hands)
+            HandHistory.objects\
+                       .filter(id__in=[hand.id for hand in hands])\
+                       .delete()
+        archived += len(hands)
+
+    return archived
+
+
+### Reading
+
+def read_archive(path: str) -> Iterator[dict]:
+    with gzip.open(archive_path(path), 'rt') as archive:
+        for line in archive:
+            if line.strip():
+                yield json.loads(line)
+
+
+def archived_hands(table_id, hand_gte=None, hand_lt=None,
+                   ts_gte=None, ts_lt=None) -> Iterator[dict]:
+    """
+    archived hands of a table in the format of get_log, oldest first,
+    read one line at a time
+    """
+    indexes = ArchivedHandHistory.objects.filter(table_id=table_id)
+    if hand_gte:
+        indexes = indexes.filter(last_hand__gte=hand_gte)
+    if hand_lt:
+        indexes = indexes.filter(first_hand__lt=hand_lt)
+    if ts_gte:
+        indexes = indexes.filter(last_ts__gte=ts_gte)
+    if ts_lt:
+        indexes = indexes.filter(first_ts__lt=ts_lt)
+
+    in_range = lambda hand: (
+        ((not hand_gte) or hand['table']['hand_number'] >= hand_gte)
+        and ((not hand_lt) or hand['table']['hand_number'] < hand_lt)
+        and ((not ts_gte) or parse_datetime(hand['ts']) >= ts_gte)
+        and ((not ts_lt) or parse_datetime(hand['ts']) < ts_lt)
+    )
+
+    # each run appends newer hands than the last one, so a file is in
+    #   hand number order apart from hands that were archived twice
+    for path in list(indexes.order_by('month')
+                            .values_list('path', flat=True)):
+        seen = set()
+        for hand in read_archive(path):
+            hand_number = hand['table']['hand_number']
+            if hand_number in seen or not in_range(hand):
+                continue
+            seen.add(hand_number)
+            yield {
+                **hand,
+                'events': lines_between(hand['events'], ts_gte, ts_lt),
+                'actions': lines_between(hand['actions'], ts_gte, ts_lt),
+            }
@@ -0,0 +1,295 @@
+"""
+Compact binary encoding of the events & actions of a finished hand.
+
+While a hand is being played every event and action is its own
+HandHistoryEvent / HandHistoryAction row.  Once the hand is over it never
+changes again, so its rows are encoded into HandHistory.compressed_log and
+deleted (see poker.outbox.compact_hand_histories):
+
+    zlib(
+        VERSION
+        strings:  n, (len, utf8)...         subject names, arg keys, cards...
+        events:   n, (subj, code, ts, args)...
+        actions:  n, (subj, code, ts, args)...
+    )
+
+    subj        index into the strings table
+    code        Event / Action value, or 0 + string index for unknown names
+    ts, args    tagged values, see VALUE_TAGS
+
+All integers are varints, signed ones are zigzag encoded.  Timestamps are
+stored as millisecond deltas from the previous timestamp and amounts like
+"12.50" as scaled integers.  Anything that wouldn't round-trip to the exact
+same json (strings that only look like numbers or timestamps) is stored as
+a plain string, so decode_hand(encode_hand(hand)) == hand.
+"""
+import re
+import zlib
+import struct
+
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Tuple
+
+import pytz
+
+from django.utils.dateparse import parse_datetime
+
+from oddslingers.utils import ExtendedEncoder
+
+from poker.constants import Event, Action
+
+
+VERSION = 1
+
+# value tags
+NULL, TRUE, FALSE, INT, FLOAT, STR, AMOUNT, LIST, DICT, TIMESTAMP = range(10)
+
+AMOUNT_RE = re.compile(r'^-?\d+\.\d+$')
+TIMESTAMP_RE = re.compile(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d{3})?Z$')
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+### Varints
+
+def write_varint(out: bytearray, value: int):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def write_signed(out: bytearray, value: int):
+    write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def varint(self) -> int:
+        value, shift = 0, 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def signed(self) -> int:
+        value = self.varint()
+        return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+    def read(self, length: int) -> bytes:
+        chunk = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return chunk
+
+
+### Encoding
+
+def as_amount(value: str):
+    """(unscaled, places) if value is a decimal string that round-trips"""
+    if not AMOUNT_RE.match(value):
+        return None
+    try:
+        sign, digits, exponent = Decimal(value).as_tuple()
+    except InvalidOperation:
+        return None
+    unscaled = int(''.join(map(str, digits)))
+    amount = (-unscaled if sign else unscaled, -exponent)
+    return amount if format_amount(*amount) == value else None
+
+
+def format_amount(unscaled: int, places: int) -> str:
+    return str(Decimal(unscaled).scaleb(-places))
+
+
+def as_millis(value: str):
+    if not TIMESTAMP_RE.match(value):
+        return None
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        return None
+    millis = (timestamp - EPOCH) // MILLISECOND
+    return millis if format_timestamp(millis) == value else None
+
+
+def format_timestamp(millis: int) -> str:
+    return ExtendedEncoder.convert_for_json(EPOCH + millis * MILLISECOND)
+
+
+class Encoder:
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.out = bytearray()
+        self.last_ts = 0
+
+    def intern(self, string: str) -> int:
+        if string not in self.strings:
+            self.strings[string] = len(self.strings)
+        return self.strings[string]
+
+    def value(self, value):
+        out = self.out
+        if value is None:
+            out.append(NULL)
+        elif value is True:
+            out.append(TRUE)
+        elif value is False:
+            out.append(FALSE)
+        elif isinstance(value, int):
+            out.append(INT)
+            write_signed(out, value)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += struct.pack('>d', value)
+        elif isinstance(value, str):
+            self.string(value)
+        elif isinstance(value, (list, tuple)):
+            out.append(LIST)
+            write_varint(out, len(value))
+            for item in value:
+                self.value(item)
+        elif isinstance(value, dict):
+            out.append(DICT)
+            write_varint(out, len(value))
+            for key, item in value.items():
+                write_varint(out, self.intern(key))
+                self.value(item)
+        else:
+            raise TypeError(f'Cannot encode {value!r} in a hand history')
+
+    def string(self, value: str):
+        out = self.out
+        amount = as_amount(value)
+        if amount is not None:
+            out.append(AMOUNT)
+            write_signed(out, amount[0])
+            write_varint(out, amount[1])
+            return
+
+        millis = as_millis(value)
+        if millis is not None:
+            out.append(TIMESTAMP)
+            write_signed(out, millis - self.last_ts)
+            self.last_ts = millis
+            return
+
+        out.append(STR)
+        write_varint(out, self.intern(value))
+
+    def line(self, line: dict, kind: str, codes):
+        write_varint(self.out, self.intern(line['subj']))
+        name = line[kind]
+        if name in codes.__members__:
+            write_varint(self.out, codes[name].value)
+        else:
+            write_varint(self.out, 0)
+            write_varint(self.out, self.intern(name))
+        self.value(line['ts'])
+        self.value(line['args'])
+
+    def lines(self, lines: List[dict], kind: str, codes):
+        write_varint(self.out, len(lines))
+        for line in lines:
+            self.line(line, kind, codes)
+
+    def finish(self) -> bytes:
+        header = bytearray([VERSION])
+        write_varint(header, len(self.strings))
+        for string in self.strings:
+            encoded = string.encode()
+            write_varint(header, len(encoded))
+            header += encoded
+        return zlib.compress(bytes(header + self.out))
+
+
+def encode_hand(events: List[dict], actions: List[dict]) -> bytes:
+    """events & actions in the format of HandHistoryEvent.__json__()"""
+    encoder = Encoder()
+    encoder.lines(events, 'event', Event)
+    encoder.lines(actions, 'action', Action)
+    return encoder.finish()
+
+
+### Decoding
+
+class Decoder(Reader):
+    def __init__(self, data: bytes):
+        super().__init__(zlib.decompress(data))
+        version = self.varint()
+        if version != VERSION:
+            raise ValueError(f'Unknown hand history encoding: {version}')
+        self.strings = [
+            self.read(self.varint()).decode()
+            for _ in range(self.varint())
+        ]
+        self.last_ts = 0
+
+    def value(self):
+        tag = self.varint()
+        if tag == NULL:
+            return None
+        elif tag == TRUE:
+            return True
+        elif tag == FALSE:
+            return False
+        elif tag == INT:
+            return self.signed()
+        elif tag == FLOAT:
+            return struct.unpack('>d', self.read(8))[0]
+        elif tag == STR:
+            return self.strings[self.varint()]
+        elif tag == AMOUNT:
+            unscaled = self.signed()
+            return format_amount(unscaled, self.varint())
+        elif tag == TIMESTAMP:
+            self.last_ts += self.signed()
+            return format_timestamp(self.last_ts)
+        elif tag == LIST:
+            return [self.value() for _ in range(self.varint())]
+        elif tag == DICT:
+            return {
+                self.strings[self.varint()]: self.value()
+                for _ in range(self.varint())
+            }
+        raise ValueError(f'Unknown value tag in hand history: {tag}')
+
+    def lines(self, kind: str, codes) -> List[dict]:
+        lines = []
+        for _ in range(self.varint()):
+            subj = self.strings[self.varint()]
+            code = self.varint()
+            name = codes(code).name if code else self.strings[self.varint()]
+            ts = self.value()
+            lines.append({
+                'ts': ts,
+                'subj': subj,
+                kind: name,
+                'args': self.value(),
+            })
+        return lines
+
+
+def decode_hand(data: bytes) -> Tuple[List[dict], List[dict]]:
+    """(events, actions) of an encoded hand, see encode_hand"""
+    decoder = Decoder(bytes(data))
+    events = decoder.lines('event', Event)
+    actions = decoder.lines('action', Action)
+    return events, actions
+
+
+def lines_between(lines: List[dict], ts_gte: datetime=None,
+                  ts_lt: datetime=None) -> List[dict]:
+    """decoded lines with ts_gte <= ts < ts_lt"""
+    if not (ts_gte or ts_lt):
+        return lines
+    return [
+        line for line in lines
+        if (not ts_gte or parse_datetime(line['ts']) >= ts_gte)
+            and (not ts_lt or parse_datetime(line['ts']) < ts_lt)
+    ]
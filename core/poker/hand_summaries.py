@@ -0,0 +1,109 @@
+"""
+Rendered GET_HANDHISTORY summaries of finished hands, cached in redis.
+
+A finished hand never changes, so its summary is rendered once, when the
+outbox compacts the hand (see poker.outbox.compact_hands), and kept in a
+sorted set per table, scored by hand number:
+
+    hand-summaries-<table_id>  (redis sorted set)
+        zlib({"hand_number": 12, "summary": {...}})  score 12
+
+DBLog.frontend_log serves finished hands from the set and only falls back
+to rendering from the db for hands that aren't cached yet (filling them in
+as it goes) and for the hand in progress.  Hand numbers that have no
+HandHistory are cached with a null summary, so they aren't queried again
+on every request.  Each table keeps its last HAND_SUMMARIES_CACHE_LENGTH
+hands, and the set of a table nobody has asked about for a day expires.
+
+Summaries only render chat, player actions and wins, never the DEAL lines
+that filter_cards hides from other players, so every viewer of a hand gets
+the same summary and one copy per hand is enough.
+"""
+import json
+import zlib
+
+from typing import Dict
+
+import redis
+
+from django.conf import settings
+
+from oddslingers.utils import to_json_str
+
+REDIS_SUMMARIES_KEY = 'hand-summaries-{0}'
+SUMMARIES_CACHE_TTL = 60 * 60 * 24          # drop the summaries of idle tables
+
+redis_summaries = redis.Redis(**settings.REDIS_CONF)
+
+
+def hand_summary(hand: dict) -> dict:
+    """hand history summary shown in the frontend, from a get_log hand"""
+    table = hand['table']
+    output = {
+        'title': 'Summary for hand #{hand_number} at table "{name}"'
+                 .format(**table),
+        'table_info': '({sb}/{bb} {num_seats}-max {table_type})'
+                      .format(**table),
+        'history': []
+
+    }
+    for event_line in hand['events']:
+        event = event_line['event']
+        subj = event_line['subj']
+        args = event_line['args']
+
+        if event == 'CHAT':
+            if args['msg'] != '====NEW HAND====':
+                output['history'].append(args['msg'])
+        elif event in ('FOLD', 'CHECK', 'CALL'):
+            output['history'].append(f'{subj} {event.lower()}ed')
+        elif event in ('BET', 'ANTE'):
+            if event == 'BET':
+                past_tense = 'bet'
+            elif event == 'ANTE':
+                past_tense = 'anted'
+            msg = f'{subj} {past_tense} {args["amt"]} chips'
+            output['history'].append(msg)
+        elif event == 'RAISE_TO':
+            msg = f'{subj} raised to {args["amt"]} chips'
+            output['history'].append(msg)
+        # elif event == 'UPDATE_STACK':
+        #     output['history'].append(f'{subj} added {args["amt"]} chips')
+
+    return output
+
+
+def cache_summaries(table_id, summaries: Dict[int, dict]):
+    """
+    store the summaries of finished hands, {hand_number: summary}, where
+    the summary is None for hands that have no HandHistory
+    """
+    if not summaries:
+        return
+    key = REDIS_SUMMARIES_KEY.format(table_id)
+    pipe = redis_summaries.pipeline()
+    for hand_number, summary in summaries.items():
+        packed = zlib.compress(to_json_str({
+            'hand_number': hand_number,
+            'summary': summary,
+        }).encode())
+        pipe.zremrangebyscore(key, hand_number, hand_number)
+        pipe.zadd(key, packed, hand_number)
+    # keep the newest HAND_SUMMARIES_CACHE_LENGTH hands
+    pipe.zremrangebyrank(key, 0, -settings.HAND_SUMMARIES_CACHE_LENGTH - 1)
+    pipe.expire(key, SUMMARIES_CACHE_TTL)
+    pipe.execute()
+
+
+def cached_summaries(table_id, hand_gte: int, hand_lt: int) -> Dict[int, dict]:
+    """cached summaries of the hands with hand_gte <= hand_number < hand_lt"""
+    if hand_lt <= hand_gte:
+        return {}
+    key = REDIS_SUMMARIES_KEY.format(table_id)
+    pipe = redis_summaries.pipeline()
+    pipe.zrangebyscore(key, hand_gte, f'({hand_lt}')
+    pipe.expire(key, SUMMARIES_CACHE_TTL)
+    packed, _ = pipe.execute()
+
+    hands = (json.loads(zlib.decompress(item)) for item in packed)
+    return {hand['hand_number']: hand['summary'] for hand in hands}
@@ -1,3 +1,5 @@
+import gzip
+
 from operator import itemgetter
 from collections import defaultdict, OrderedDict
 
@@ -10,6 +12,14 @@ from poker.constants import (Event, TABLE_SUBJECT_REPR, SIDE_EFFECT_SUBJ,
                              PLAYER_API)
 from poker.models import (Player, PokerTable, HandHistory, HandHistoryEvent,
                           HandHistoryAction, SideEffectSubject)
+from poker.outbox import outbox_event, queue_outbox_events
+from poker.hand_archive import archived_hands
+from poker.hand_encoding import lines_between
+from poker.hand_summaries import (hand_summary, cache_summaries,
+                                  cached_summaries)
+
+# saved hands are fetched this many at a time when streaming a log to a file
+HANDS_PER_QUERY = 100
 
 # important assumptions made by the JSON and DBLogs:
 #   - The END_HAND event will be called once per hand, and everything
@@ -51,6 +61,11 @@ class HandHistoryLog:
                'representation of the log'
         raise NotImplementedError(desc)
 
+    def iter_hands(self, player=None, hand_gte=None, hand_lt=None,
+                   ts_gte=None, ts_lt=None, current_hand_only=False):
+        desc = 'Should yield the hands of get_log one at a time'
+        raise NotImplementedError(desc)
+
     def current_hand_log(self, player=None, notes=None):
         desc = 'Should return the same as '\
                'get_log(hand_gte=self.current_hand.hand_number)'
@@ -65,7 +80,8 @@ class HandHistoryLog:
     def save_to_file(self, filename, player=None, notes=None,
                             hand_gte=None, hand_lt=None,
                             ts_gte=None, ts_lt=None,
-                            current_hand_only=False, indent=False):
+                            current_hand_only=False, indent=False,
+                            gzipped=None):
         raise NotImplementedError('Should save a json-serialized log to file')
 
     def frontend_log(player, hand_gte, hand_lt):
@@ -136,39 +152,7 @@ class HandHistoryLog:
 
     @staticmethod
     def hand_history_to_frontend_dict(hand):
-        table = hand['table']
-        output = {
-            'title': 'Summary for hand #{hand_number} at table "{name}"'
-                     .format(**table),
-            'table_info': '({sb}/{bb} {num_seats}-max {table_type})'
-                          .format(**table),
-            'history': []
-
-        }
-        for event_line in hand['events']:
-            event = event_line['event']
-            subj = event_line['subj']
-            args = event_line['args']
-
-            if event == 'CHAT':
-                if args['msg'] != '====NEW HAND====':
-                    output['history'].append(args['msg'])
-            elif event in ('FOLD', 'CHECK', 'CALL'):
-                output['history'].append(f'{subj} {event.lower()}ed')
-            elif event in ('BET', 'ANTE'):
-                if event == 'BET':
-                    past_tense = 'bet'
-                elif event == 'ANTE':
-                    past_tense = 'anted'
-                msg = f'{subj} {past_tense} {args["amt"]} chips'
-                output['history'].append(msg)
-            elif event == 'RAISE_TO':
-                msg = f'{subj} raised to {args["amt"]} chips'
-                output['history'].append(msg)
-            # elif event == 'UPDATE_STACK':
-            #     output['history'].append(f'{subj} added {args["amt"]} chips')
-
-        return output
+        return hand_summary(hand)
 
 
 class MultiLog(HandHistoryLog):
@@ -198,10 +182,15 @@ class MultiLog(HandHistoryLog):
                             current_hand_only=False, stringify=True):
         raise NotImplementedError('Call readable_log on a child log.')
 
+    def iter_hands(self, player=None, hand_gte=None, hand_lt=None,
+                   ts_gte=None, ts_lt=None, current_hand_only=False):
+        raise NotImplementedError('Call iter_hands on a child log.')
+
     def save_to_file(self, filename, player=None, notes=None,
                             hand_gte=None, hand_lt=None,
                             ts_gte=None, ts_lt=None,
-                            current_hand_only=False, indent=False):
+                            current_hand_only=False, indent=False,
+                            gzipped=None):
         raise NotImplementedError('Call save_to_file on a child log.')
 
     def commit(self):
@@ -332,6 +321,16 @@ class JSONLog(HandHistoryLog):
             if tsf_gte(hh) and tsf_lt(hh) and hf_gte(hh) and hf_lt(hh)
         ]
 
+    def iter_hands(self, player=None, hand_gte=None, hand_lt=None,
+                   ts_gte=None, ts_lt=None, current_hand_only=False):
+        if current_hand_only:
+            hands = [self.current_hand()] if self.hands else []
+        else:
+            hands = self._filter_hands(self.hands, hand_gte, hand_lt,
+                                       ts_gte, ts_lt)
+        for hh in hands:
+            yield self._convert_hand(hh, player)
+
     def get_log(self, player=None, notes=None, hand_gte=None, hand_lt=None,
                       ts_gte=None, ts_lt=None, current_hand_only=False):
         if current_hand_only:
@@ -339,19 +338,14 @@ class JSONLog(HandHistoryLog):
 
         return {
             **self._log_metadata(notes),
-            'hands': [
-                self._convert_hand(hh, player)
-                for hh in self._filter_hands(self.hands, hand_gte, hand_lt,
-                                             ts_gte, ts_lt)
-            ]
+            'hands': list(self.iter_hands(player, hand_gte, hand_lt,
+                                          ts_gte, ts_lt)),
         }
 
     def current_hand_log(self, player=None, notes=None):
         return {
             **self._log_metadata(notes),
-            'hands': [
-                self._convert_hand(self.current_hand(), player)
-            ] if self.hands else [],
+            'hands': list(self.iter_hands(player, current_hand_only=True)),
         }
 
     def describe(self, for_player=None,
@@ -378,16 +372,25 @@ class JSONLog(HandHistoryLog):
 
     def save_to_file(self, filename, player='all', notes=None, hand_gte=None,
                      hand_lt=None, ts_gte=None, current_hand_only=False,
-                     indent=False):
+                     indent=False, gzipped=None):
+        """
+        Write the log one hand at a time, so saving the full history of a
+        table doesn't build it in memory first.  Files ending in .gz are
+        gzipped unless gzipped=False.
+        """
         if current_hand_only:
-            log = self.current_hand_log(player=player, notes=notes)
+            hands = self.iter_hands(player=player, current_hand_only=True)
         else:
-            log = self.get_log(player=player, notes=notes, hand_gte=hand_gte,
-                               hand_lt=hand_lt, ts_gte=ts_gte)
+            hands = self.iter_hands(player=player, hand_gte=hand_gte,
+                                    hand_lt=hand_lt, ts_gte=ts_gte)
+
+        if gzipped is None:
+            gzipped = filename.endswith('.gz')
+        open_file = gzip.open if gzipped else open
 
-        # import ipdb; ipdb.set_trace()
-        with open(filename, 'w') as f:
-            f.write(to_json_str(log, indent=4 if indent else 0))
+        with open_file(filename, 'wt') as f:
+            write_log(f, self._log_metadata(notes), hands,
+                      indent=4 if indent else 0)
 
     def frontend_log(self, player, hand_gte, hand_lt):
         log = self.get_log(player=player, hand_gte=hand_gte, hand_lt=hand_lt)
@@ -408,6 +411,10 @@ class DBLog(JSONLog):
         self.accessor = accessor
         self.objects_to_save = []
 
+        # json actions & events of the current hand, see _current_lines()
+        self._lines = None
+        self._unsaved_lines = []
+
         try:
             self.hands = [
                 HandHistory.objects.get(
@@ -429,6 +436,7 @@ class DBLog(JSONLog):
         new_hh = HandHistory(table=table, hand_number=table.hand_number)
         self.objects_to_save.append(new_hh)
         self.hands.append(new_hh)
+        self._lines = {'actions': [], 'events': []}
 
     def _check_serialized_state(self, force=False):
         if not self.hands:
@@ -459,26 +467,68 @@ class DBLog(JSONLog):
     def _write_event(self, subj, event, **args):
         if subj == SIDE_EFFECT_SUBJ:
             subj = SideEffectSubject.load()
+        subject_kind, subject_repr = HandHistoryEvent.describe_subject(subj)
 
-        self.objects_to_save.append(
-            HandHistoryEvent(
-                hand_history=self.current_hand(),
-                subject=subj,
-                event=event.name,
-                args=ExtendedEncoder.convert_for_json(args),
-            )
+        event_obj = HandHistoryEvent(
+            hand_history=self.current_hand(),
+            subject=subj,
+            subject_kind=subject_kind,
+            subject_repr=subject_repr,
+            event=event.name,
+            args=ExtendedEncoder.convert_for_json(args),
         )
+        self.objects_to_save.append(event_obj)
+        # events about unnamed subjects (e.g. a Freezeout) can't be read
+        if self._lines is not None and subject_repr is not None:
+            self._mirror_line(event_obj)
 
     def write_action(self, action, player_id=None, **args):
         assert player_id is not None, 'Received an action without a player_id'
 
         player = self.accessor.player_by_player_id(player_id)
-        self.objects_to_save.append(HandHistoryAction(
+        action_obj = HandHistoryAction(
             hand_history=self.current_hand(),
             subject=player,
             action=str(action),
             args=ExtendedEncoder.convert_for_json(args),
-        ))
+        )
+        self.objects_to_save.append(action_obj)
+        if self._lines is not None:
+            self._mirror_line(action_obj)
+
+    def _mirror_line(self, obj):
+        line = obj.__json__()
+        if isinstance(obj, HandHistoryAction):
+            self._lines['actions'].append(line)
+        else:
+            self._lines['events'].append(line)
+        # the saved timestamp replaces the one of the json on commit
+        self._unsaved_lines.append((obj, line))
+
+    def _current_lines(self) -> dict:
+        """
+        append-only mirror of the current hand's actions & events.
+        the saved ones are read from the db the first time, after that
+        lines are added as they're written, so reading the current hand
+        doesn't query the db
+        """
+        if self._lines is None:
+            hand = self.current_hand()
+            saved = {'actions': [], 'events': []}
+            if hand.id is not None:
+                saved = ExtendedEncoder.convert_for_json(hand.filtered_json())
+            self._lines = {
+                'actions': saved['actions'],
+                'events': saved['events'],
+            }
+            for obj in self.objects_to_save:
+                if isinstance(obj, HandHistoryEvent) \
+                        and obj.subject_repr is None:
+                    continue
+                if (isinstance(obj, (HandHistoryEvent, HandHistoryAction))
+                        and obj.hand_history is hand):
+                    self._mirror_line(obj)
+        return self._lines
 
     def _unsaved_hands(self, hand_gte=None, hand_lt=None,
                        ts_gte=None, ts_lt=None, current_hand_only=False):
@@ -533,18 +583,10 @@ class DBLog(JSONLog):
             hand_gte, hand_lt, ts_gte, ts_lt, current_hand_only
         )
 
-        output = []
         for hand in hands:
             if hand['table']['hand_number'] in unsaved_hands:
                 unsaved_hand = unsaved_hands.pop(hand['table']['hand_number'])
 
-                output.append(self._add_gamestate_if_unserialized({
-                    **hand,
-                    **unsaved_hand,
-                    'actions': hand['actions'] + unsaved_hand['actions'],
-                    'events': hand['events'] + unsaved_hand['events'],
-                }))
-
                 assert (
                     ((not hand['actions']) or (not unsaved_hand['actions']))
                     or
@@ -558,19 +600,23 @@ class DBLog(JSONLog):
                      <= unsaved_hand['events'][0]['ts'])
                 ), "Broken assumption: unsaved event predates saved event"
 
+                yield self._add_gamestate_if_unserialized({
+                    **hand,
+                    **unsaved_hand,
+                    'actions': hand['actions'] + unsaved_hand['actions'],
+                    'events': hand['events'] + unsaved_hand['events'],
+                })
+
             else:
-                output.append(hand)
+                yield hand
 
         for hand_number in sorted(unsaved_hands.keys()):
-            output.append(unsaved_hands[hand_number])
-
-        for hh in output:
+            hh = unsaved_hands[hand_number]
             if 'table' not in hh:
                 print(hh)
                 print(self.objects_to_save)
                 raise Exception('Broken hh detected')
-
-        return output
+            yield hh
 
     def _timestamp_filter_args(self, ts_gte, ts_lt):
         args = {}
@@ -580,42 +626,68 @@ class DBLog(JSONLog):
             args['timestamp__lt'] = ts_lt
         return args
 
-    def get_log(self, player=None, notes=None, hand_gte=None, hand_lt=None,
-                      ts_gte=None, ts_lt=None, current_hand_only=False):
-        if not self.hands:
-            hands = []
-        else:
-            ts_filt_args = self._timestamp_filter_args(ts_gte, ts_lt)
-
-            if current_hand_only:
-                hands = [self.current_hand().filtered_json(**ts_filt_args)]
-
-            else:
-                hh_filter_args = {'table_id': self.accessor.table.id}
-                if hand_gte:
-                    hh_filter_args['hand_number__gte'] = hand_gte
-                if hand_lt:
-                    hh_filter_args['hand_number__lt'] = hand_lt
-
-
-                hh_filter_args = {**hh_filter_args, **ts_filt_args}
-
-                hands = [
+    def _saved_hands(self, hand_gte=None, hand_lt=None,
+                     ts_gte=None, ts_lt=None):
+        """archived hands, then the ones in the db, HANDS_PER_QUERY at a time"""
+        ts_filt_args = self._timestamp_filter_args(ts_gte, ts_lt)
+        hh_filter_args = {'table_id': self.accessor.table.id}
+        if hand_gte:
+            hh_filter_args['hand_number__gte'] = hand_gte
+        if hand_lt:
+            hh_filter_args['hand_number__lt'] = hand_lt
+
+        # hands older than HAND_ARCHIVE_AFTER_DAYS are read from
+        #   their monthly archive files, see poker.hand_archive
+        archived = set()
+        for hand in archived_hands(self.accessor.table.id,
+                                   hand_gte, hand_lt, ts_gte, ts_lt):
+            archived.add(hand['table']['hand_number'])
+            yield hand
+
+        for hand in HandHistory.objects\
+                               .filter(**hh_filter_args, **ts_filt_args)\
+                               .order_by('hand_number')\
+                               .iterator(chunk_size=HANDS_PER_QUERY):
+            if hand.hand_number not in archived:
+                yield ExtendedEncoder.convert_for_json(
                     hand.filtered_json(**ts_filt_args)
-                    for hand in HandHistory.objects\
-                            .filter(**hh_filter_args, **ts_filt_args)\
-                            .select_related()\
-                            .order_by('hand_number')
-                ]
+                )
 
-            hands = ExtendedEncoder.convert_for_json(hands)
-            hands = self._merge_unsaved(
-                hands, hand_gte, hand_lt, ts_gte, ts_lt, current_hand_only
-            )
+    def iter_hands(self, player=None, hand_gte=None, hand_lt=None,
+                   ts_gte=None, ts_lt=None, current_hand_only=False):
+        if not self.hands:
+            return
+
+        if current_hand_only:
+            hand = self.current_hand()
+            lines = self._current_lines()
+            # copies, the mirrored lines get their 'ts' set on commit
+            yield self._convert_hand({
+                'ts': ExtendedEncoder.convert_for_json(hand.timestamp),
+                'table': hand.table_json,
+                'players': hand.players_json,
+                'actions': [
+                    dict(line)
+                    for line in lines_between(lines['actions'], ts_gte, ts_lt)
+                ],
+                'events': [
+                    dict(line)
+                    for line in lines_between(lines['events'], ts_gte, ts_lt)
+                ],
+            }, player)
+            return
+
+        hands = self._saved_hands(hand_gte, hand_lt, ts_gte, ts_lt)
+
+        for hh in self._merge_unsaved(hands, hand_gte, hand_lt, ts_gte, ts_lt):
+            yield self._convert_hand(hh, player)
 
+    def get_log(self, player=None, notes=None, hand_gte=None, hand_lt=None,
+                      ts_gte=None, ts_lt=None, current_hand_only=False):
         return {
             **self._log_metadata(notes),
-            'hands': [self._convert_hand(hh, player) for hh in hands]
+            'hands': list(self.iter_hands(player, hand_gte, hand_lt,
+                                          ts_gte, ts_lt, current_hand_only)),
         }
 
     def current_hand_log(self, player=None, notes=None):
@@ -623,6 +695,47 @@ class DBLog(JSONLog):
             player=player, notes=notes, current_hand_only=True
         )
 
+    def frontend_log(self, player, hand_gte, hand_lt):
+        """finished hands come from the redis cache, see poker.hand_summaries"""
+        table_id = self.accessor.table.id
+        hand_gte = hand_gte or 0
+        finished_lt = self.accessor.table.hand_number
+        if hand_lt is not None:
+            finished_lt = min(hand_lt, finished_lt)
+
+        summaries = cached_summaries(table_id, hand_gte, finished_lt)
+        missing = [
+            hand_number
+            for hand_number in range(hand_gte, finished_lt)
+            if hand_number not in summaries
+        ]
+        if missing:
+            rendered = {
+                hand['hand_number']: hand['summary']
+                for hand in super().frontend_log(player, min(missing),
+                                                 max(missing) + 1)
+            }
+            # hands without a HandHistory are cached as None, so that they
+            #   aren't looked up in the db again on every request
+            rendered = {
+                hand_number: rendered.get(hand_number)
+                for hand_number in missing
+            }
+            cache_summaries(table_id, rendered)
+            summaries.update(rendered)
+
+        in_progress = []
+        if hand_lt is None or hand_lt > finished_lt:
+            in_progress = super().frontend_log(player, max(hand_gte,
+                                                           finished_lt),
+                                               hand_lt)
+
+        return [
+            {'hand_number': hand_number, 'summary': summaries[hand_number]}
+            for hand_number in sorted(summaries)
+            if summaries[hand_number] is not None
+        ] + in_progress
+
     def commit(self):
         self._check_serialized_state()
         # if (len(self.current_hand().players_json)
@@ -639,8 +752,43 @@ class DBLog(JSONLog):
                 #   it's been committed to the database
                 obj.hand_history_id = obj.hand_history.id
             obj.save()
+
+        for obj, line in self._unsaved_lines:
+            line['ts'] = ExtendedEncoder.convert_for_json(obj.timestamp)
+        self._unsaved_lines = []
+
+        # finished hands never change, compact their events & actions
+        queue_outbox_events([
+            outbox_event(
+                'hand_history',
+                str(obj.hand_history_id),
+                table_id=obj.hand_history.table_id,
+                hand_history_id=obj.hand_history_id,
+            )
+            for obj in self.objects_to_save
+            if isinstance(obj, HandHistoryEvent)
+                and obj.event == Event.END_HAND.name
+                and isinstance(obj.subject, PokerTable)
+        ])
         self.objects_to_save = []
 
+
+def write_log(file, metadata: dict, hands, indent=0):
+    """
+    write {**metadata, 'hands': [...]} as json, consuming the hands
+    iterator one hand at a time
+    """
+    file.write('{')
+    for key, value in metadata.items():
+        file.write(f'{to_json_str(key)}: {to_json_str(value)}, ')
+    file.write('"hands": [')
+    for idx, hand in enumerate(hands):
+        if idx:
+            file.write(', ')
+        file.write(to_json_str(hand, indent=indent))
+    file.write(']}')
+
+
 def fmt_hand(hand_json, filtered=True, for_player=None):
     od = OrderedDict(fmt_table(hand_json['table']))
     od['ts'] = hand_json['ts']
@@ -1,6 +1,12 @@
-from typing import List, Tuple
-
-from django.db.models import Q
+from uuid import UUID
+from decimal import Decimal
+from datetime import datetime, timedelta
+from collections import defaultdict
+from typing import List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 
 from banker.mutations import buy_chips
@@ -12,7 +18,7 @@ from poker.constants import (
 )
 
 from oddslingers.model_utils import BaseModel
-from oddslingers.models import User
+from oddslingers.models import User, UserStats
 from oddslingers.tasks import track_analytics_event
 from oddslingers.mutations import MutationList, increase_games_level
 
@@ -80,36 +86,75 @@ def levelup_bonuses(user: User, old_lvl, new_lvl) -> List[BaseModel]:
     return mutations
 
 
-def earned_chips(user: User) -> int:
-    """
-        User winnings since the last time its balance fall below zero
-        no taking into account the chips received nor sent with other users
-    """
+def level_up_notification() -> dict:
+    return {
+        'type': 'level_up',
+        'bsStyle': 'success',
+        'ts': timezone.now(),
+        'title': 'Congratulations!',
+        'description': 'New level unlocked!',
+        'icon': '/static/images/logo.png',
+    }
+
+
+EarnedChipsState = Tuple[Decimal, Optional[datetime], Optional[UUID]]
+
+# transfers newer than this may still have uncommitted transfers with an
+#   earlier timestamp before them, so they aren't saved in the running state
+EARNED_CHIPS_SETTLE_TIME = timedelta(minutes=1)
+
+
+def earned_chips_transfers(user: User,
+                           season: int=settings.CURRENT_SEASON) -> QuerySet:
+    """transfers that count towards earned_chips, in the order they apply"""
     user_type = ContentType.objects.get_for_model(User)
     user_transfers = Q(source_id=user.id) & Q(dest_type=user_type)\
                    | Q(source_type=user_type) & Q(dest_id=user.id)
 
-    transfers = BalanceTransfer.objects.current_season().filter(
+    return BalanceTransfer.objects.season(season).filter(
         Q(source_id=user.id) | Q(dest_id=user.id),
     ).exclude(
         user_transfers
-    ).order_by('timestamp')
+    ).only(
+        'id', 'timestamp', 'amt',
+        'source_type', 'source_id', 'dest_type', 'dest_id',
+    ).order_by('timestamp', 'id')
 
-    total = 0
-    target_ids = {}
+
+def private_targets(transfers: List[BalanceTransfer],
+                    user_id: UUID) -> Set[UUID]:
+    """ids of the private tables/tournaments the user transferred with"""
+    target_ids = defaultdict(set)
     for transfer in transfers:
-        is_credit = True if transfer.dest_id == user.id else False
+        if transfer.dest_id == user_id:
+            target_ids[transfer.source_type_id].add(transfer.source_id)
+        else:
+            target_ids[transfer.dest_type_id].add(transfer.dest_id)
+
+    private_ids = set()
+    for type_id, ids in target_ids.items():
+        model = ContentType.objects.get_for_id(type_id).model_class()
+        if not any(f.name == 'is_private' for f in model._meta.fields):
+            continue
+        private_ids.update(
+            model.objects
+                 .filter(id__in=ids, is_private=True)
+                 .values_list('id', flat=True)
+        )
+    return private_ids
 
-        target_id = transfer.source_id if is_credit else transfer.dest_id
-        if not target_id in target_ids:
-            target_ids.update({
-                target_id: transfer.source if is_credit else transfer.dest
-            })
 
-        target = target_ids[target_id]
-        exclude = hasattr(target, 'is_private') and target.is_private
+def add_earned_chips(user: User, state: EarnedChipsState,
+                     transfers: List[BalanceTransfer]) -> EarnedChipsState:
+    """advance the earned_chips running state past the given transfers"""
+    total, last_timestamp, last_transfer_id = state
+    private_ids = private_targets(transfers, user.id)
+
+    for transfer in transfers:
+        is_credit = transfer.dest_id == user.id
+        target_id = transfer.source_id if is_credit else transfer.dest_id
 
-        if not exclude:
+        if target_id not in private_ids:
             total += transfer.amt if is_credit else -transfer.amt
 
         # This allow users to start again from zero
@@ -117,5 +162,70 @@ def earned_chips(user: User) -> int:
         if total < 0:
             total = 0
 
-    return total
+        last_timestamp, last_transfer_id = transfer.timestamp, transfer.id
 
+    return total, last_timestamp, last_transfer_id
+
+
+def earned_chips(user: User, season: int=settings.CURRENT_SEASON) -> Decimal:
+    """
+        User winnings since the last time its balance fall below zero
+        no taking into account the chips received nor sent with other users
+
+        Only the transfers made since the running state saved on UserStats
+        are loaded, and the state is moved forward past the settled ones.
+    """
+    stats = UserStats.objects.season(season).filter(user=user).values(
+        'id',
+        'earned_chips',
+        'earned_chips_timestamp',
+        'earned_chips_transfer_id',
+    ).first()
+
+    transfers = earned_chips_transfers(user, season)
+    state = (Decimal(0), None, None)
+    if stats and stats['earned_chips_timestamp']:
+        state = (
+            stats['earned_chips'],
+            stats['earned_chips_timestamp'],
+            stats['earned_chips_transfer_id'],
+        )
+        transfers = transfers.filter(
+            Q(timestamp__gt=state[1])
+            | Q(timestamp=state[1], id__gt=state[2])
+        )
+
+    transfers = list(transfers)
+    settled_before = timezone.now() - EARNED_CHIPS_SETTLE_TIME
+    settled = [xfer for xfer in transfers if xfer.timestamp < settled_before]
+    unsettled = transfers[len(settled):]
+
+    if settled:
+        prev_timestamp = state[1]
+        state = add_earned_chips(user, state, settled)
+        if stats:
+            # only moves forward if nobody else did it in the meantime
+            UserStats.objects.filter(
+                id=stats['id'],
+                earned_chips_timestamp=prev_timestamp,
+            ).update(
+                earned_chips=state[0],
+                earned_chips_timestamp=state[1],
+                earned_chips_transfer_id=state[2],
+            )
+
+    if unsettled:
+        state = add_earned_chips(user, state, unsettled)
+
+    return state[0]
+
+
+def rebuild_earned_chips(user: User,
+                         season: int=settings.CURRENT_SEASON) -> Decimal:
+    """discard the saved running state and recompute it from scratch"""
+    UserStats.objects.season(season).filter(user=user).update(
+        earned_chips=0,
+        earned_chips_timestamp=None,
+        earned_chips_transfer_id=None,
+    )
+    return earned_chips(user, season)
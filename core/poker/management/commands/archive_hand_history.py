@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from poker.models import HandHistory
+from poker.hand_archive import archive_hands
+
+
+class Command(BaseCommand):
+    help = (
+        'Move finished hands older than --days out of the db and into '
+        'gzipped per-table monthly files in HAND_ARCHIVE_DIR'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.HAND_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, days=None, batch_size=500, **options):
+        cutoff = timezone.now() - timedelta(days=days)
+        old_hands = HandHistory.objects\
+                               .filter(timestamp__lt=cutoff,
+                                       hand_number__lt=F('table__hand_number'))\
+                               .order_by('timestamp')\
+                               .values_list('id', flat=True)
+        total = old_hands.count()
+        archived = 0
+        while True:
+            hand_ids = list(old_hands[:batch_size])
+            if not hand_ids:
+                break
+            archived += archive_hands(hand_ids)
+            print(f'[{archived}/{total}] hands archived')
+
+        print(f'[√] Archived {archived} hands older than {days} days')
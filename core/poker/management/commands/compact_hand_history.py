@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from poker.models import HandHistory
+from poker.outbox import compact_hands
+
+
+class Command(BaseCommand):
+    help = (
+        'Encode the events & actions of finished hands that are still '
+        'stored row by row into HandHistory.compressed_log (new hands are '
+        'compacted by the outbox when they end)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, batch_size=500, **options):
+        finished = HandHistory.objects\
+                              .filter(compressed_log__isnull=True,
+                                      hand_number__lt=F('table__hand_number'))\
+                              .order_by('id')\
+                              .values_list('id', flat=True)
+        total = finished.count()
+        compacted, last_id = 0, None
+        while True:
+            # hands being compacted by the outbox right now are skipped,
+            #   so page by id instead of re-reading the same batch
+            batch = finished if last_id is None \
+                    else finished.filter(id__gt=last_id)
+            hand_ids = list(batch[:batch_size])
+            if not hand_ids:
+                break
+            last_id = hand_ids[-1]
+            compacted += compact_hands(hand_ids)
+            print(f'[{compacted}/{total}] hands compacted')
+
+        print(f'[√] Compacted {compacted} finished hands')
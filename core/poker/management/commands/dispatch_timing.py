@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from oddslingers.utils import to_json_str
+from poker.game_utils import fuzzy_get_table
+from poker.dispatch_timing import (dispatch_timing_histograms,
+                                   reset_dispatch_timing)
+
+
+class Command(BaseCommand):
+    help = 'Show per-phase GameController.dispatch timing for a table (or all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table_id', type=str, nargs='?', default=None)
+        parser.add_argument('--json', action='store_true',
+                            help='print the raw histograms as json')
+        parser.add_argument('--reset', action='store_true',
+                            help='clear the recorded histograms')
+
+    def handle(self, *args, table_id=None, json=False, reset=False,
+               **options):
+        table = fuzzy_get_table(table_id, only=('id', 'name')) \
+                if table_id else None
+        key_id = table.id if table else None
+        label = f'{table.name} ({table.short_id})' if table else 'all tables'
+
+        if reset:
+            reset_dispatch_timing(key_id)
+            print(f'[√] Cleared dispatch timing for {label}')
+            return
+
+        histograms = dispatch_timing_histograms(key_id)
+        if json:
+            print(to_json_str(histograms, indent=4))
+            return
+
+        if not histograms:
+            print(f'No dispatch timing recorded for {label}')
+            return
+
+        print(f'Dispatch timing for {label} (slowest phases first):')
+        print(f'{"phase":<40} {"count":>7} {"mean ms":>9} {"total ms":>11} '
+              f'{"p50":>6} {"p90":>6} {"p99":>6} {"queries":>8}')
+        by_total = sorted(
+            histograms.items(),
+            key=lambda item: item[1]['total_ms'],
+            reverse=True,
+        )
+        for phase, hist in by_total:
+            print(f'{phase:<40} {hist["count"]:>7} {hist["mean_ms"]:>9.2f} '
+                  f'{hist["total_ms"]:>11.1f} {hist["p50_ms"]:>6} '
+                  f'{hist["p90_ms"]:>6} {hist["p99_ms"]:>6} '
+                  f'{hist["queries_per_call"]:>8.1f}')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from poker.outbox import process_outbox_events, purge_outbox_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Process the pending subscriber OutboxEvents (normally done by the '
+        'process_outbox dramatiq actor) and purge the old processed ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--purge-days', type=int, default=None,
+                            help='delete events processed more than this '
+                                 'many days ago (default: '
+                                 'OUTBOX_RETENTION_DAYS), and the ones '
+                                 'that failed OUTBOX_MAX_ATTEMPTS times')
+
+    def handle(self, *args, batch_size=None, purge_days=None, **options):
+        total = 0
+        while True:
+            num_events = process_outbox_events(limit=batch_size)
+            total += num_events
+            if not num_events:
+                break
+        print(f'[√] Processed {total} outbox events')
+
+        num_deleted = purge_outbox_events(days=purge_days)
+        print(f'[√] Purged {num_deleted} processed or dead outbox events')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from oddslingers.models import User, UserStats
+from oddslingers.settings import CURRENT_SEASON
+
+from poker.level_utils import rebuild_earned_chips
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the earned_chips running state saved on UserStats from '
+        'the BalanceTransfer ledger'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', type=str,
+                            help='only rebuild these users (default: all)')
+        parser.add_argument('--season', type=int, default=CURRENT_SEASON)
+
+    def handle(self, *args, usernames=None, season=CURRENT_SEASON,
+               **options):
+        user_ids = UserStats.objects.season(season)\
+                                    .values_list('user_id', flat=True)
+        users = User.objects.filter(id__in=user_ids, is_robot=False)\
+                            .only('id', 'username')\
+                            .order_by('username')
+        if usernames:
+            users = users.filter(username__in=usernames)
+
+        total = users.count()
+        for idx, user in enumerate(users.iterator()):
+            amt = rebuild_earned_chips(user, season=season)
+            print(f'[{idx + 1}/{total}] {user.username}: {amt}')
+
+        print(f'[√] Rebuilt earned chips for {total} users in season {season}')
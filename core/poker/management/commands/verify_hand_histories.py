@@ -0,0 +1,121 @@
+import os
+import gzip
+import json
+import time
+
+from itertools import chain, islice
+from multiprocessing import Pool
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from poker.accessors import accessor_type_for_table
+from poker.game_utils import fuzzy_get_table
+from poker.handhistory import DBLog
+from poker.replay_verifier import verify_hand
+
+
+def hands_in_file(path):
+    """hands of a get_log .json file or of a .jsonl(.gz) hand archive"""
+    opener = gzip.open if path.endswith('.gz') else open
+    if path.endswith('.jsonl') or path.endswith('.jsonl.gz'):
+        with opener(path, 'rt') as lines:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with opener(path, 'rt') as log_file:
+            yield from json.load(log_file)['hands']
+
+
+def hands_in_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if '.json' in name:
+                        yield from hands_in_file(os.path.join(root, name))
+        else:
+            yield from hands_in_file(path)
+
+
+def hands_of_tables(table_ids):
+    for table_id in table_ids:
+        table = fuzzy_get_table(table_id)
+        log = DBLog(accessor_type_for_table(table)(table))
+        # the hand in progress can't be verified yet
+        yield from log.iter_hands(player='all', hand_lt=table.hand_number)
+
+
+def verify(hand):
+    return (
+        hand['table']['id'],
+        hand['table']['hand_number'],
+        verify_hand(hand),
+    )
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay stored hand histories action by action and report the hands '
+        'whose replayed events differ from the logged ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', type=str,
+                            help='get_log .json files, .jsonl(.gz) hand '
+                                 'archives or directories of them')
+        parser.add_argument('--table', action='append', dest='tables',
+                            default=[], help='verify the hands of a table '
+                                             'in the db (repeatable)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, paths=(), tables=(), workers=None,
+               batch_size=200, **options):
+        if not (paths or tables):
+            print('Pass hand history files or --table ids to verify')
+            return
+
+        hands = chain(hands_in_paths(paths), hands_of_tables(tables))
+        workers = max(workers or 1, 1)
+
+        # forked workers can't share the parent's db connection
+        db.connections.close_all()
+        pool = Pool(workers, initializer=db.connections.close_all) \
+               if workers > 1 else None
+
+        verified, diverged = 0, 0
+        start = time.time()
+        try:
+            for batch in batches(hands, batch_size):
+                results = pool.imap(verify, batch) if pool \
+                          else map(verify, batch)
+                for table_id, hand_number, divergence in results:
+                    verified += 1
+                    if divergence:
+                        diverged += 1
+                        print(f'[X] Table {table_id} hand #{hand_number}: '
+                              f'{divergence}')
+
+                elapsed = max(time.time() - start, 1e-6)
+                print(f'[{verified}] hands verified, {diverged} diverged '
+                      f'({verified / elapsed:.1f} hands/sec)')
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        elapsed = max(time.time() - start, 1e-6)
+        print(f'[√] Verified {verified} hands in {elapsed:.1f}s with '
+              f'{workers} workers ({verified / elapsed:.1f} hands/sec), '
+              f'{diverged} diverged')
@@ -3,6 +3,8 @@ from django.conf import settings
 from oddslingers.utils import ExtendedEncoder
 from sockets.models import Socket, SocketQuerySet
 
+from poker.dispatch_timing import NULL_TIMER
+
 
 # the 'privado' keyword is added to any private gamestate in order so that
 #   outgoing gamestates can be easily filtered on privacy (QA, etc)
@@ -101,31 +103,36 @@ def get_players_from_animations(gamestate, accessor):
     return accessor.seated_players()
 
 
-def broadcast_to_sockets(accessor, subscribers, only_to_player=None):
+def broadcast_to_sockets(accessor, subscribers, only_to_player=None,
+                         timer=NULL_TIMER):
     if only_to_player:
-        gamestate = gamestate_json(accessor, only_to_player, subscribers)
-        sockets = player_sockets(only_to_player)
+        with timer.phase('broadcast.build'):
+            gamestate = gamestate_json(accessor, only_to_player, subscribers)
+            sockets = player_sockets(only_to_player)
         if sockets:
-            return sockets.send_action(
-                'UPDATE_GAMESTATE',
-                privado=True,
-                **gamestate,
-            )
+            with timer.phase('broadcast.send'):
+                return sockets.send_action(
+                    'UPDATE_GAMESTATE',
+                    privado=True,
+                    **gamestate,
+                )
         else:
             return 0
 
     sent_count = 0
-    sockets_and_gamestates = gamestates_for_sockets(
-        accessor,
-        subscribers,
-    )
-
-    for sockets, json_to_send in sockets_and_gamestates.items():
-        sent_count += sockets.send_action(
-            'UPDATE_GAMESTATE',
-            **json_to_send
+    with timer.phase('broadcast.build'):
+        sockets_and_gamestates = gamestates_for_sockets(
+            accessor,
+            subscribers,
         )
 
+    with timer.phase('broadcast.send'):
+        for sockets, json_to_send in sockets_and_gamestates.items():
+            sent_count += sockets.send_action(
+                'UPDATE_GAMESTATE',
+                **json_to_send
+            )
+
     return sent_count
 
 
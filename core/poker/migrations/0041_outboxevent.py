@@ -0,0 +1,31 @@
+# Generated by Django 2.2.11 on 2026-10-19 06:55
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0040_auto_20201222_2043'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('kind', models.CharField(max_length=32)),
+                ('table_id', models.UUIDField(blank=True, null=True)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+            ],
+            options={
+                'index_together': {('processed', 'created')},
+            },
+        ),
+    ]
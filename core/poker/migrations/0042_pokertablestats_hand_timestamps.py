@@ -0,0 +1,44 @@
+# Generated by Django 2.2.11 on 2026-10-19 07:45
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+# frozen copy of poker.constants.HAND_SAMPLING_CAP
+HAND_SAMPLING_CAP = 20
+
+
+def seed_hand_timestamps(apps, schema_editor):
+    """Fill the ring buffer from the last hands of each table"""
+    PokerTableStats = apps.get_model('poker', 'PokerTableStats')
+    HandHistory = apps.get_model('poker', 'HandHistory')
+
+    for table_stats in PokerTableStats.objects.only('id', 'table_id'):
+        timestamps = HandHistory.objects\
+                                .filter(table_id=table_stats.table_id)\
+                                .order_by('-hand_number')\
+                                .values_list('timestamp', flat=True)\
+                                [:HAND_SAMPLING_CAP + 2]
+        hand_timestamps = sorted(
+            timestamp.timestamp() for timestamp in timestamps
+        )
+        if hand_timestamps:
+            PokerTableStats.objects\
+                           .filter(id=table_stats.id)\
+                           .update(hand_timestamps=hand_timestamps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0041_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pokertablestats',
+            name='hand_timestamps',
+            field=django.contrib.postgres.fields.jsonb.JSONField(default=list),
+        ),
+        migrations.RunPython(seed_hand_timestamps,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.11 on 2026-10-19 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0042_pokertablestats_hand_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='handhistory',
+            name='compressed_log',
+            field=models.BinaryField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.11 on 2026-10-19 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0043_handhistory_compressed_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='handhistory',
+            name='timestamp',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedHandHistory',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('table_id', models.UUIDField()),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('first_hand', models.IntegerField()),
+                ('last_hand', models.IntegerField()),
+                ('first_ts', models.DateTimeField()),
+                ('last_ts', models.DateTimeField()),
+                ('num_hands', models.IntegerField(default=0)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('table_id', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.11 on 2026-10-19 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poker', '0044_handhistory_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='handhistoryevent',
+            name='subject_kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'PLAYER'), (2, 'TABLE'), (3, 'SIDE_EFFECT')], null=True),
+        ),
+        migrations.AddField(
+            model_name='handhistoryevent',
+            name='subject_repr',
+            field=models.CharField(max_length=150, null=True),
+        ),
+    ]
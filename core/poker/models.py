@@ -5,7 +5,7 @@ from decimal import Decimal
 from typing import Optional, Union, Tuple, Iterable, List
 
 from django.db import models
-from django.db.models import Prefetch
+from django.db.models import Prefetch, prefetch_related_objects
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import JSONField
@@ -23,9 +23,10 @@ from poker.cards import Card, Deck
 from poker.constants import (
     TABLE_TYPES, Event, NL_HOLDEM, TABLE_SUBJECT_REPR, Action,
     SIDE_EFFECT_SUBJ, PLAYER_API, PlayingState, HIDE_TABLES_AFTER_N_HANDS,
-    TournamentStatus
+    TournamentStatus, SubjectKind
 )
 from poker.bot_personalities import PERSONALITIES
+from poker.hand_encoding import decode_hand, lines_between
 
 logger = logging.getLogger('poker')
 
@@ -39,9 +40,13 @@ class ChatHistory(BaseModel):
     def get_chat(self):
         return ChatLine.objects.filter(chat_history=self).order_by('id')
 
-    def get_last_100(self) -> models.QuerySet:
-        lines = ChatLine.objects.filter(chat_history=self)
-        return lines.order_by('-timestamp')[:100][::-1]
+    def get_recent(self, count: int) -> List['ChatLine']:
+        lines = ChatLine.objects.filter(chat_history=self)\
+                                .select_related('user')
+        return lines.order_by('-timestamp')[:count][::-1]
+
+    def get_last_100(self) -> List['ChatLine']:
+        return self.get_recent(100)
 
 
 class ChatLine(models.Model):
@@ -1255,7 +1260,7 @@ class SideEffectSubject(BaseModel):
 
 class HandHistory(models.Model):
     id = models.AutoField(primary_key=True)
-    timestamp = models.DateTimeField(auto_now=True)
+    timestamp = models.DateTimeField(auto_now=True, db_index=True)
 
     table = models.ForeignKey(PokerTable, on_delete=models.CASCADE)
     hand_number = models.IntegerField(default=0, db_index=True)
@@ -1263,6 +1268,10 @@ class HandHistory(models.Model):
     table_json = JSONField(null=True)
     players_json = JSONField(null=True)
 
+    # events & actions of the finished hand, see poker.hand_encoding.
+    #   when set, the hand has no HandHistoryEvent/Action rows left
+    compressed_log = models.BinaryField(null=True, editable=False)
+
     class Meta:
         unique_together = (('table', 'hand_number'), ('table', 'timestamp'))
         index_together = (('table', 'hand_number'))
@@ -1273,22 +1282,47 @@ class HandHistory(models.Model):
     def actions(self):
         return self.handhistoryaction_set.all()
 
-    def filtered_json(self, *filter_args, **filter_kwargs) -> dict:
-        actions = self.handhistoryaction_set\
-                    .filter(*filter_args, **filter_kwargs)\
-                    .select_related('subject')\
-                    .order_by('id')
-        events = self.handhistoryevent_set\
-                    .filter(*filter_args, **filter_kwargs)\
-                    .select_related('subject_type')\
-                    .prefetch_related('subject')\
+    def filtered_json(self, timestamp__gte: datetime=None,
+                      timestamp__lt: datetime=None) -> dict:
+        filter_kwargs = {}
+        if timestamp__gte:
+            filter_kwargs['timestamp__gte'] = timestamp__gte
+        if timestamp__lt:
+            filter_kwargs['timestamp__lt'] = timestamp__lt
+
+        if self.compressed_log is None:
+            actions = [
+                a.__json__()
+                for a in self.handhistoryaction_set
+                             .filter(**filter_kwargs)
+                             .select_related('subject__user')
+                             .order_by('id')
+            ]
+            events = HandHistoryEvent.prefetch_legacy_subjects(
+                self.handhistoryevent_set
+                    .filter(**filter_kwargs)
                     .order_by('id')
+            )
+            events = [e.__json__() for e in events]
+            if not (actions or events or self.id is None):
+                # the hand may have been compacted since it was loaded
+                self.compressed_log = HandHistory.objects\
+                                                 .filter(id=self.id)\
+                                                 .values_list('compressed_log',
+                                                              flat=True)\
+                                                 .first()
+
+        if self.compressed_log is not None:
+            events, actions = decode_hand(self.compressed_log)
+            events = lines_between(events, timestamp__gte, timestamp__lt)
+            actions = lines_between(actions, timestamp__gte, timestamp__lt)
+
         return {
             'ts': self.timestamp,
             'table': self.table_json,
             'players': self.players_json,
-            'actions': [a.__json__() for a in actions],
-            'events': [e.__json__() for e in events],
+            'actions': actions,
+            'events': events,
         }
 
     def __repr__(self) -> str:
@@ -1307,6 +1341,13 @@ class HandHistoryEvent(models.Model):
     subject_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     subject_id = models.UUIDField()
     subject = GenericForeignKey('subject_type', 'subject_id')
+    # copied from the subject when the event is written, so reading a
+    #   hand doesn't have to fetch every subject through the generic fk
+    subject_kind = models.PositiveSmallIntegerField(
+        choices=[(kind.value, kind.name) for kind in SubjectKind],
+        null=True
+    )
+    subject_repr = models.CharField(max_length=150, null=True)
     event = models.CharField(
         choices=((e.name, e.name) for e in Event),
         max_length=64,
@@ -1314,7 +1355,36 @@ class HandHistoryEvent(models.Model):
     )
     args = JSONField()
 
+    @staticmethod
+    def describe_subject(subj) -> Tuple[Optional[int], Optional[str]]:
+        """(subject_kind, subject_repr) to store with an event about subj"""
+        if isinstance(subj, Player):
+            return SubjectKind.PLAYER.value, str(subj.username)
+        elif isinstance(subj, PokerTable):
+            return SubjectKind.TABLE.value, TABLE_SUBJECT_REPR
+        elif isinstance(subj, SideEffectSubject):
+            return SubjectKind.SIDE_EFFECT.value, str(subj)
+        # other subjects (e.g. a Freezeout) are only named when read
+        return None, None
+
+    @staticmethod
+    def prefetch_legacy_subjects(events: Iterable['HandHistoryEvent']
+                                 ) -> List['HandHistoryEvent']:
+        """
+        fetch the subjects of the events that have no subject_repr (written
+        before it existed, or about other subjects) in a query per type
+        """
+        events = list(events)
+        legacy = [event for event in events if event.subject_repr is None]
+        if legacy:
+            prefetch_related_objects(legacy, 'subject_type', 'subject')
+        return events
+
     def subject_name(self):
+        if self.subject_repr is not None:
+            return self.subject_repr
+
+        # events written before subject_repr existed
         if self.subject_type.model_class() in (Player, MockPlayer):
             return str(self.subject.username)
         elif self.subject_type.model_class() in (PokerTable, MockPokerTable):
@@ -1405,6 +1475,32 @@ class HandHistoryAction(models.Model):
         return output_str
 
 
+class ArchivedHandHistory(models.Model):
+    """
+    Index of one table's monthly archive file of old hands,
+    see poker.hand_archive.
+    """
+    id = models.AutoField(primary_key=True)
+    table_id = models.UUIDField()
+    month = models.DateField()
+    path = models.CharField(max_length=255)
+
+    first_hand = models.IntegerField()
+    last_hand = models.IntegerField()
+    first_ts = models.DateTimeField()
+    last_ts = models.DateTimeField()
+    num_hands = models.IntegerField(default=0)
+
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('table_id', 'month'),)
+
+    def __str__(self) -> str:
+        return (f'<ArchivedHandHistory {self.path} '
+                f'hands {self.first_hand}-{self.last_hand}>')
+
+
 class PokerTableStats(BaseModel):
     table = models.OneToOneField(
         PokerTable,
@@ -1436,6 +1532,8 @@ class PokerTableStats(BaseModel):
         null=True
     )
     num_samples = models.IntegerField(default=0)
+    # start times (unix timestamps) of the most recent hands, oldest first
+    hand_timestamps = JSONField(default=list)
 
     def __json__(self, *attrs) -> dict:
         return self.attrs(
@@ -1447,3 +1545,26 @@ class PokerTableStats(BaseModel):
             *attrs,
         )
 
+
+
+class OutboxEvent(BaseModel):
+    """
+    Work for the non-critical subscribers (badges, levels, user & table
+    stats, analytics), written in the same transaction as the game state
+    it came from and processed in batches by poker.outbox.
+    key is unique, so an event can't be queued (or processed) twice.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    kind = models.CharField(max_length=32)
+    table_id = models.UUIDField(null=True, blank=True)
+    payload = JSONField(default=dict)
+
+    created = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = (('processed', 'created'),)
+
+    def __str__(self):
+        return f'{self.key} ({"processed" if self.processed else "pending"})'
@@ -0,0 +1,408 @@
+"""
+Transactional outbox for the subscribers that don't affect gameplay.
+
+Badges, levels, hands played and analytics used to do their
+queries in the dispatch/commit path of every action.  Instead those
+subscribers (and DBLog, for compacting finished hands) now write compact
+OutboxEvent rows during GameController.commit
+(in the same transaction as the game state that produced them), and the
+rows are processed in batches by the process_outbox dramatiq actor:
+
+    subscriber.commit()  ->  OutboxEvent(key='levels:<table>:<hand>:<user>')
+    transaction commit   ->  process_outbox.send()
+    dramatiq worker      ->  process_outbox_events()  ->  OUTBOX_HANDLERS
+
+Every event has a unique idempotency key, duplicate events are dropped on
+insert, and an event is marked processed in the same transaction as its
+effects, so each one is applied exactly once.
+
+Notifications created by the workers (level ups, hands played badges) are
+pushed to redis once their batch commits, and picked up by the table's
+subscribers on their next commit, so they go out with the next broadcast.
+Analytics events are only sent once their batch commits as well, so
+batches that are rolled back and retried don't send them twice.
+
+If dramatiq is disabled (dev & tests) the events are processed right away
+during the subscriber's commit, and a failing handler raises instead of
+being retried later.  Events that failed OUTBOX_MAX_ATTEMPTS times are
+logged and deleted along with the old processed ones by
+purge_outbox_events.
+"""
+import json
+import logging
+
+from datetime import timedelta
+from functools import partial
+from collections import Counter, OrderedDict, defaultdict
+from typing import Callable, Dict, List
+
+import redis
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from oddslingers.utils import to_json_str
+from oddslingers.models import User, UserStats
+from oddslingers.mutations import execute_mutations
+from oddslingers.tasks import track_analytics_event, process_outbox
+
+from banker.models import deferred_ledger_updates
+
+from poker.constants import ANALYTIC_HAND_THRESHOLDS
+from poker.models import (
+    OutboxEvent, HandHistory, HandHistoryEvent, HandHistoryAction, Player,
+)
+from poker.hand_encoding import encode_hand
+from poker.hand_summaries import hand_summary, cache_summaries
+from poker.level_utils import (
+    update_levels, earned_chips, level_up_notification,
+)
+
+from rewards.constants import BADGES_FOR_HANDS, badge_notification
+from rewards.mutations import award_badge
+from rewards.utils import BadgeIndex
+
+
+logger = logging.getLogger('poker')
+
+REDIS_NOTIFICATIONS_KEY = 'outbox-notifications-{0}-{1}'
+NOTIFICATIONS_TTL = 60 * 60                 # drop those of tables that closed
+
+redis_outbox = redis.Redis(**settings.REDIS_CONF)
+
+OutboxHandler = Callable[[List[OutboxEvent]], None]
+
+
+### Queueing & Processing
+
+def outbox_event(kind: str, key: str, table_id=None,
+                 **payload) -> OutboxEvent:
+    return OutboxEvent(
+        key=f'{kind}:{key}',
+        kind=kind,
+        table_id=table_id,
+        payload=json.loads(to_json_str(payload)),
+    )
+
+
+def queue_outbox_events(events: List[OutboxEvent]):
+    """save events in the current transaction and schedule processing"""
+    if not events:
+        return
+
+    OutboxEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+    if settings.ENABLE_DRAMATIQ:
+        transaction.on_commit(process_outbox.send)
+    else:
+        process_outbox_events(keys=[event.key for event in events],
+                              raise_errors=True)
+
+
+def process_outbox_events(limit: int=None, keys: List[str]=None,
+                          raise_errors: bool=False) -> int:
+    """
+    Run the handlers of the oldest pending events, grouped by kind.
+    If a handler fails its events are retried in a later batch, up to
+    OUTBOX_MAX_ATTEMPTS times, or the error is raised if raise_errors.
+    """
+    limit = limit or settings.OUTBOX_BATCH_SIZE
+    with transaction.atomic(), deferred_ledger_updates():
+        pending = OutboxEvent.objects\
+                             .filter(
+                                 processed__isnull=True,
+                                 attempts__lt=settings.OUTBOX_MAX_ATTEMPTS,
+                             )\
+                             .select_for_update(skip_locked=True)\
+                             .order_by('created', 'id')
+        if keys is not None:
+            pending = pending.filter(key__in=keys)
+        events = list(pending[:limit])
+
+        by_kind: Dict[str, List[OutboxEvent]] = OrderedDict()
+        for event in events:
+            by_kind.setdefault(event.kind, []).append(event)
+
+        processed_ids, failed_ids = [], []
+        for kind, kind_events in by_kind.items():
+            ids = [event.id for event in kind_events]
+            try:
+                with transaction.atomic(), deferred_ledger_updates():
+                    OUTBOX_HANDLERS[kind](kind_events)
+                processed_ids += ids
+            except Exception:
+                if raise_errors:
+                    raise
+                logger.exception(f'Failed to process outbox events: {kind}',
+                                 extra={'keys': [e.key for e in kind_events]})
+                failed_ids += ids
+
+        OutboxEvent.objects.filter(id__in=processed_ids)\
+                           .update(processed=timezone.now())
+        OutboxEvent.objects.filter(id__in=failed_ids)\
+                           .update(attempts=F('attempts') + 1)
+
+    return len(events)
+
+
+def purge_outbox_events(days: int=None) -> int:
+    """
+    delete the events processed over OUTBOX_RETENTION_DAYS ago, and the
+    ones that were given up on after OUTBOX_MAX_ATTEMPTS (logging them)
+    """
+    days = settings.OUTBOX_RETENTION_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboxEvent.objects.filter(processed__lt=cutoff).delete()
+
+    dead = OutboxEvent.objects.filter(
+        processed__isnull=True,
+        attempts__gte=settings.OUTBOX_MAX_ATTEMPTS,
+        created__lt=cutoff,
+    )
+    for event in dead:
+        logger.error(f'Dropped outbox event after {event.attempts} attempts',
+                     extra={'key': event.key, 'payload': event.payload})
+    dead_deleted, _ = dead.delete()
+    return deleted + dead_deleted
+
+
+### Notifications
+
+def push_notification(kind: str, table_id, user_id, notification: dict):
+    """queue a notification for the next broadcast of the table"""
+    transaction.on_commit(partial(
+        _push_notification, kind, table_id, user_id, notification
+    ))
+
+
+def _push_notification(kind: str, table_id, user_id, notification: dict):
+    key = REDIS_NOTIFICATIONS_KEY.format(kind, table_id)
+    pipe = redis_outbox.pipeline()
+    pipe.rpush(key, to_json_str({
+        'user_id': str(user_id),
+        'notification': notification,
+    }))
+    pipe.expire(key, NOTIFICATIONS_TTL)
+    pipe.execute()
+
+
+def pop_notifications(kind: str, table_id) -> List[dict]:
+    key = REDIS_NOTIFICATIONS_KEY.format(kind, table_id)
+    pipe = redis_outbox.pipeline()
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    items, _ = pipe.execute()
+    return [json.loads(item) for item in items]
+
+
+### Handlers
+
+def users_by_id(user_ids) -> Dict[str, User]:
+    return {
+        str(user_id): user
+        for user_id, user in User.objects.in_bulk(set(user_ids)).items()
+    }
+
+
+def hands_played_totals(user_ids) -> Dict[str, int]:
+    return {
+        str(user_id): hands_played
+        for user_id, hands_played in UserStats.objects
+                                              .current_season()
+                                              .filter(user_id__in=user_ids)
+                                              .values_list('user_id',
+                                                           'hands_played')
+    }
+
+
+def crossed(thresholds, total: int, increase: int) -> list:
+    """thresholds passed when a counter went from total-increase to total"""
+    return [
+        threshold for threshold in thresholds
+        if total - increase < threshold <= total
+    ]
+
+
+def award_badges(events: List[OutboxEvent]):
+    users = users_by_id(event.payload['user_id'] for event in events)
+    badges = BadgeIndex(users.values())
+    mutations = []
+    for event in events:
+        mutations += award_badge(
+            users[event.payload['user_id']],
+            event.payload['name'],
+            event.payload.get('max_times'),
+            badges=badges,
+        )
+    execute_mutations(mutations)
+
+
+def recalculate_levels(events: List[OutboxEvent]):
+    users = users_by_id(event.payload['user_id'] for event in events)
+    for event in events:
+        user = users[event.payload['user_id']]
+        chips_in_play = user.player_set\
+                            .filter(seated=True, table__is_private=False)\
+                            .aggregate(Sum('stack'))['stack__sum'] or 0
+
+        mutations, leveledup = update_levels(user,
+                                             earned_chips(user),
+                                             chips_in_play)
+        execute_mutations(mutations)
+
+        if leveledup:
+            push_notification('levels', event.table_id, user.id,
+                              level_up_notification())
+
+
+def increase_hands_played(events: List[OutboxEvent]):
+    hands = Counter(
+        user_id
+        for event in events
+        for user_id in event.payload['user_ids']
+    )
+    # one UPDATE per distinct increment instead of one per player per hand
+    by_count = defaultdict(list)
+    for user_id, count in hands.items():
+        by_count[count].append(user_id)
+    for count, user_ids in by_count.items():
+        UserStats.objects\
+                 .current_season()\
+                 .filter(user_id__in=user_ids)\
+                 .update(hands_played=F('hands_played') + count)
+
+    last_table = {
+        user_id: event.table_id
+        for event in events
+        for user_id in event.payload['user_ids']
+    }
+    new_badges = [
+        (user_id, BADGES_FOR_HANDS[hand_count])
+        for user_id, total in hands_played_totals(hands.keys()).items()
+        for hand_count in crossed(BADGES_FOR_HANDS, total, hands[user_id])
+    ]
+    if not new_badges:
+        return
+
+    users = users_by_id(user_id for user_id, _ in new_badges)
+    badges = BadgeIndex(users.values())
+    mutations = []
+    for user_id, badge_name in new_badges:
+        badge_mutations = award_badge(users[user_id], badge_name,
+                                      badges=badges)
+        if not badge_mutations:
+            continue
+        mutations += badge_mutations
+        push_notification('badges', last_table[user_id], user_id,
+                          badge_notification(badge_name))
+    execute_mutations(mutations)
+
+
+def lifetime_hands_played(user_ids) -> Dict[str, int]:
+    """hands played at every table in every season, see User.hands_played"""
+    return {
+        str(user_id): hands_played or 0
+        for user_id, hands_played in Player.objects
+                                           .filter(user_id__in=user_ids)
+                                           .values_list('user_id')
+                                           .annotate(Sum('n_hands_played'))
+                                           .order_by()
+    }
+
+
+def track_hands_played(events: List[OutboxEvent]):
+    # runs after the hands_played events queued in the same commits
+    hands = Counter(
+        user_id
+        for event in events
+        for user_id in event.payload['user_ids']
+    )
+    last_event = {
+        user_id: event
+        for event in events
+        for user_id in event.payload['user_ids']
+    }
+    # milestones count lifetime hands, unlike the per season badges
+    totals = lifetime_hands_played(hands.keys())
+    users = users_by_id(hands.keys())
+    for user_id, total in totals.items():
+        event = last_event[user_id]
+        for hand_count in crossed(ANALYTIC_HAND_THRESHOLDS,
+                                  total,
+                                  hands[user_id]):
+            transaction.on_commit(partial(
+                track_analytics_event.send,
+                users[user_id].username,
+                f'played {hand_count} hands',
+                topic=event.payload['topic'],
+                stream=event.payload['stream'],
+            ))
+
+
+def compact_hand_histories(events: List[OutboxEvent]):
+    compact_hands({event.payload['hand_history_id'] for event in events})
+
+
+def compact_hands(hand_ids) -> int:
+    """
+    encode the events & actions of finished hands into compressed_log,
+    and cache their frontend summaries
+    """
+    with transaction.atomic():
+        # lock the hands so that concurrent runs (the outbox worker and the
+        #   compact_hand_history command) don't compact the same hand, the
+        #   compressed_log filter is re-checked on the locked rows, so a
+        #   hand compacted in the meantime is skipped
+        hands = list(
+            HandHistory.objects.filter(id__in=hand_ids,
+                                       compressed_log__isnull=True)
+                               .select_for_update(skip_locked=True)
+                               .only('id', 'table_id', 'hand_number',
+                                     'table_json')
+        )
+        hand_ids = [hand.id for hand in hands]
+        if not hand_ids:
+            return 0
+
+        lines = defaultdict(lambda: {'events': [], 'actions': []})
+        events = HandHistoryEvent.prefetch_legacy_subjects(
+            HandHistoryEvent.objects
+                            .filter(hand_history_id__in=hand_ids)
+                            .order_by('id')
+        )
+        for event in events:
+            lines[event.hand_history_id]['events'].append(event.__json__())
+        for action in HandHistoryAction.objects\
+                                       .filter(hand_history_id__in=hand_ids)\
+                                       .select_related('subject__user')\
+                                       .order_by('id'):
+            lines[action.hand_history_id]['actions'].append(action.__json__())
+
+        summaries = defaultdict(dict)
+        for hand in hands:
+            hand.compressed_log = encode_hand(lines[hand.id]['events'],
+                                              lines[hand.id]['actions'])
+            if hand.table_json:
+                summaries[hand.table_id][hand.hand_number] = hand_summary({
+                    'table': hand.table_json,
+                    'events': lines[hand.id]['events'],
+                })
+        # bulk_update doesn't touch the auto_now HandHistory.timestamp
+        HandHistory.objects.bulk_update(hands, ['compressed_log'])
+        HandHistoryEvent.objects.filter(hand_history_id__in=hand_ids).delete()
+        HandHistoryAction.objects.filter(hand_history_id__in=hand_ids).delete()
+
+    for table_id, table_summaries in summaries.items():
+        cache_summaries(table_id, table_summaries)
+    return len(hands)
+
+
+OUTBOX_HANDLERS: Dict[str, OutboxHandler] = {
+    'badges': award_badges,
+    'levels': recalculate_levels,
+    'hands_played': increase_hands_played,
+    'analytics': track_hands_played,
+    'hand_history': compact_hand_histories,
+}
@@ -0,0 +1,133 @@
+"""
+Checks that stored hand histories still replay to the events they logged.
+
+Every hand is replayed on its own from its starting state with the
+ActionReplayer, and the gameplay events the controller dispatches are
+compared line by line to the ones in the log:
+
+    hand (get_log format)  ->  ActionReplayer(actions)  ->  JSONLog
+    hand['events']         ==  JSONLog events             (VERIFIED_EVENTS)
+
+Events that depend on the outside world (timestamps, chat, notifications,
+sit out timers...) are left out of the comparison.  A replayed hand still
+creates and deletes its mock table & players, so each worker process of
+the verify_hand_histories command needs its own db connection.
+"""
+import traceback
+
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, List, Optional, Tuple
+
+from poker.constants import Event
+from poker.handhistory import JSONLog
+from poker.replayer import ActionReplayer
+from poker.subscribers import Subscriber
+
+
+VERIFIED_EVENTS = frozenset((
+    Event.DEAL,
+    Event.POST,
+    Event.POST_DEAD,
+    Event.ANTE,
+    Event.BET,
+    Event.RAISE_TO,
+    Event.CALL,
+    Event.CHECK,
+    Event.FOLD,
+    Event.NEW_STREET,
+    Event.RETURN_CHIPS,
+    Event.WIN,
+    Event.REVEAL_HAND,
+    Event.MUCK,
+    Event.BOUNTY_WIN,
+))
+VERIFIED_EVENT_NAMES = frozenset(event.name for event in VERIFIED_EVENTS)
+
+
+class ReplayLogSubscriber(Subscriber):
+    """keeps the verified events of a replay in a JSONLog that's never saved"""
+    events = VERIFIED_EVENTS
+
+    def __init__(self, accessor):
+        self.log = JSONLog(accessor)
+
+    def dispatch(self, subj, event, changes=None, **kwargs):
+        self.log.write_event(subj, event, **kwargs)
+
+    def commit(self):
+        pass
+
+    def updates_for_broadcast(self, player=None, spectator=None):
+        return {}
+
+
+# the replayed players are mocks with their own ids
+IGNORED_ARGS = frozenset(('player_id',))
+
+
+def normalized(value):
+    """amounts were logged as '1', 1.0 or '1.00' by different releases"""
+    if isinstance(value, (list, tuple)):
+        return [normalized(item) for item in value]
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        try:
+            return Decimal(str(value))
+        except InvalidOperation:
+            pass
+    return value
+
+
+def gameplay_events(events: Iterable[dict]) -> List[Tuple]:
+    return [
+        (event['subj'], event['event'], {
+            key: normalized(value)
+            for key, value in event['args'].items()
+            if key not in IGNORED_ARGS
+        })
+        for event in events
+        if event['event'] in VERIFIED_EVENT_NAMES
+    ]
+
+
+def replay_events(hand: dict) -> List[dict]:
+    """events logged by replaying the actions of a single hand"""
+    replayer = ActionReplayer({'hands': [hand]},
+                              hand_idx=0,
+                              subscriber_types=[ReplayLogSubscriber])
+    try:
+        n_actions = len(hand['actions'])
+        while replayer.action_idx < n_actions:
+            replayer.dispatch_current_action(multi_hand=False)
+        # the replayer stops before wrapping up the hand
+        if replayer.accessor.hand_is_over():
+            replayer.controller.end_hand()
+        log = next(sub.log for sub in replayer.controller.subscribers
+                   if isinstance(sub, ReplayLogSubscriber))
+        return [event for logged in log.hands for event in logged['events']]
+    finally:
+        replayer.delete()
+
+
+def verify_hand(hand: dict) -> Optional[str]:
+    """description of where the replay of a hand diverged, or None"""
+    if 'actions' not in hand:
+        return 'no actions were logged, the hand cannot be replayed'
+    try:
+        replayed = gameplay_events(replay_events(hand))
+    except Exception:
+        return f'replay failed:\n{traceback.format_exc()}'
+
+    logged = gameplay_events(hand['events'])
+    for idx, (expected, actual) in enumerate(zip(logged, replayed)):
+        # older releases logged fewer args, only compare the logged ones
+        subj, event, args = actual
+        actual = (subj, event, {key: args.get(key) for key in expected[2]})
+        if expected != actual:
+            return (f'event #{idx} differs:\n'
+                    f'    logged:   {expected}\n'
+                    f'    replayed: {actual}')
+
+    if len(logged) != len(replayed):
+        return (f'logged {len(logged)} gameplay events '
+                f'but the replay dispatched {len(replayed)}')
+    return None
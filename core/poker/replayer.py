@@ -1,3 +1,4 @@
+import copy
 import json
 
 from collections import OrderedDict
@@ -21,7 +22,24 @@ from poker.subscribers import LogSubscriber
 from oddslingers.utils import DoesNothing, to_json_str
 
 
+def model_state(obj) -> dict:
+    return {
+        field.attname: copy.copy(getattr(obj, field.attname))
+        for field in obj._meta.concrete_fields
+    }
+
+
+def restore_model_state(obj, state: dict):
+    for attname, value in state.items():
+        setattr(obj, attname, copy.copy(value))
+
+
 class HandHistoryReplayer:
+    # in-memory snapshots of the game are kept every this many steps of
+    #   the current hand, so stepping back or seeking within the hand
+    #   restores the nearest one instead of replaying from the start
+    snapshot_every = 1
+
     def __init__(self, json_log,
                        hand_idx=None,
                        hand_number=None,
@@ -52,6 +70,7 @@ class HandHistoryReplayer:
         self.players = None
         self.controller = None
         self.logging = logging
+        self._snapshots = {}
 
         if session_id is not None:
             self.session_id = session_id
@@ -91,6 +110,7 @@ class HandHistoryReplayer:
                   'skip_to_hand_idx() or skip_to_hand_number()?'
             raise ValueError(msg)
         self.delete()
+        self._snapshots = {}
 
         table_dict = hand_history['table'].copy()
         table_name = f'Replayer-{table_dict.pop("name")}-{self.session_id}'
@@ -206,6 +226,46 @@ class HandHistoryReplayer:
     def current_hand(self):
         return self.hands[self.hand_idx]
 
+    def _save_snapshot(self, kind: str, idx: int):
+        """
+        Copy the mock table & player fields after step idx of the current
+        hand.  Nothing is saved when logging or with subscribers, the log
+        rows written and the steps subscribers saw since the snapshot
+        couldn't be taken back.
+        """
+        if self.logging or self.subscriber_types or idx % self.snapshot_every:
+            return
+        self._snapshots[(kind, idx)] = {
+            'table': model_state(self.table),
+            'players': [
+                (player, model_state(player))
+                for player in self.accessor.players
+            ],
+            'pending_transfers': list(self.accessor.pending_transfers),
+        }
+
+    def _nearest_snapshot(self, kind: str, idx: int):
+        """index of the latest snapshot at or before step idx, or None"""
+        return max(
+            (
+                snapshot_idx
+                for snapshot_kind, snapshot_idx in self._snapshots
+                if snapshot_kind == kind and snapshot_idx <= idx
+            ),
+            default=None,
+        )
+
+    def _restore_snapshot(self, kind: str, idx: int):
+        snapshot = self._snapshots[(kind, idx)]
+        restore_model_state(self.table, snapshot['table'])
+        for player, state in snapshot['players']:
+            restore_model_state(player, state)
+
+        # the accessor shares its players list with the replayer
+        self.players = [player for player, _ in snapshot['players']]
+        self.accessor.players = self.players
+        self.accessor.pending_transfers = list(snapshot['pending_transfers'])
+
     def skip_to_end_of_hand(self):
         while True:
             try:
@@ -510,10 +570,19 @@ class EventReplayer(HandHistoryReplayer):
         )
 
     def _skip_to_event(self, idx):
-        self.reset_to_hand(self.current_hand())
-        for event in self.current_hand()['events'][:idx]:
+        start = self._nearest_snapshot('event', idx)
+        if start is None:
+            start = 0
+            self.reset_to_hand(self.current_hand())
+            self._save_snapshot('event', self.event_idx)
+        else:
+            self._restore_snapshot('event', start)
+
+        events = self.current_hand()['events'][start:idx]
+        for event_idx, event in enumerate(events, start):
             if not self._is_skip_event(event):
                 self.dispatch_event(event)
+                self._save_snapshot('event', event_idx + 1)
         self.event_idx = idx
         self.go_to_next_nonskip_event()
 
@@ -521,6 +590,7 @@ class EventReplayer(HandHistoryReplayer):
         # import ipdb; ipdb.set_trace()
         self.dispatch_event(self.current_event())
         self.event_idx += 1
+        self._save_snapshot('event', self.event_idx)
         self.go_to_next_nonskip_event()
 
     def step_back(self):
@@ -529,7 +599,7 @@ class EventReplayer(HandHistoryReplayer):
 
         self.event_idx -= 1
         self.go_to_next_nonskip_event(backwards=True)
-        # must replay the hand from the beginning
+        # restores the snapshot taken when we first got there
         self._skip_to_event(self.event_idx)
 
 
@@ -592,6 +662,8 @@ class ActionReplayer(EventReplayer):
             #   which occurs after the SIT_IN action in this edgecase
             self.action_idx = 1
 
+        self._save_snapshot('action', self.action_idx)
+
         if self.verbose:
             hand_number = self.controller.table.hand_number
             print(f'\t ====Reset to hand #{hand_number}====')
@@ -669,15 +741,22 @@ class ActionReplayer(EventReplayer):
             self.controller.mocked_forced_flip(deck_str=flip_deck)
 
     def _skip_to_action(self, idx):
-        self.action_idx = 0
-        self.reset_to_hand(self.current_hand())
         n_actions = len(self.current_hand()['actions'])
 
         if idx < 0:
             idx = n_actions - idx
 
+        start = self._nearest_snapshot('action', idx)
+        if start is None:
+            self.action_idx = 0
+            self.reset_to_hand(self.current_hand())
+        else:
+            self._restore_snapshot('action', start)
+            self.action_idx = start
+
         while self.action_idx < idx:
             self.dispatch_current_action()
+            self._save_snapshot('action', self.action_idx)
 
     def step_forward(self, multi_hand=True):
         try:
@@ -686,6 +765,7 @@ class ActionReplayer(EventReplayer):
             #   or when multiple actions are dispatched at once because
             #   preset_action(s) are dispatched by `step`
             self.dispatch_current_action(multi_hand)
+            self._save_snapshot('action', self.action_idx)
 
             if self.verbose:
                 print(f'replayer gamestate:')
@@ -723,6 +803,7 @@ class ActionReplayer(EventReplayer):
         self.controller.end_hand()
         self.hand_idx += 1
         self.action_idx = 0
+        self._snapshots = {}
 
         self.players += self._takeseat_players(
             self.current_hand(),
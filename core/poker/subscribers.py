@@ -1,25 +1,24 @@
 from collections import defaultdict
 from decimal import Decimal
-from typing import Union
+from typing import (
+    Dict, FrozenSet, Iterable, List, Optional, Tuple, Union,
+)
 
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from django.db.models import Sum
 
 from oddslingers.utils import camelcase_to_capwords
-from oddslingers.tasks import track_analytics_event
 from oddslingers.mutations import MutationList, execute_mutations
 
 from banker.mutations import create_transfer
 
 import poker.animations as anims
-from poker.constants import (
-    Event, AnimationEvent, HAND_SAMPLING_CAP, ANALYTIC_HAND_THRESHOLDS,
-)
+from poker.constants import Event, AnimationEvent, HAND_SAMPLING_CAP
 from poker.models import (
-    ChatLine, Player, PokerTable, HandHistory, TournamentResult
+    ChatLine, Player, PokerTable, TournamentResult, OutboxEvent
 )
-from poker.level_utils import update_levels, earned_chips
+from poker.chat import chatline_json, render_chatline, cache_chatlines
+from poker.outbox import outbox_event, queue_outbox_events, pop_notifications
 
 User = get_user_model()
 
@@ -36,8 +35,28 @@ class Subscriber:
     the order in which Subscribers receive events is not guaranteed,
     but they always receive them after changes have been applied to
     the subj model.
+
+    Subscribers only receive the events (and subject types) they declare
+    below, see SubscriberList.
     """
 
+    # events to dispatch to this subscriber, None means all of them
+    events: Optional[FrozenSet[Event]] = None
+
+    # only dispatch events whose subj is one of these, None means any subj
+    subject_types: Optional[Tuple[type, ...]] = None
+
+    # subscriber types that have to receive each event before this one
+    dispatch_after: Tuple[type, ...] = ()
+
+    @classmethod
+    def wants(cls, event: Event, subj_type: type) -> bool:
+        if cls.events is not None and event not in cls.events:
+            return False
+        if cls.subject_types is not None:
+            return issubclass(subj_type, cls.subject_types)
+        return True
+
     def dispatch(self, subj, event, changes=None, **kwargs):
         desc = 'This should decide what to do based on the event '\
                'passed from the controller. Events are received '\
@@ -56,6 +75,84 @@ class Subscriber:
         raise NotImplementedError(desc)
 
 
+class SubscriberList(list):
+    """
+    The subscribers of a GameController, in dispatch order.
+
+    Keeps a routing table of (event, subj type): [interested subscribers],
+    filled in as events come in, so each event is only dispatched to the
+    subscribers that declared it.  The table is reset and the dispatch_after
+    ordering is checked whenever the list is changed.
+    """
+
+    def __init__(self, subscribers: Iterable[Subscriber]=()):
+        super().__init__(subscribers)
+        self._changed()
+
+    def _changed(self):
+        self.routes: Dict[Tuple[Event, type], List[Subscriber]] = {}
+
+        seen_types: Tuple[type, ...] = ()
+        for sub in self:
+            for required in sub.dispatch_after:
+                if not issubclass(required, seen_types):
+                    raise ValueError(
+                        f'Cannot dispatch to {type(sub).__name__} before '
+                        f'{required.__name__} because of '
+                        f'{type(sub).__name__} dependency on it.'
+                    )
+            seen_types += (type(sub),)
+
+    def for_event(self, subj, event: Event) -> List[Subscriber]:
+        key = (event, type(subj))
+        try:
+            return self.routes[key]
+        except KeyError:
+            self.routes[key] = [
+                sub for sub in self if sub.wants(event, type(subj))
+            ]
+            return self.routes[key]
+
+    # any change to the list resets the routing table
+
+    def append(self, sub: Subscriber):
+        super().append(sub)
+        self._changed()
+
+    def extend(self, subs: Iterable[Subscriber]):
+        super().extend(subs)
+        self._changed()
+
+    def insert(self, idx: int, sub: Subscriber):
+        super().insert(idx, sub)
+        self._changed()
+
+    def remove(self, sub: Subscriber):
+        super().remove(sub)
+        self._changed()
+
+    def pop(self, *args) -> Subscriber:
+        sub = super().pop(*args)
+        self._changed()
+        return sub
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __iadd__(self, subs: Iterable[Subscriber]):
+        self.extend(subs)
+        return self
+
+
 class MutationSubscriber(Subscriber):
     def __init__(self, accessor):
         self.accessor = accessor
@@ -69,7 +166,42 @@ class MutationSubscriber(Subscriber):
         return {}
 
 
+class OutboxSubscriber(Subscriber):
+    """
+    Queues its work as OutboxEvents in the commit transaction instead of
+    doing it in the dispatch/commit path, see poker.outbox.
+    """
+    def __init__(self, accessor):
+        self.accessor = accessor
+        self.outbox: List[OutboxEvent] = []
+
+    def queue(self, kind: str, *key_parts, **payload):
+        # the idempotency key: one event per kind, table, hand & key_parts
+        table = self.accessor.table
+        key = ':'.join(str(part) for part in (
+            table.id, table.hand_number, *key_parts
+        ))
+        self.outbox.append(
+            outbox_event(kind, key, table_id=table.id, **payload)
+        )
+
+    def commit(self):
+        queue_outbox_events(self.outbox)
+        self.outbox = []
+
+    def notifications_from_outbox(self, kind: str) -> Dict[Player, list]:
+        """notifications for this table's players pushed by the workers"""
+        notifications = defaultdict(list)
+        for item in pop_notifications(kind, self.accessor.table.id):
+            player = self.accessor.player_by_user_id(item['user_id'])
+            if player:
+                notifications[player].append(item['notification'])
+        return notifications
+
+
 class NotificationSubscriber(Subscriber):
+    events = frozenset((Event.NOTIFICATION,))
+
     def __init__(self, accessor):
         self.notifications = defaultdict(list)
         self.to_broadcast = defaultdict(list)
@@ -101,6 +233,11 @@ class NotificationSubscriber(Subscriber):
 
 
 class ChatSubscriber(Subscriber):
+    events = frozenset((
+        Event.CHAT, Event.FOLD, Event.BET, Event.RAISE_TO, Event.CALL,
+        Event.CHECK, Event.DEAL,
+    ))
+
     def __init__(self, accessor):
         self.accessor = accessor
         # Who this chat belongs to
@@ -176,30 +313,31 @@ class ChatSubscriber(Subscriber):
         return new_line
 
     def commit(self):
-        output = []
         self.to_broadcast = defaultdict(dict)
         self.to_broadcast['all'] = {'chat': []}
 
         for player in self.accessor.seated_players():
             self.to_broadcast[player.id] = {'chat': []}
 
-        for chat in self.chats:
-            chat_line = self.create_chatline(**chat)
-            output.append(chat_line)
-            self.to_broadcast['all']['chat'].append(
-                json_for_chatline(chat_line, accessor=self.accessor)
-            )
+        # one INSERT for all the lines of the commit, it also sets their
+        #   timestamps so the broadcast json matches what's saved
+        output = [self.create_chatline(**chat) for chat in self.chats]
+        ChatLine.objects.bulk_create(output)
+        lines = [chatline_json(chat_line) for chat_line in output]
+        cache_chatlines(self.target.chat_history_id, lines)
+        self.to_broadcast['all']['chat'] = [
+            render_chatline(line, accessor=self.accessor)
+            for line in lines
+        ]
 
         for player, deal_chat in self.cards_dealt_chat.items():
             chat_line = self.create_chatline(**deal_chat)
             self.to_broadcast[player.id] = {
-                'chat': [json_for_chatline(chat_line, accessor=self.accessor)]
+                'chat': [render_chatline(chatline_json(chat_line),
+                                         accessor=self.accessor)]
             }
         self.chats = []
         self.cards_dealt_chat = {}
-        for chat in output:
-            chat.save()
-
 
     def updates_for_broadcast(self, player=None, spectator=None):
         receiver = 'all'
@@ -217,29 +355,6 @@ class TournamentChatSubscriber(ChatSubscriber):
         self.target = self.accessor.table.tournament
 
 
-def json_for_chatline(chatline, accessor=None, tourney_entrants=None):
-    species = ''
-    output = chatline.__json__()
-    output.pop('user')
-    speaker = chatline.speaker
-    is_player = accessor and speaker in (
-        p.username for p in accessor.seated_players()
-    )
-    is_entrant = tourney_entrants and speaker in tourney_entrants
-
-    if chatline.user and chatline.user.is_staff:
-        species = 'staff'
-    elif is_player or is_entrant:
-        species = 'player'
-    elif chatline.speaker.lower() in ['dealer', 'winner_info']:
-        species = 'dealer'
-    else:
-        species = 'observer'
-
-    output['species'] = species
-    return output
-
-
 class LogSubscriber(Subscriber):
     def __init__(self, log):
         self.log = log
@@ -330,6 +445,7 @@ class AnimationSubscriber(Subscriber):
 
 
 class BankerSubscriber(MutationSubscriber):
+    events = frozenset((Event.CREATE_TRANSFER,))
 
     def dispatch(self, subj, event, changes=None, **kwargs):
         # Tutorials ignore the cashier altogether.
@@ -340,11 +456,12 @@ class BankerSubscriber(MutationSubscriber):
             self.mutations += create_transfer(**kwargs)
 
 
-class LevelSubscriber(MutationSubscriber):
+class LevelSubscriber(OutboxSubscriber):
+    events = frozenset((Event.WIN, Event.SHOWDOWN_COMPLETE))
+
     def __init__(self, accessor):
         super().__init__(accessor)
         self.winners = set()
-        self.notifications = defaultdict(list)
         self.to_broadcast = defaultdict(list)
 
     def dispatch(self, subj, event, changes=None, **kwargs):
@@ -363,37 +480,13 @@ class LevelSubscriber(MutationSubscriber):
         if plyr.is_robot:
             return
 
-        all_winnings = plyr.user\
-                           .player_set\
-                           .filter(seated=True, table__is_private=False)\
-                           .exclude(id=plyr.id)\
-                           .aggregate(Sum('stack'))['stack__sum'] or 0
-
-        if not plyr.table.is_private:
-            all_winnings += plyr.stack
-
-        mutations, leveledup = update_levels(
-            plyr.user,
-            earned_chips(plyr.user),
-            all_winnings
-        )
-        self.mutations += mutations
-
-        if leveledup:
-            msg = 'New level unlocked!'
-            self.notifications[plyr].append({
-                'type': 'level_up',
-                'bsStyle': 'success',
-                'ts': timezone.now(),
-                'title': 'Congratulations!',
-                'description': msg,
-                'icon': '/static/images/logo.png',
-            })
+        # levels are recalculated from the committed stacks by the
+        #   outbox worker, level ups come back in a later broadcast
+        self.queue('levels', plyr.user.id, user_id=plyr.user.id)
 
     def commit(self):
         super().commit()
-        self.to_broadcast = self.notifications
-        self.notifications = defaultdict(list)
+        self.to_broadcast = self.notifications_from_outbox('levels')
 
     def updates_for_broadcast(self, player=None, spectator=None):
         if player:
@@ -415,49 +508,42 @@ class InMemoryLogSubscriber(Subscriber):
         return {}
 
 
-class AnalyticsEventSubscriber(Subscriber):
+class AnalyticsEventSubscriber(OutboxSubscriber):
+    events = frozenset((Event.END_HAND,))
+    subject_types = (PokerTable,)
+
     def __init__(self, accessor):
-        self.accessor = accessor
+        super().__init__(accessor)
         table = accessor.table
         is_cashtable = table.tournament is None
-        self.template = {
-            'username': None,
-            'event': 'something went wrong',
-            'topic': table.zulip_topic if is_cashtable else table.tournament.zulip_topic,
-            'stream': "Tables" if is_cashtable else "Tournaments",
-        }
-        self.to_track = []
+        self.topic = table.zulip_topic if is_cashtable \
+                     else table.tournament.zulip_topic
+        self.stream = "Tables" if is_cashtable else "Tournaments"
 
     def dispatch(self, subj, event, changes=None, **kwargs):
         if event == Event.END_HAND and isinstance(subj, PokerTable):
-            self.to_track += self._track_analytics_for_hands_played()
+            self._track_analytics_for_hands_played()
 
         # too noisy with many ysers, uncomment if you need it for debugging
         # elif event == Event.LEAVE_SEAT and isinstance(subj, Player):
-        #     event_data = self.template.copy()
-        #     event_data.update({
-        #         'username': subj.user.username,
-        #         'event': 'is leaving' if subj.seated else 'left seat',
-        #     })
-        #     self.to_track.append(event_data)
+        #     track_analytics_event.send(
+        #         subj.user.username,
+        #         'is leaving' if subj.seated else 'left seat',
+        #         topic=self.topic,
+        #         stream=self.stream,
+        #     )
 
     def _track_analytics_for_hands_played(self):
-        events_data = []
-        for plyr in self.accessor.active_players():
-            if plyr.user and not plyr.user.is_robot:
-                if plyr.user.hands_played in ANALYTIC_HAND_THRESHOLDS:
-                    event_data = self.template.copy()
-                    event_data.update({
-                        'username': plyr.user.username,
-                        'event': f'played {plyr.user.hands_played} hands',
-                    })
-                    events_data.append(event_data)
-        return events_data
-
-
-    def commit(self):
-        while self.to_track:
-            track_analytics_event.send(**self.to_track.pop())
+        # ANALYTIC_HAND_THRESHOLDS are checked by the outbox worker
+        user_ids = [
+            plyr.user.id for plyr in self.accessor.active_players()
+            if plyr.user and not plyr.user.is_robot
+        ]
+        if user_ids:
+            self.queue('analytics',
+                       user_ids=user_ids,
+                       topic=self.topic,
+                       stream=self.stream)
 
     def updates_for_broadcast(self, player=None, spectator=None):
         return {}
@@ -469,12 +555,10 @@ class TableStatsSubscriber(Subscriber):
         self.table_stats = accessor.table.stats
 
     def dispatch(self, subj, event, changes=None, **kwargs):
-        self.table_stats.avg_stack = self._get_avg_stack()
-
         if event == Event.NEW_HAND:
             self._increase_num_samples()
-            hands_per_hour = self._get_hands_per_hour()
-            self.table_stats.hands_per_hour = hands_per_hour
+            self._add_hand_timestamp()
+            self.table_stats.hands_per_hour = self._get_hands_per_hour()
 
         elif event == Event.DEAL and isinstance(subj, PokerTable):
             if self.accessor.is_flop():
@@ -499,7 +583,6 @@ class TableStatsSubscriber(Subscriber):
                 )
                 self.table_stats.players_per_flop_pct = players_per_flop_pct
 
-
     def _get_rolling_avg(self, num_samples, new_sample, prev_avg):
         try:
             prev_avg_sample = (num_samples - 1) * (prev_avg or 0)
@@ -520,6 +603,26 @@ class TableStatsSubscriber(Subscriber):
         if self.table_stats.num_samples < HAND_SAMPLING_CAP:
             self.table_stats.num_samples += 1
 
+    def _add_hand_timestamp(self):
+        # ring buffer of the start times of the last HAND_SAMPLING_CAP + 2
+        #   hands: the window opens at the oldest one and closes at the
+        #   newest, and the HAND_SAMPLING_CAP hands between are sampled
+        timestamps = self.table_stats.hand_timestamps
+        timestamps.append(timezone.now().timestamp())
+        del timestamps[:-(HAND_SAMPLING_CAP + 2)]
+
+    def _get_hands_per_hour(self):
+        timestamps = self.table_stats.hand_timestamps
+        len_hands = min(len(timestamps) - 1, HAND_SAMPLING_CAP)
+        if len_hands < 1:
+            return 0
+
+        elapsed_hours = (timestamps[-1] - timestamps[0]) / 3600
+        try:
+            return round(len_hands / elapsed_hours, 2)
+        except ZeroDivisionError:
+            return None
+
     def _get_players_per_flop_pct(self):
         showdown_players = len(self.accessor.showdown_players())
         active_players = len(self.accessor.active_players())
@@ -531,31 +634,9 @@ class TableStatsSubscriber(Subscriber):
             prev_avg=self.table_stats.players_per_flop_pct
         )
 
-    def _get_hands_per_hour(self):
-        hands = HandHistory.objects.filter(table=self.accessor.table)
-        hands_per_hour = 0
-        if hands.exists():
-            initial_hand = self._get_initial_hand(hands)
-            len_hands = min(hands.count(), HAND_SAMPLING_CAP)
-            end_time = timezone.now()
-            delta_timestamps = end_time - initial_hand.timestamp
-            elapsed_hours = delta_timestamps.total_seconds() / 3600
-            try:
-                hands_per_hour = len_hands / elapsed_hours
-                hands_per_hour = round(hands_per_hour, 2)
-            except ZeroDivisionError:
-                hands_per_hour = None
-        return hands_per_hour
-
-    def _get_initial_hand(self, hands):
-        last_hand = hands.latest('hand_number')
-        fixed_hand_number = last_hand.hand_number - HAND_SAMPLING_CAP
-        hand_number = max(0, fixed_hand_number)
-        initial_hand = hands.filter(hand_number=hand_number).first()\
-                       or hands.first()
-        return initial_hand
-
     def commit(self):
+        # only the stacks at the end of the action matter
+        self.table_stats.avg_stack = self._get_avg_stack()
         self.table_stats.save()
 
     def updates_for_broadcast(self, player=None, spectator=None):
@@ -566,6 +647,8 @@ class TableStatsSubscriber(Subscriber):
 
 
 class TournamentResultsSubscriber(Subscriber):
+    events = frozenset((Event.LEAVE_SEAT, Event.FINISH_TOURNAMENT))
+
     def __init__(self, accessor):
         self.tournament = accessor.table.tournament
         self.current_results = TournamentResult.objects.filter(
@@ -3,6 +3,7 @@ import os
 import sys
 import traceback
 
+from time import time
 from datetime import timedelta
 from typing import Optional, List
 
@@ -46,21 +47,39 @@ from .heartbeat_utils import (
 
 ### Heartbeat Queue Functions
 
+# added to every queued message to measure how long it waited in the queue
+QUEUED_TIMESTAMP_KEY = 'QUEUED_TIMESTAMP'
+
+def _strip_queued_timestamp(dispatch: Optional[dict]) -> Optional[dict]:
+    if dispatch is None:
+        return None
+    return {k: v for k, v in dispatch.items() if k != QUEUED_TIMESTAMP_KEY}
+
 def queue_tablebeat_dispatch(table_id: str, action: dict) -> None:
-    return queue_redis_dispatch(f'{settings.REDIS_TABLEBEAT_KEY}-{table_id}', action)
+    return queue_redis_dispatch(
+        f'{settings.REDIS_TABLEBEAT_KEY}-{table_id}',
+        {**action, QUEUED_TIMESTAMP_KEY: time()},
+    )
 
-def pop_tablebeat_dispatch(table_id: str) -> Optional[dict]:
+def pop_tablebeat_dispatch(table_id: str,
+                           with_timestamp: bool=False) -> Optional[dict]:
     dispatch = pop_redis_dispatch(f'{settings.REDIS_TABLEBEAT_KEY}-{table_id}')
     assert dispatch is None or isinstance(dispatch, dict)
-    return dispatch
+    return dispatch if with_timestamp else _strip_queued_timestamp(dispatch)
 
-def peek_tablebeat_dispatch(table_id: str) -> Optional[dict]:
+def peek_tablebeat_dispatch(table_id: str,
+                            with_timestamp: bool=False) -> Optional[dict]:
     dispatch = peek_redis_dispatch(f'{settings.REDIS_TABLEBEAT_KEY}-{table_id}')
     assert dispatch is None or isinstance(dispatch, dict)
-    return dispatch
+    return dispatch if with_timestamp else _strip_queued_timestamp(dispatch)
 
 def list_tablebeat_dispatch(table_id: str) -> List[dict]:
-    return list_redis_dispatch(f'{settings.REDIS_TABLEBEAT_KEY}-{table_id}')
+    return [
+        _strip_queued_timestamp(dispatch)
+        for dispatch in list_redis_dispatch(
+            f'{settings.REDIS_TABLEBEAT_KEY}-{table_id}'
+        )
+    ]
 
 ### Heartbeat Process Management
 
@@ -194,7 +213,7 @@ def tablebeat_loop(table_id: str, loop=True, verbose=True, peek=True):
         # get any table IO from queue (peek, then pop once finished to
         #   guarantee at-least-once)
         if not settings.IS_TESTING or peek:
-            message = peek_tablebeat_dispatch(table_id)
+            message = peek_tablebeat_dispatch(table_id, with_timestamp=True)
         else:
             message = None
 
@@ -302,7 +321,8 @@ def tablebeat_loop(table_id: str, loop=True, verbose=True, peek=True):
 
         finally:
             if message is not None:
-                popped_message = pop_tablebeat_dispatch(table_id)
+                popped_message = pop_tablebeat_dispatch(table_id,
+                                                        with_timestamp=True)
                 assert popped_message == message, (
                     'Message at top of queue was changed '
                     'while it was still being processed!')
@@ -330,6 +350,7 @@ def tablebeat_step(controller, message: dict=None, verbose=True):
     """logic for a single step of the table heartbeat loop"""
     # print('tablebeat_step message:', message)
     if message:
+        queued_timestamp = message.pop(QUEUED_TIMESTAMP_KEY, None)
         debug_print_io(out=False, content=message)
 
         # if table IO came in, dispatch it to the controller as an action
@@ -360,7 +381,8 @@ def tablebeat_step(controller, message: dict=None, verbose=True):
                 )
                 controller.dispatch(ai_action, **kwargs)
         else:
-            controller.dispatch(action, **message)
+            controller.dispatch(action, queued_timestamp=queued_timestamp,
+                                **message)
 
     else:
         # fix any sat-out bots -- allows recovery if a heartbeat error
@@ -679,3 +679,65 @@ class ActiveFirstToActPlayerTest(GenericTableTest):
 
         assert self.accessor.first_to_act_pos() == 4
         assert self.accessor.first_to_act() == self.pirate_player
+
+
+class MemoizedAccessorTest(GenericTableTest):
+    def test_memo_is_invalidated_by_dispatch(self):
+        acc = self.accessor
+        self.controller.step()
+        first = acc.next_to_act()
+
+        with acc.memoizing():
+            with self.assertNumQueries(0):
+                assert acc.next_to_act() == first
+                # modifying a returned list doesn't touch the cached one
+                acc.active_players().pop()
+                assert len(acc.active_players()) == 4
+                pot = acc.current_pot()
+
+            self.controller.player_dispatch('call', player_id=first.id)
+            assert acc.next_to_act() != first
+            assert acc.current_pot() > pot
+
+        # nothing is cached outside of a dispatch
+        assert acc._memo is None
+        seated = len(acc.seated_players())
+        self.pirate_player.seated = False
+        assert len(acc.seated_players()) == seated - 1
+
+
+class SeatArrayTest(GenericTableTest):
+    def test_seats_from(self):
+        acc = self.accessor
+        seats = list(acc.seats_from(2))
+        self.assertEqual([pos for pos, _ in seats], [2, 3, 4, 5, 0, 1])
+        self.assertEqual(
+            [plyr for _, plyr in seats],
+            [self.ajfenix_player, self.cowpig_player, None, None,
+             self.pirate_player, self.cuttlefish_player],
+        )
+
+    def test_lookups_dont_scan_the_db(self):
+        acc = self.accessor
+        with self.assertNumQueries(0):
+            assert acc.player_by_player_id(str(self.cowpig_player.id)) \
+                    == self.cowpig_player
+            assert acc.player_by_user_id(self.ajfenix.id) \
+                    == self.ajfenix_player
+            assert acc.player_by_player_id('not a player') is None
+
+    def test_seat_array_follows_take_and_leave_seat(self):
+        acc = self.accessor
+        with acc.memoizing():
+            assert acc.players_at_position(3) == self.cowpig_player
+            self.controller.internal_dispatch([
+                (self.cowpig_player, Event.LEAVE_SEAT, {'immediate': True}),
+            ])
+            assert acc.players_at_position(3) is None
+            assert self.cowpig_player not in acc.seated_players()
+
+            self.controller.internal_dispatch([
+                (self.cowpig_player, Event.TAKE_SEAT, {'position': 5}),
+            ])
+            assert acc.players_at_position(5) == self.cowpig_player
+            assert acc.seats()[3] is None
@@ -2,6 +2,7 @@ import random
 
 from decimal import Decimal
 from random import randint
+from time import time
 from datetime import timedelta
 
 from django.test import TestCase
@@ -26,6 +27,9 @@ from poker.subscribers import (
     LogSubscriber
 )
 from poker.handhistory import DBLog
+from poker.dispatch_timing import (NULL_TIMER, dispatch_timing_histograms,
+                                   reset_dispatch_timing, redis_timing,
+                                   REDIS_TIMING_KEY, TABLE_TIMING_TTL)
 from poker.bots import get_robot_move
 from poker.game_utils import fuzzy_get_table, has_recent_human_activity
 
@@ -3201,3 +3205,43 @@ class TestPresetCall(TableWithChipsTest):
         self.controller.dispatch('call', player_id=ajfenix.id, amt=10)
 
         assert ajfenix.preset_call == Decimal(0)
+
+
+class DispatchTimingTest(GenericTableTest):
+    def setUp(self):
+        super().setUp()
+        reset_dispatch_timing(self.table.id)
+
+    def tearDown(self):
+        reset_dispatch_timing(self.table.id)
+
+    def test_dispatch_records_phase_timing(self):
+        self.controller.step()
+        to_act = self.accessor.next_to_act()
+        with self.settings(DISPATCH_TIMING_ENABLED=True,
+                           DISPATCH_TIMING_SAMPLE_RATE=1.0):
+            self.controller.dispatch(
+                'fold',
+                player_id=to_act.id,
+                queued_timestamp=time() - 0.5,
+            )
+
+        histograms = dispatch_timing_histograms(self.table.id)
+        for phase in ('total', 'queue_wait', 'player_dispatch', 'step',
+                      'commit', 'commit.accessor', 'broadcast'):
+            assert histograms[phase]['count'] == 1, phase
+        assert histograms['queue_wait']['p50_ms'] >= 500
+        assert histograms['total']['queries_per_call'] > 0
+        assert self.controller.timer is NULL_TIMER
+
+        # the histograms of idle tables expire
+        table_key = REDIS_TIMING_KEY.format(self.table.id)
+        assert 0 < redis_timing.ttl(table_key) <= TABLE_TIMING_TTL
+
+    def test_dispatch_timing_disabled(self):
+        self.controller.step()
+        to_act = self.accessor.next_to_act()
+        with self.settings(DISPATCH_TIMING_ENABLED=False):
+            self.controller.dispatch('fold', player_id=to_act.id)
+
+        assert dispatch_timing_histograms(self.table.id) == {}
@@ -1,18 +1,25 @@
+import gzip
 import json
+import tempfile
 
 from os import remove, path
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from oddslingers.utils import ExtendedEncoder
+from oddslingers.utils import ExtendedEncoder, to_json_str
 
 from poker.controllers import HoldemController
 from poker.handhistory import JSONLog, DBLog, MultiLog
-from poker.models import HandHistory, HandHistoryEvent, HandHistoryAction
+from poker.models import (HandHistory, HandHistoryEvent, HandHistoryAction,
+                          ArchivedHandHistory)
 from poker.replayer import EventReplayer, ActionReplayer
 from poker.tests.test_controller import GenericTableTest
 from poker.subscribers import LogSubscriber
-from poker.constants import HH_TEST_PATH
+from poker.constants import HH_TEST_PATH, TABLE_SUBJECT_REPR, SIDE_EFFECT_SUBJ
+from poker.hand_encoding import encode_hand, decode_hand
+from poker.outbox import process_outbox_events, compact_hands
+from poker.hand_archive import archive_hands
+from poker.hand_summaries import REDIS_SUMMARIES_KEY, redis_summaries
 
 
 class JSONLogTest(GenericTableTest):
@@ -133,6 +140,199 @@ class DBLogUnsavedObjectsTest(DBLogTest):
         assert len(unsaved_hands[1]['actions']) == 1
 
 
+class DBLogCompressedHandsTest(DBLogTest):
+    def play_one_hand(self):
+        ctrl = self.controller
+        acc = ctrl.accessor
+        ctrl.step()
+        ctrl.dispatch('raise_to', player_id=acc.next_to_act().id, amt=10)
+        ctrl.dispatch('call', player_id=acc.next_to_act().id)
+        ctrl.dispatch('call', player_id=acc.next_to_act().id)
+        ctrl.dispatch('fold', player_id=acc.next_to_act().id)
+        ctrl.step()
+        ctrl.dispatch('bet', player_id=acc.next_to_act().id, amt=10)
+        ctrl.dispatch('fold', player_id=acc.next_to_act().id)
+        ctrl.dispatch('fold', player_id=acc.next_to_act().id)
+        ctrl.step()
+
+    def test_finished_hands_are_compressed(self):
+        with override_settings(ENABLE_DRAMATIQ=True):
+            self.play_one_hand()
+        hand = HandHistory.objects.order_by('hand_number').first()
+        assert hand.compressed_log is None
+        before = self.log.get_log(player='all')['hands']
+
+        process_outbox_events()
+
+        hand = HandHistory.objects.get(id=hand.id)
+        assert hand.compressed_log is not None
+        assert not hand.events().exists()
+        assert not hand.actions().exists()
+        assert self.log.get_log(player='all')['hands'] == before
+
+        with self.assertNumQueries(1):
+            hand_json = HandHistory.objects.get(id=hand.id).filtered_json()
+        assert len(hand_json['actions']) == 7
+        assert len(hand_json['events']) == len(before[0]['events'])
+
+    def test_hands_are_compacted_once(self):
+        with override_settings(ENABLE_DRAMATIQ=True):
+            self.play_one_hand()
+        hand = HandHistory.objects.order_by('hand_number').first()
+        before = self.log.get_log(player='all')['hands']
+
+        assert compact_hands([hand.id]) == 1
+        compressed_log = HandHistory.objects.get(id=hand.id).compressed_log
+
+        # e.g. the compact_hand_history command after the outbox worker
+        assert compact_hands([hand.id]) == 0
+        hand = HandHistory.objects.get(id=hand.id)
+        assert bytes(hand.compressed_log) == bytes(compressed_log)
+        assert self.log.get_log(player='all')['hands'] == before
+
+    def test_events_are_read_without_their_subjects(self):
+        with override_settings(ENABLE_DRAMATIQ=True):
+            self.play_one_hand()
+        hand = HandHistory.objects.order_by('hand_number').first()
+
+        # one query for the actions, one for the events
+        with self.assertNumQueries(2):
+            hand_json = hand.filtered_json()
+        subjects = {event['subj'] for event in hand_json['events']}
+        usernames = {
+            player.username
+            for player in self.controller.accessor.players
+        }
+        assert subjects == {TABLE_SUBJECT_REPR, SIDE_EFFECT_SUBJ, *usernames}
+
+    def test_legacy_events_prefetch_their_subjects(self):
+        with override_settings(ENABLE_DRAMATIQ=True):
+            self.play_one_hand()
+        hand = HandHistory.objects.order_by('hand_number').first()
+        hand_json = hand.filtered_json()
+        # events written before subject_repr existed
+        hand.events().update(subject_kind=None, subject_repr=None)
+
+        # the content types and one query per subject type, plus each
+        #   player's user, however many events there are
+        with self.assertNumQueries(2 + 1 + 3 + 4):
+            assert hand.filtered_json() == hand_json
+
+    def test_current_hand_log_is_kept_in_memory(self):
+        ctrl = self.controller
+        acc = ctrl.accessor
+        self.play_one_hand()
+        ctrl.dispatch('raise_to', player_id=acc.next_to_act().id, amt=10)
+
+        self.log.current_hand_log(player='all')
+        ctrl.dispatch('call', player_id=acc.next_to_act().id)
+        with self.assertNumQueries(0):
+            current = self.log.current_hand_log(player='all')['hands']
+
+        # same as the current hand read back from the db
+        fresh = DBLog(acc).current_hand_log(player='all')['hands']
+        assert current == fresh
+        assert len(current[0]['actions']) == 2
+
+        # the lines handed out are copies of the in-memory ones
+        current[0]['actions'][-1]['ts'] = None
+        current[0]['events'][-1]['ts'] = None
+        assert self.log.current_hand_log(player='all')['hands'] == fresh
+
+    def test_old_hands_are_archived(self):
+        self.play_one_hand()
+        self.play_one_hand()
+        before = self.log.get_log(player='all')['hands']
+        old_ids = list(
+            HandHistory.objects
+                       .filter(hand_number__lt=self.table.hand_number)
+                       .values_list('id', flat=True)
+        )
+        assert len(old_ids) == 2
+
+        with tempfile.TemporaryDirectory() as archive_dir, \
+                override_settings(HAND_ARCHIVE_DIR=archive_dir):
+            assert archive_hands(old_ids) == 2
+            assert not HandHistory.objects.filter(id__in=old_ids).exists()
+            assert ArchivedHandHistory.objects.get().num_hands == 2
+            # a second run for the same hands doesn't count them again
+            assert archive_hands(old_ids) == 0
+            assert ArchivedHandHistory.objects.get().num_hands == 2
+
+            assert self.log.get_log(player='all')['hands'] == before
+            first_hand = before[0]['table']['hand_number']
+            log = self.log.get_log(player='all', hand_gte=first_hand,
+                                   hand_lt=first_hand + 1)
+            assert log['hands'] == before[:1]
+
+    def test_save_to_file_streams_hands(self):
+        self.play_one_hand()
+        self.play_one_hand()
+        hands = json.loads(to_json_str(self.log.get_log(player='all')['hands']))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for filename, open_file in (('log.json', open),
+                                        ('log.json.gz', gzip.open)):
+                filepath = path.join(tmp_dir, filename)
+                self.log.save_to_file(filepath, player='all', notes='test')
+                with open_file(filepath, 'rt') as f:
+                    saved = json.load(f)
+                assert saved['notes'] == 'test'
+                assert saved['hands'] == hands
+
+    def test_frontend_log_is_cached(self):
+        self.play_one_hand()
+        self.play_one_hand()
+        first_hand = HandHistory.objects.order_by('hand_number')\
+                                        .first().hand_number
+        finished_lt = self.table.hand_number
+        rendered = JSONLog.frontend_log(self.log, None, first_hand,
+                                        finished_lt)
+        assert len(rendered) == 2
+
+        # summaries are cached when the outbox compacts the finished hands
+        with self.assertNumQueries(0):
+            assert self.log.frontend_log(None, first_hand,
+                                         finished_lt) == rendered
+
+        redis_summaries.delete(REDIS_SUMMARIES_KEY.format(self.table.id))
+        assert self.log.frontend_log(None, first_hand,
+                                     finished_lt) == rendered
+        with self.assertNumQueries(0):
+            assert self.log.frontend_log(None, first_hand,
+                                         finished_lt) == rendered
+
+        # hands with no HandHistory are cached too
+        assert self.log.frontend_log(None, first_hand - 2,
+                                     finished_lt) == rendered
+        with self.assertNumQueries(0):
+            assert self.log.frontend_log(None, first_hand - 2,
+                                         finished_lt) == rendered
+
+        # the hand in progress is always rendered from the log
+        frontend_log = self.log.frontend_log(None, first_hand, None)
+        assert frontend_log[:2] == rendered
+        assert len(frontend_log) == 3
+
+    def test_encoding_round_trip(self):
+        events = [
+            {'ts': '2019-07-25T06:00:00.120Z', 'subj': 'pirate',
+             'event': 'BET', 'args': {'amt': '12.50', 'all_in': False}},
+            {'ts': '2019-07-25T06:00:00Z', 'subj': 'table',
+             'event': 'NOT_AN_EVENT', 'args': {'cards': ['Ah', '2s']}},
+            {'ts': '2019-07-25T06:00:01.000500Z', 'subj': 'side_effect',
+             'event': 'CHAT', 'args': {'msg': '-0.00', 'n': -3, 'x': 1.5,
+                                       'none': None, 'stamp': '1.0E+2'}},
+        ]
+        actions = [
+            {'ts': '2019-07-25T05:59:59.999Z', 'subj': 'pirate',
+             'action': 'BET', 'args': {'amt': 100}},
+        ]
+        encoded = encode_hand(events, actions)
+        assert decode_hand(encoded) == (events, actions)
+        assert len(encoded) < len(json.dumps([events, actions]))
+
+
 class MultiLogTest(GenericTableTest):
     def setUp(self):
         super().setUp()
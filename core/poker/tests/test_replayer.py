@@ -7,6 +7,7 @@ from oddslingers.settings import DEBUG_DUMP_DIR
 
 from poker.constants import HH_TEST_PATH, PLAYER_REFRESH_FIELDS
 from poker.replayer import EventReplayer, ActionReplayer
+from poker.replay_verifier import verify_hand
 from poker.subscribers import AnimationSubscriber, InMemoryLogSubscriber
 from poker.megaphone import gamestate_json
 from poker.models import MockPokerTable, MockPlayer
@@ -112,6 +113,32 @@ class IsLastHandTest(ActionReplayerTest):
         self.replayer.skip_to_hand_idx(-1)
         assert self.replayer.is_last_hand()
 
+class ReplayerSnapshotTest(ActionReplayerTest):
+    def setUp(self):
+        self.filename = os.path.join(HH_TEST_PATH, 'a_few_hands.json')
+        super().setUp(self.filename)
+
+    def test_seek_restores_snapshots(self):
+        rep = self.replayer
+        rep.skip_to_hand_idx(5)
+        states = []
+        for _ in range(4):
+            states.append((rep.action_idx,
+                           rep.accessor.gamestate(convert=True)))
+            rep.step_forward(multi_hand=False)
+
+        for action_idx, gamestate in reversed(states):
+            with self.assertNumQueries(0):
+                rep._skip_to_action(action_idx)
+            assert rep.action_idx == action_idx
+            assert rep.accessor.gamestate(convert=True) == gamestate
+
+        with self.assertNumQueries(0):
+            rep.step_forward(multi_hand=False)
+            rep.step_back()
+        assert rep.accessor.gamestate(convert=True) == states[0][1]
+
+
 class ReplayerWithSubscribersTest(ActionReplayerTest):
     def setUp(self):
         self.filename = os.path.join(HH_TEST_PATH, 'a_few_hands.json')
@@ -126,6 +153,12 @@ class ReplayerWithSubscribersTest(ActionReplayerTest):
 
         assert 'animations' in gamestate
 
+    def test_no_snapshots_with_subscribers(self):
+        # subscribers can't be rewound, so seeking replays from the start
+        self.replayer.skip_to_hand_idx(5)
+        self.replayer.step_forward()
+        assert self.replayer._snapshots == {}
+
 class ReplayerDescribeTest(ActionReplayerTest):
     def setUp(self):
         self.filename = os.path.join(HH_TEST_PATH, 'a_few_hands.json')
@@ -395,6 +428,30 @@ class ActionReplayerLoggingTest(TestCase):
             os.remove(self.TEMP_FN)
 
 
+class ReplayVerifierTest(TestCase):
+    TEMP_FN = os.path.join(DEBUG_DUMP_DIR, 'tmp.json')
+    def test_verify_hands(self):
+        with open('poker/tests/data/a_few_hands.json') as file:
+            replayer = ActionReplayer.from_file(file,
+                                                hand_idx=0,
+                                                logging=True)
+        replayer.skip_to_end_of_hand()
+        replayer.controller.log.save_to_file(self.TEMP_FN, player='all')
+
+        with open(self.TEMP_FN) as file:
+            hand = json.load(file)['hands'][0]
+        assert verify_hand(hand) is None
+
+        deal = next(event for event in hand['events']
+                          if event['event'] == 'DEAL')
+        deal['args']['card'] = 'Xx'
+        assert 'differs' in verify_hand(hand)
+
+    def tearDown(self):
+        if os.path.isfile(self.TEMP_FN):
+            os.remove(self.TEMP_FN)
+
+
 class ReplayerOriginalLogTest(TestCase):
     TEMP_FN = os.path.join(DEBUG_DUMP_DIR, 'tmp.json')
     def test_original_log(self):
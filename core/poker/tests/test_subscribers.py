@@ -1,5 +1,10 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from decimal import Decimal
+from unittest.mock import Mock, patch
+
+import pytz
+
+from django.test import override_settings
 from django.utils import timezone
 
 from oddslingers.tests.test_utils import TimezoneMocker
@@ -10,7 +15,7 @@ from poker.subscribers import (
     ChatSubscriber, AnimationSubscriber,
     TableStatsSubscriber, LogSubscriber,
     TournamentResultsSubscriber, LevelSubscriber,
-    BankerSubscriber
+    BankerSubscriber, InMemoryLogSubscriber,
 )
 from poker.tests.test_controller import GenericTableTest
 from poker.tests.test_freezeout import FreezeoutControllerTest
@@ -18,12 +23,29 @@ from poker.bots import get_robot_move
 from poker.megaphone import gamestate_json
 from poker.handhistory import DBLog
 from poker.constants import (
-    HAND_SAMPLING_CAP, PlayingState, CASH_GAME_BBS, N_BB_TO_NEXT_LEVEL,
+    Event, SIDE_EFFECT_SUBJ, HAND_SAMPLING_CAP, PlayingState, CASH_GAME_BBS, N_BB_TO_NEXT_LEVEL,
     CASHTABLES_LEVELUP_BONUS
 )
-from poker.models import TournamentResult, PokerTable, Player
-from poker.level_utils import update_levels, earned_chips
+from poker.models import (
+    TournamentResult, PokerTable, Player, OutboxEvent, ChatLine,
+)
+from poker.chat import (
+    recent_chatlines, render_chatline, chatline_json, push_chatlines,
+    fill_chatlines, chat_generation,
+)
+from poker.outbox import (
+    process_outbox_events, purge_outbox_events, lifetime_hands_played,
+    OUTBOX_HANDLERS,
+)
+from poker.level_utils import (
+    update_levels, earned_chips, rebuild_earned_chips,
+)
+
+from rewards.subscribers import BadgeSubscriber
+from rewards.constants import DEDICATED_HANDS
+from rewards.models import Badge
 
+from banker.models import BalanceTransfer, Cashier
 from banker.mutations import buy_chips, transfer_chips
 from banker.utils import balance
 
@@ -51,6 +73,169 @@ class FoldNotSentTwiceBySubscriberTest(GenericTableTest):
         ) == 1
 
 
+class ChatSubscriberTest(GenericTableTest):
+    def commit_chat(self, chatsub):
+        # tests never commit their transaction, collect the callbacks
+        with patch('poker.chat.transaction.on_commit') as on_commit:
+            chatsub.commit()
+        return [args[0] for args, _ in on_commit.call_args_list]
+
+    def test_chat_lines_are_bulk_saved_and_cached(self):
+        chat_history = self.table.chat_history
+        # fill the cache from the (empty) db first
+        assert recent_chatlines(chat_history) == []
+        ChatLine.objects.create(chat_history=chat_history,
+                                speaker='Dealer',
+                                message='welcome')
+        assert [line['message'] for line in recent_chatlines(chat_history)] \
+            == ['welcome']
+
+        chatsub = ChatSubscriber(self.controller.accessor)
+        for msg in ('pirate folded', 'cuttlefish checked', 'ajfenix bet 2'):
+            chatsub.chats.append({'speaker': 'Dealer', 'msg': msg})
+
+        with self.assertNumQueries(1):
+            on_commit = self.commit_chat(chatsub)
+
+        broadcast = chatsub.to_broadcast['all']['chat']
+        assert [line['message'] for line in broadcast] == [
+            'pirate folded', 'cuttlefish checked', 'ajfenix bet 2',
+        ]
+        assert all(line['timestamp'] for line in broadcast)
+        assert ChatLine.objects.filter(chat_history=chat_history).count() == 4
+
+        # the lines are only cached once the transaction commits
+        assert [line['message'] for line in recent_chatlines(chat_history)] \
+            == ['welcome']
+        for callback in on_commit:
+            callback()
+
+        with self.assertNumQueries(0):
+            cached = recent_chatlines(chat_history)
+        assert [line['message'] for line in cached] == [
+            'welcome', 'pirate folded', 'cuttlefish checked', 'ajfenix bet 2',
+        ]
+        assert render_chatline(cached[-1])['species'] == 'dealer'
+
+    def test_cached_chat_is_bounded(self):
+        chat_history = self.table.chat_history
+        ChatLine.objects.create(chat_history=chat_history,
+                                speaker='Dealer',
+                                message='welcome')
+        recent_chatlines(chat_history)
+
+        chatsub = ChatSubscriber(self.controller.accessor)
+        with override_settings(CHAT_HISTORY_CACHE_LENGTH=3):
+            for msg in ('one', 'two', 'three', 'four'):
+                chatsub.chats.append({'speaker': 'Dealer', 'msg': msg})
+            for callback in self.commit_chat(chatsub):
+                callback()
+
+            messages = [
+                line['message']
+                for line in recent_chatlines(chat_history)
+            ]
+        assert messages == ['two', 'three', 'four']
+
+    def test_filled_cache_is_not_overwritten(self):
+        chat_history = self.table.chat_history
+        ChatLine.objects.create(chat_history=chat_history,
+                                speaker='Dealer',
+                                message='welcome')
+        generation = chat_generation(chat_history.id)
+        stale = [
+            chatline_json(chatline)
+            for chatline in chat_history.get_recent(10)
+        ]
+        # another request filled the cache and appended a line since
+        #   our db read
+        recent_chatlines(chat_history)
+        newer = ChatLine(chat_history=chat_history,
+                         speaker='Dealer',
+                         message='newer')
+        push_chatlines(chat_history.id, [chatline_json(newer)])
+
+        fill_chatlines(chat_history.id, stale, generation)
+        assert [line['message'] for line in recent_chatlines(chat_history)] \
+            == ['welcome', 'newer']
+
+    def test_lines_pushed_during_a_fill_are_not_missed(self):
+        chat_history = self.table.chat_history
+        ChatLine.objects.create(chat_history=chat_history,
+                                speaker='Dealer',
+                                message='welcome')
+        get_recent = chat_history.get_recent
+
+        def read_then_push(num_lines):
+            # a line is committed & pushed after our db read, while the
+            #   list doesn't exist yet
+            lines = list(get_recent(num_lines))
+            newer = ChatLine.objects.create(chat_history=chat_history,
+                                            speaker='Dealer',
+                                            message='newer')
+            push_chatlines(chat_history.id, [chatline_json(newer)])
+            return lines
+
+        with patch.object(chat_history, 'get_recent', read_then_push):
+            stale = recent_chatlines(chat_history)
+        assert [line['message'] for line in stale] == ['welcome']
+
+        # the stale lines weren't cached
+        assert [line['message'] for line in recent_chatlines(chat_history)] \
+            == ['welcome', 'newer']
+
+
+class SubscriberRoutingTest(GenericTableTest):
+    def test_events_only_go_to_interested_subscribers(self):
+        everything = InMemoryLogSubscriber()
+        banker = BankerSubscriber(self.accessor)
+        banker.dispatch = Mock(wraps=banker.dispatch)
+        self.controller.subscribers = [everything, banker]
+
+        self.controller.step()
+        to_act = self.accessor.next_to_act()
+        self.controller.dispatch('FOLD', player_id=to_act.id)
+
+        events = [event for _, event, _, _ in everything.log]
+        assert Event.CREATE_TRANSFER not in events
+        banker.dispatch.assert_not_called()
+
+        self.controller.internal_dispatch([
+            (SIDE_EFFECT_SUBJ, Event.CREATE_TRANSFER, {
+                'src': self.pirate,
+                'dst': self.table,
+                'amt': Decimal(1),
+            }),
+        ])
+        assert banker.dispatch.call_count == 1
+        assert len(banker.mutations) > 0
+
+    def test_routes_reset_when_subscribers_change(self):
+        everything = InMemoryLogSubscriber()
+        self.controller.subscribers = []
+        self.controller.step()
+        self.controller.subscribers.append(everything)
+
+        to_act = self.accessor.next_to_act()
+        self.controller.dispatch('FOLD', player_id=to_act.id)
+        assert everything.log
+
+    def test_subscriber_order_checked_on_assignment(self):
+        log = DBLog(self.accessor)
+        with self.assertRaises(ValueError):
+            self.controller.subscribers = [
+                BadgeSubscriber(self.accessor, log),
+                LogSubscriber(log),
+            ]
+
+        self.controller.subscribers = [LogSubscriber(log)]
+        with self.assertRaises(ValueError):
+            self.controller.subscribers.insert(
+                0,
+                BadgeSubscriber(self.accessor, log),
+            )
+
+
 class AnimationPatchesTest(GenericTableTest):
     def test_anim_patch_privacy(self):
         anim_sub = AnimationSubscriber(self.controller.accessor)
@@ -77,9 +262,9 @@ class AnimationPatchesTest(GenericTableTest):
             # test that RESET events have empty card patches
             for anim in anim_sub.to_broadcast:
                 if anim['type'] == 'RESET':
-                    for patch in anim['patches']:
-                        if 'card' in patch['path']:
-                            assert not patch['value']
+                    for card_patch in anim['patches']:
+                        if 'card' in card_patch['path']:
+                            assert not card_patch['value']
 
             # anims = anim_sub.updates_for_broadcast()
 
@@ -307,6 +492,25 @@ class TableStatsSubscriberTest(GenericTableTest):
         expected_hands_per_hour = round(n_hands / elapsed_hours, 2)
         assert calculated_hands_per_hour == expected_hands_per_hour
 
+    def test_hands_per_hour_without_queries(self):
+        stats_sub = TableStatsSubscriber(self.accessor)
+        start_time = timezone.now()
+        with self.assertNumQueries(0):
+            for hand_idx in range(HAND_SAMPLING_CAP * 2):
+                in_a_few = timedelta(minutes=3 * hand_idx)
+                with TimezoneMocker(start_time + in_a_few):
+                    stats_sub.dispatch(SIDE_EFFECT_SUBJ, Event.NEW_HAND)
+
+        table_stats = stats_sub.table_stats
+        assert len(table_stats.hand_timestamps) == HAND_SAMPLING_CAP + 2
+        elapsed_hours = (HAND_SAMPLING_CAP + 1) * 3 / 60
+        expected_hands_per_hour = round(HAND_SAMPLING_CAP / elapsed_hours, 2)
+        assert table_stats.hands_per_hour == expected_hands_per_hour
+
+        stats_sub.commit()
+        table_stats.refresh_from_db()
+        assert len(table_stats.hand_timestamps) == HAND_SAMPLING_CAP + 2
+
     def test_not_enough_players_to_play(self):
         self.stats_sub = TableStatsSubscriber(self.accessor)
         self.controller.subscribers = [self.stats_sub]
@@ -660,6 +864,60 @@ class PrivateGamesDontLevelUpTest(GenericTableTest):
         assert self.cuttlefish.cashtables_level == CASH_GAME_BBS[0]
 
 
+class IncrementalEarnedChipsTest(GenericTableTest):
+    # a date in season 1
+    start = datetime(year=2019, month=7, day=25, tzinfo=pytz.utc)
+
+    def setUp(self):
+        super().setUp()
+        self.private_table = PokerTable.objects.create_table(
+            name='private_table',
+            is_private=True,
+        )
+        self.hour = 0
+
+    def transfer(self, src, dst, amt):
+        self.hour += 1
+        with TimezoneMocker(self.start + timedelta(hours=self.hour)):
+            BalanceTransfer.objects.create(source=src, dest=dst, amt=amt)
+
+    def earned_chips_later(self):
+        with TimezoneMocker(self.start + timedelta(hours=self.hour + 1)):
+            return earned_chips(self.pirate, season=1)
+
+    def test_earned_chips_is_incremental(self):
+        cashier = Cashier.load()
+        self.transfer(cashier, self.pirate, Decimal(1000))
+        self.transfer(self.pirate, self.table, Decimal(500))
+        self.transfer(self.table, self.pirate, Decimal(800))
+        self.transfer(self.private_table, self.pirate, Decimal(5000))
+        self.transfer(self.cowpig, self.pirate, Decimal(300))
+        assert self.earned_chips_later() == 1300
+
+        stats = self.pirate.userstats_set.season(1).get()
+        assert stats.earned_chips == 1300
+        assert stats.earned_chips_timestamp is not None
+
+        # only the transfers since the saved state are loaded
+        self.transfer(self.pirate, self.table, Decimal(2000))
+        self.transfer(self.table, self.pirate, Decimal(100))
+        with self.assertNumQueries(4):
+            assert self.earned_chips_later() == 100
+
+        self.pirate.userstats_set.season(1).update(earned_chips=12345)
+        with TimezoneMocker(self.start + timedelta(hours=self.hour + 1)):
+            assert rebuild_earned_chips(self.pirate, season=1) == 100
+
+    def test_unsettled_transfers_arent_saved(self):
+        self.transfer(self.table, self.pirate, Decimal(100))
+        with TimezoneMocker(self.start + timedelta(hours=self.hour)):
+            assert earned_chips(self.pirate, season=1) == 100
+
+        stats = self.pirate.userstats_set.season(1).get()
+        assert stats.earned_chips_timestamp is None
+        assert self.earned_chips_later() == 100
+
+
 class UserStatsSubscriberTest(GenericTableTest):
     def test_hands_played(self):
         """Test if each hand is correctly counted"""
@@ -681,3 +939,106 @@ class UserStatsSubscriberTest(GenericTableTest):
             player.user.userstats().refresh_from_db()
             # In 30 folds for a 4 players table we will have 10 hands played
             assert player.user.userstats().hands_played == 10
+
+
+class OutboxTest(GenericTableTest):
+    def setUp(self):
+        super().setUp()
+        self.user_stats_sub = UserStatsSubscriber(self.accessor)
+        self.badge_sub = BadgeSubscriber(self.accessor, self.controller.log)
+
+    def hands_played(self, user):
+        return user.userstats_set.current_season().get().hands_played
+
+    def queue_end_hand(self, hand_number):
+        self.table.hand_number = hand_number
+        self.user_stats_sub.dispatch(self.table, Event.END_HAND)
+        self.user_stats_sub.commit()
+
+    @override_settings(ENABLE_DRAMATIQ=True)
+    def test_events_are_processed_once(self):
+        before = self.hands_played(self.pirate)
+        self.queue_end_hand(1)
+        # the same hand committed twice only queues one event
+        self.queue_end_hand(1)
+        self.queue_end_hand(2)
+        assert self.hands_played(self.pirate) == before
+
+        with self.assertNumQueries(8):
+            assert process_outbox_events() == 2
+        assert process_outbox_events() == 0
+        assert self.hands_played(self.pirate) == before + 2
+        assert not OutboxEvent.objects.filter(processed__isnull=True).exists()
+
+    @override_settings(ENABLE_DRAMATIQ=True)
+    def test_failed_events_are_retried(self):
+        self.queue_end_hand(1)
+        failing_handler = Mock(side_effect=ValueError('nope'))
+        with patch.dict(OUTBOX_HANDLERS, hands_played=failing_handler):
+            assert process_outbox_events() == 1
+        event = OutboxEvent.objects.get()
+        assert event.processed is None and event.attempts == 1
+
+        assert process_outbox_events() == 1
+        event.refresh_from_db()
+        assert event.processed is not None
+
+    def test_inline_handler_errors_are_raised(self):
+        failing_handler = Mock(side_effect=ValueError('nope'))
+        with patch.dict(OUTBOX_HANDLERS, hands_played=failing_handler):
+            with self.assertRaises(ValueError):
+                self.queue_end_hand(1)
+
+    @override_settings(ENABLE_DRAMATIQ=True, OUTBOX_MAX_ATTEMPTS=1)
+    def test_dead_events_are_purged(self):
+        self.queue_end_hand(1)
+        failing_handler = Mock(side_effect=ValueError('nope'))
+        with patch.dict(OUTBOX_HANDLERS, hands_played=failing_handler):
+            assert process_outbox_events() == 1
+        # given up on, but kept for OUTBOX_RETENTION_DAYS
+        assert process_outbox_events() == 0
+        assert purge_outbox_events() == 0
+
+        OutboxEvent.objects.update(created=timezone.now() - timedelta(days=30))
+        assert purge_outbox_events() == 1
+        assert not OutboxEvent.objects.exists()
+
+    def test_analytics_milestones_count_lifetime_hands(self):
+        self.pirate_player.n_hands_played = 7
+        self.pirate_player.save()
+        self.pirate.userstats_set.current_season().update(hands_played=2)
+        assert lifetime_hands_played([self.pirate.id]) == {
+            str(self.pirate.id): 7,
+        }
+
+    @override_settings(ENABLE_DRAMATIQ=True)
+    def test_hands_badges_in_next_broadcast(self):
+        self.pirate.userstats_set.current_season()\
+                                 .update(hands_played=DEDICATED_HANDS - 1)
+        # both hands are processed in the same batch
+        self.queue_end_hand(1)
+        self.queue_end_hand(2)
+        # tests never commit their transaction, collect the callbacks
+        with patch('poker.outbox.transaction.on_commit') as on_commit:
+            process_outbox_events()
+
+        assert Badge.objects.filter(user=self.pirate,
+                                    name='dedicated').count() == 1
+        # notifications are only pushed once the batch commits
+        self.badge_sub.commit()
+        assert not self.badge_sub.updates_for_broadcast(
+            player=self.pirate_player
+        )['badge_notifications']
+        for args, _ in on_commit.call_args_list:
+            args[0]()
+
+        self.badge_sub.commit()
+        notifications = self.badge_sub.updates_for_broadcast(
+            player=self.pirate_player
+        )['badge_notifications']
+        assert [n['subtype'] for n in notifications] == ['dedicated']
+
+        self.badge_sub.commit()
+        assert not self.badge_sub.updates_for_broadcast(
+            player=self.pirate_player
+        )['badge_notifications']
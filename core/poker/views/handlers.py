@@ -25,7 +25,7 @@ from ..game_utils import (
 )
 from ..megaphone import gamestate_json, table_sockets, tournament_sockets
 from ..models import ChatLine, Freezeout, PokerTable
-from ..subscribers import json_for_chatline
+from ..chat import chatline_json, render_chatline, cache_chatlines
 from ..constants import (
     CASH_GAME_BBS, TOURNEY_BUYIN_AMTS,
     N_BB_TO_NEXT_LEVEL, TOURNEY_BUYIN_TIMES
@@ -423,7 +423,9 @@ class PokerWithChatSocketHandler(BasePokerSocketHandler):
                 message=text,
             )
             line.save()
-            chat_line = [json_for_chatline(line, accessor=self.accessor)]
+            chat_json = chatline_json(line)
+            cache_chatlines(target.chat_history_id, [chat_json])
+            chat_line = [render_chatline(chat_json, accessor=self.accessor)]
 
             self.table.sockets.send_action('UPDATE_CHAT', chat=chat_line)
 
@@ -584,8 +586,10 @@ class TournamentSocketHandler(RoutedSocketHandler):
                 message=text,
             )
             line.save()
+            chat_json = chatline_json(line)
+            cache_chatlines(tournament.chat_history_id, [chat_json])
             entrants = tournament.entrants.values_list('username', flat=True)
-            chat_line = [json_for_chatline(line, tourney_entrants=entrants)]
+            chat_line = [render_chatline(chat_json, tourney_entrants=entrants)]
 
             tournament_sockets(tournament).send_action(
                 'UPDATE_CHAT',
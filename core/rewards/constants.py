@@ -1,5 +1,10 @@
 from collections import defaultdict
 
+from django.urls import reverse
+from django.utils import timezone
+
+from oddslingers.utils import camelcase_to_capwords
+
 from poker.constants import StrBasedEnum
 
 
@@ -170,6 +175,20 @@ def get_badge_icon(badge_name):
     return f'/static/images/reward_icons/{BADGE_ICONS[badge_name]}'
 
 
+def badge_notification(badge_name):
+    badge_title = camelcase_to_capwords(badge_name)
+    return {
+        'type': 'badge',
+        'subtype': badge_name,
+        'bsStyle': 'warning',
+        'ts': timezone.now(),
+        'title': f'{badge_title} achieved!',
+        'description': BADGE_DESCRIPTIONS[badge_name],
+        'url': reverse('UserProfile'),
+        'icon': get_badge_icon(badge_name),
+    }
+
+
 BADGES_FOR_HANDS = {
     DEDICATED_HANDS: 'dedicated',
     ADEPT_HANDS: 'adept'
@@ -9,6 +9,7 @@ from banker.models import Cashier
 from oddslingers.mutations import Mutation, MutationList
 
 from .models import Badge
+from .utils import BadgeIndex
 from .constants import (
     BADGE_DESCRIPTIONS, NEWCOMER_BADGES, NEWCOMER_REWARD,
     EXCEPTIONAL_BADGES, EXCEPTIONAL_UNUSUAL_REWARD, REGULAR_BADGE_REWARD,
@@ -35,12 +36,11 @@ def earn_first_time_chips(user: User, name: str):
     )
 
 
-def reward_completed_badge(user: User, currently_earned=None) -> MutationList:
+def reward_completed_badge(user: User, currently_earned=None,
+                           badges: BadgeIndex=None) -> MutationList:
+    badges = badges or BadgeIndex([user])
     for badge in NEWCOMER_BADGES.keys():
-        badge_doesnt_exist = not Badge.objects.current_season().filter(
-            user=user,
-            name=badge
-        ).exists()
+        badge_doesnt_exist = not badges.earned(user, badge)
         if badge_doesnt_exist or badge != currently_earned:
             return []
 
@@ -59,27 +59,23 @@ def reward_completed_badge(user: User, currently_earned=None) -> MutationList:
     ]
 
 
-def award_badge(user: User, name: str, max_times: int=None) -> MutationList:
+def award_badge(user: User, name: str, max_times: int=None,
+                badges: BadgeIndex=None) -> MutationList:
+    """
+    pass a BadgeIndex when awarding many badges, so the user's badges are
+    only loaded once
+    """
     mutations = []
     if name not in BADGE_DESCRIPTIONS.keys():
         raise ValueError(
             f"Trying to reward a badge that doesn't exist: {name}"
         )
 
-    if name in NEWCOMER_BADGES.keys():
-        max_times = 1
-
-    if max_times:
-        if Badge.objects\
-                .current_season()\
-                .filter(user=user, name=name)\
-                .count() >= max_times:
-            return []
+    badges = badges or BadgeIndex([user])
+    if not badges.can_award(user, name, max_times):
+        return []
 
-    first_time_earned = not Badge.objects\
-                                 .current_season()\
-                                 .filter(user=user, name=name)\
-                                 .exists()
+    first_time_earned = not badges.earned(user, name)
     mutations.append(Mutation(
         qs=Badge.objects,
         method_name='create_for_current_season',
@@ -88,7 +84,8 @@ def award_badge(user: User, name: str, max_times: int=None) -> MutationList:
 
     if first_time_earned and name not in NO_REWARD_BADGES.keys():
         mutations += earn_first_time_chips(user, name)
-        mutations += reward_completed_badge(user, name)
+        mutations += reward_completed_badge(user, name, badges)
+    badges.add(user, name)
 
     conditions_to_notify = [
         name not in ('genesis', 'fearless_leader', 'hello_world', 'shove'),
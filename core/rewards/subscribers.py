@@ -3,46 +3,112 @@ import logging
 from collections import defaultdict
 from decimal import Decimal
 
-from django.urls import reverse
-from django.utils import timezone
-
-from oddslingers.utils import camelcase_to_capwords
-from oddslingers.mutations import MutationList
-
-from poker.subscribers import MutationSubscriber
+from poker.subscribers import OutboxSubscriber, LogSubscriber
 
 from poker.constants import Event
+from poker.models import Player
 from poker.cards import Card
 from poker.rankings import handrank_encoding, best_hand_from_cards
 
-from .constants import (
-    BADGE_DESCRIPTIONS, get_badge_icon, BIG_WIN_BBS, THE_DUCK_BBS,
-    BADGES_FOR_HANDS
-)
-from .mutations import award_badge
+from .constants import BIG_WIN_BBS, THE_DUCK_BBS, badge_notification
+from .utils import BadgeIndex
 
 
 logger = logging.getLogger('root')
 
 
-class BadgeSubscriber(MutationSubscriber):
+class HandAggregates:
+    """
+    What the badges need to know about the current hand, per username:
+    winnings, who bet or raised, dealt & mucked cards.  Fed with the
+    events of the hand as they are dispatched, so the badge rules don't
+    have to read the hand history log.
+    """
+    TRACKED_EVENTS = (
+        Event.WIN, Event.BET, Event.RAISE_TO, Event.DEAL, Event.MUCK,
+    )
+
+    def __init__(self):
+        self.winnings = defaultdict(lambda: {
+            'total': Decimal(0),
+            'showdown': Decimal(0),
+            'non-showdown': Decimal(0),
+        })
+        self.aggressors = set()
+        self.dealt_cards = defaultdict(list)
+        self.mucked = set()
+
+    @classmethod
+    def from_log(cls, hand_events: list) -> 'HandAggregates':
+        """aggregates of a hand that was already (partly) dispatched"""
+        hand = cls()
+        for rec in hand_events:
+            hand.add(rec['subj'], Event.from_str(rec['event']), rec['args'])
+        return hand
+
+    def add(self, username: str, event: Event, args: dict):
+        if event == Event.WIN:
+            amt = Decimal(str(args['amt']))
+            kind = 'showdown' if args['showdown'] else 'non-showdown'
+            self.winnings[username]['total'] += amt
+            self.winnings[username][kind] += amt
+        elif event in (Event.BET, Event.RAISE_TO):
+            self.aggressors.add(username)
+        elif event == Event.DEAL:
+            self.dealt_cards[username].append(str(args['card']))
+        elif event == Event.MUCK:
+            self.mucked.add(username)
+
+
+class BadgeSubscriber(OutboxSubscriber):
+    # badges for the number of hands played are awarded by the outbox
+    #   worker that increases UserStats.hands_played
+    events = frozenset((
+        Event.SHOWDOWN_COMPLETE, Event.FINISH_TOURNAMENT, Event.BOUNTY_WIN,
+        Event.NEW_HAND, *HandAggregates.TRACKED_EVENTS,
+    ))
+    # a hand that started before this subscriber is read from the log
+    dispatch_after = (LogSubscriber,)
+
     def __init__(self, accessor, log):
-        self.accessor = accessor
+        super().__init__(accessor)
         self.log = log
+        self._badges = None
+        self._hand = None
+        self.notifications = defaultdict(list)
         self.to_broadcast = defaultdict(list)
-        self.mutations: MutationList = []
 
     @property
     def table(self):
         return self.accessor.table
 
+    @property
+    def badges(self) -> BadgeIndex:
+        """the season's badges of the table's players, loaded when needed"""
+        if self._badges is None or self._badges.is_stale():
+            self._badges = BadgeIndex(
+                plyr.user for plyr in self.accessor.players
+            )
+        return self._badges
+
+    @property
+    def hand(self) -> HandAggregates:
+        if self._hand is None:
+            self._hand = HandAggregates.from_log(self.recent_hh()['events'])
+        return self._hand
+
     def dispatch(self, subj, event, changes=None, **kwargs):
+        if event == Event.NEW_HAND:
+            self._hand = HandAggregates()
+        elif (self._hand is not None
+                and event in HandAggregates.TRACKED_EVENTS
+                and isinstance(subj, Player)):
+            self._hand.add(subj.username, event, kwargs)
+
         try:
             new_badges = []
             if event == Event.SHOWDOWN_COMPLETE:
                 new_badges = self.showdown_badges()
-            elif event == Event.NEW_HAND:
-                new_badges = self.new_hand_badges()
             elif event == Event.BET or event == Event.RAISE_TO:
                 new_badges = self.aggressor_badges(subj, event, **kwargs)
             elif event == Event.FINISH_TOURNAMENT:
@@ -61,14 +127,17 @@ class BadgeSubscriber(MutationSubscriber):
             })
 
     def add_badge(self, player, badge_name, max_times=None):
-        self.mutations += award_badge(
-            player.user,
-            badge_name,
-            max_times
-        )
-        self.to_broadcast[player].append(
-            self._get_badge_to_broadcast(badge_name)
-        )
+        # the outbox worker checks again when it awards the badge, in case
+        #   it was awarded somewhere else in the meantime
+        if not self.badges.can_award(player.user, badge_name, max_times):
+            return
+        self.badges.add(player.user, badge_name)
+
+        self.queue('badges', player.user.id, badge_name,
+                   user_id=player.user.id,
+                   name=badge_name,
+                   max_times=max_times)
+        self.notifications[player].append(badge_notification(badge_name))
 
     def tournament_winner_badges(self, winner):
         return [(winner, 'tourney_winner')]
@@ -86,18 +155,6 @@ class BadgeSubscriber(MutationSubscriber):
 
         return output
 
-    def new_hand_badges(self):
-        badges = []
-        for player in self.accessor.active_players():
-            # TODO: determine how to keep this value up-to-date without
-            # refresh_from_db on every subscriber dispatch
-            # (refresh is currently located in PokerAccessor.commit)
-            hands_played = player.user.userstats().hands_played
-            if hands_played in BADGES_FOR_HANDS.keys():
-                badges.append((player, BADGES_FOR_HANDS[hands_played],))
-
-        return badges
-
     def aggressor_badges(self, subj, event, **kwargs):
         if (subj.stack_available - kwargs['amt'] == 0):
             return [(subj, 'shove')]
@@ -106,20 +163,11 @@ class BadgeSubscriber(MutationSubscriber):
 
     def commit(self):
         super().commit()
-        self.to_broadcast = defaultdict(list)
-
-    def _get_badge_to_broadcast(self, badge_name):
-        badge_title = camelcase_to_capwords(badge_name)
-        return {
-            'type': 'badge',
-            'subtype': badge_name,
-            'bsStyle': 'warning',
-            'ts': timezone.now(),
-            'title': f'{badge_title} achieved!',
-            'description': BADGE_DESCRIPTIONS[badge_name],
-            'url': reverse('UserProfile'),
-            'icon': get_badge_icon(badge_name),
-        }
+        self.to_broadcast = self.notifications
+        outbox_badges = self.notifications_from_outbox('badges')
+        for player, notifications in outbox_badges.items():
+            self.to_broadcast[player] += notifications
+        self.notifications = defaultdict(list)
 
     def updates_for_broadcast(self, player=None, spectator=None):
         return {'badge_notifications': self.to_broadcast[player]}
@@ -128,32 +176,9 @@ class BadgeSubscriber(MutationSubscriber):
         return self.log.current_hand_log(player='all')['hands'][0]
 
     def player_winnings_from_history(self):
-        history = self.recent_hh()['events']
-        wins = [rec for rec in history if rec['event'] == 'WIN']
-        player_winnings = {
-            self.accessor.player_by_username(player_name): [
-                win['args'] for win in wins
-                if win['subj'] == player_name
-            ]
-            for player_name in set(win['subj'] for win in wins)
-        }
         return {
-            player: {
-                'total': sum([
-                    Decimal(win['amt'])
-                    for win in player_winnings[player]
-                ]),
-                'showdown': sum([
-                    Decimal(win['amt'])
-                    for win in player_winnings[player]
-                    if win['showdown']
-                ]),
-                'non-showdown': sum([
-                    Decimal(win['amt']) for win in player_winnings[player]
-                    if not win['showdown']
-                ]),
-            }
-            for player in player_winnings.keys()
+            self.accessor.player_by_username(username): dict(winnings)
+            for username, winnings in self.hand.winnings.items()
         }
 
     def large_win_badges(self, player_winnings):
@@ -222,33 +247,18 @@ class BadgeSubscriber(MutationSubscriber):
         ]
 
     def did_raise_or_bet(self, player):
-        bets_and_raises = [
-            rec for rec in self.recent_hh()['events']
-            if (rec['event'] in ('RAISE_TO', 'BET')
-                    and rec['subj'] == player.username)
-        ]
-        return len(bets_and_raises) != 0
+        return player.username in self.hand.aggressors
 
     def profile_updates(self):
         # TODO
         return []
 
     def recover_opponent_cards_str(self, opponent):
-        # import ipdb; ipdb.set_trace()
         if opponent.cards_str:
             return opponent.cards_str
-        else:
-            player_records = [
-                rec for rec in self.recent_hh()['events']
-                if rec['subj'] == opponent.username
-            ]
-            # make sure this isn't being used incorrectly.
-            #   may have to remove this check later if it's used in
-            #   contexts other than checking mucked hands
-            assert 'MUCK' in [rec['event'] for rec in player_records]
-            original_hand = ','.join([
-                record['args']['card']
-                for record in player_records
-                if record['event'] == 'DEAL'
-            ])
-        return original_hand
+
+        # make sure this isn't being used incorrectly.
+        #   may have to remove this check later if it's used in
+        #   contexts other than checking mucked hands
+        assert opponent.username in self.hand.mucked
+        return ','.join(self.hand.dealt_cards[opponent.username])
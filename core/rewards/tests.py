@@ -3,6 +3,7 @@ import json
 from decimal import Decimal
 
 from unittest import skip
+from unittest.mock import Mock
 
 from django.test import TestCase
 from django.conf import settings
@@ -23,6 +24,7 @@ from poker.controllers import BountyController
 
 from rewards.constants import NEWCOMER_REWARD, REGULAR_BADGE_REWARD
 from rewards.models import Badge
+from rewards.mutations import award_badge
 from rewards.subscribers import BadgeSubscriber
 
 from ui.test_utils import FrontendTest
@@ -127,6 +129,31 @@ class BadgeSubscriberTest(BadgeTest):
         assert len(player_wins.keys()) == 1
 
 
+    def test_hand_aggregates_dont_read_the_log(self):
+        self.table.btn_idx = 0
+        self.controller.step()
+        current_hand_log = Mock(side_effect=AssertionError('read the log'))
+        self.controller.log.current_hand_log = current_hand_log
+
+        self.controller.dispatch('raise_to',
+                                 player_id=self.cowpig_player.id,
+                                 amt=100)
+        hand = self.badge_subscriber.hand
+        assert hand.aggressors == {'cowpig'}
+        assert len(hand.dealt_cards['cowpig']) == 2
+
+        for _ in range(3):
+            self.controller.dispatch(
+                'fold',
+                player_id=self.controller.accessor.next_to_act().id
+            )
+        # the next hand started with fresh aggregates
+        assert self.badge_subscriber.hand is not hand
+        assert not self.badge_subscriber.hand.winnings
+        assert hand.winnings['cowpig']['non-showdown'] > 0
+        current_hand_log.assert_not_called()
+
+
 class TestUserProfileBadges(FrontendTest):
     def setUp(self):
         username = 'test_user'
@@ -207,6 +234,37 @@ class ShoveTest(BadgeTest):
                     .filter(name='shove')
                     .count() == 1)
 
+    def test_earned_badges_are_checked_in_memory(self):
+        Badge(user=self.cowpig,
+              name='shove',
+              season=settings.CURRENT_SEASON).save()
+        badges = self.badge_subscriber.badges
+        assert badges.earned(self.cowpig, 'shove')
+
+        with self.assertNumQueries(0):
+            self.badge_subscriber.add_badge(self.cowpig_player, 'shove')
+            assert award_badge(self.cowpig, 'shove', badges=badges) == []
+        assert not self.badge_subscriber.outbox
+        assert not self.badge_subscriber.notifications[self.cowpig_player]
+
+        # awarding a badge updates the index
+        assert badges.can_award(self.pirate, 'shove')
+        self.badge_subscriber.add_badge(self.pirate_player, 'shove')
+        assert not badges.can_award(self.pirate, 'shove')
+        assert len(self.badge_subscriber.outbox) == 1
+
+    def test_badge_index_is_reloaded_for_a_new_season(self):
+        Badge(user=self.cowpig,
+              name='shove',
+              season=settings.CURRENT_SEASON).save()
+        assert not self.badge_subscriber.badges.can_award(self.cowpig,
+                                                          'shove')
+
+        with self.settings(CURRENT_SEASON=settings.CURRENT_SEASON + 1):
+            badges = self.badge_subscriber.badges
+            assert badges.season == settings.CURRENT_SEASON
+            assert badges.can_award(self.cowpig, 'shove')
+
 
 class BigWinTest(BadgeTest):
     # win a pot over 500bbs
@@ -0,0 +1,69 @@
+from collections import Counter
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.db.models import Count
+
+from oddslingers.models import User
+
+from .models import Badge
+from .constants import NEWCOMER_BADGES
+
+
+class BadgeIndex:
+    """
+    The names and counts of the badges each user earned this season,
+    loaded with one query for many users so that badge eligibility checks
+    don't need a COUNT/EXISTS query per badge.  award_badge updates it
+    (write-through) whenever it awards a badge.
+
+    Keep one per batch of awards or per table controller; badges awarded
+    elsewhere in the meantime aren't seen, so award_badge still has the
+    last word on whether a badge is given.  Controllers that outlive a
+    season need a new one, see is_stale().
+    """
+    def __init__(self, users: Iterable[User]=(), season: int=None):
+        self.season = settings.CURRENT_SEASON if season is None else season
+        self.counts: Dict[str, Counter] = {}
+        self.load(users)
+
+    def load(self, users: Iterable[User]):
+        """load the badges of the users that aren't in the index yet"""
+        missing = {
+            str(user.id) for user in users
+            if user and str(user.id) not in self.counts
+        }
+        if not missing:
+            return
+
+        for user_id in missing:
+            self.counts[user_id] = Counter()
+
+        badge_counts = Badge.objects\
+                            .season(self.season)\
+                            .filter(user_id__in=missing)\
+                            .values_list('user_id', 'name')\
+                            .annotate(count=Count('id'))\
+                            .order_by()
+        for user_id, name, count in badge_counts:
+            self.counts[str(user_id)][name] = count
+
+    def is_stale(self) -> bool:
+        """whether the season changed since the index was created"""
+        return self.season != settings.CURRENT_SEASON
+
+    def count(self, user: User, name: str) -> int:
+        self.load([user])
+        return self.counts[str(user.id)][name]
+
+    def earned(self, user: User, name: str) -> bool:
+        return self.count(user, name) > 0
+
+    def can_award(self, user: User, name: str, max_times: int=None) -> bool:
+        if name in NEWCOMER_BADGES.keys():
+            max_times = 1
+        return not max_times or self.count(user, name) < max_times
+
+    def add(self, user: User, name: str):
+        self.load([user])
+        self.counts[str(user.id)][name] += 1
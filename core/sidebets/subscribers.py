@@ -15,6 +15,12 @@ from sidebets.views import make_sidebet
 User = get_user_model()
 
 class SidebetSubscriber(Subscriber):
+    events = frozenset((
+        Event.NEW_HAND, Event.END_HAND, Event.BET, Event.RAISE_TO,
+        Event.CALL, Event.WIN, Event.CREATE_SIDEBET, Event.CLOSE_SIDEBET,
+        Event.LEAVE_SEAT, Event.CREATE_TRANSFER,
+    ))
+
     def __init__(self, accessor):
         self.accessor = accessor
         self.objects_to_save = []
@@ -0,0 +1,122 @@
+"""
+Wire encodings for outgoing websocket messages.
+
+Every socket starts out receiving plain JSON text frames.  A client can opt
+in to a binary encoding by sending {"type": "HELLO", "encoding": "msgpack"}
+(or "deflate"), the GOT_HELLO reply then confirms the encoding and includes
+the KEY_DICTIONARY used to shorten the most common gamestate keys.
+
+    json:       {'text': '{"type": "UPDATE_GAMESTATE", "players": ...}'}
+    msgpack:    {'bytes': msgpack.packb({0: 'UPDATE_GAMESTATE', 4: ...})}
+    deflate:    {'bytes': deflate('{"type": "UPDATE_GAMESTATE", ...}')}
+
+msgpack: keys found in KEY_DICTIONARY are replaced by their (int) index in
+the list at any depth, all other keys are sent as str, values are unchanged.
+deflate: the JSON text is compressed with the keys as a preset zlib
+dictionary, so even small messages don't pay to spell the keys out.
+
+The list is append-only: never reorder or remove entries, clients may have
+cached it.
+"""
+import json
+import zlib
+
+import msgpack
+
+from oddslingers.utils import ExtendedEncoder, to_json_str
+
+
+JSON_ENCODING = 'json'
+MSGPACK_ENCODING = 'msgpack'
+DEFLATE_ENCODING = 'deflate'
+
+ENCODINGS = (JSON_ENCODING, MSGPACK_ENCODING, DEFLATE_ENCODING)
+DEFAULT_ENCODING = JSON_ENCODING
+
+KEY_DICTIONARY = (
+    # socket message envelope
+    'type', 'HASH', 'TIMESTAMP', 'privado',
+    # gamestate
+    'players', 'table', 'animations', 'chat', 'notifications',
+    'level_notifications', 'table_stats', 'sidebets', 'value', 'patches',
+    'subj', 'event', 'args', 'path',
+    # table_json
+    'id', 'short_id', 'name', 'variant', 'sb', 'bb', 'btn_idx',
+    'num_seats', 'available_seats', 'min_buyin', 'max_buyin', 'hand_number',
+    'board', 'total_pot', 'sidepot_summary', 'uncollected_bets', 'to_act_id',
+    'seconds_to_act', 'last_action_timestamp', 'is_private', 'created_by',
+    'tournament', 'sidebets_enabled',
+    # player_json
+    'username', 'user_id', 'stack', 'position', 'playing_state', 'cards',
+    'card', 'amt', 'last_action', 'is_active', 'is_all_in', 'is_robot',
+    'is_autofolding', 'sitting_out', 'sit_in_next_hand', 'sit_in_at_blinds',
+    'logged_in', 'timebank', 'auto_rebuy', 'pending_rebuy', 'profile_image',
+    'available_actions', 'amt_to_call', 'min_bet', 'balance',
+    'preset_call', 'preset_check', 'preset_checkfold',
+    'legal_min_buyin', 'legal_max_buyin',
+)
+KEY_CODES = {key: code for code, key in enumerate(KEY_DICTIONARY)}
+DEFLATE_ZDICT = to_json_str(KEY_DICTIONARY).encode()
+
+
+def compact_keys(obj):
+    """replace every dictionary key found in KEY_DICTIONARY with its code"""
+    if isinstance(obj, dict):
+        return {
+            KEY_CODES.get(key, str(key)): compact_keys(val)
+            for key, val in obj.items()
+        }
+    if isinstance(obj, list):
+        return [compact_keys(item) for item in obj]
+    return obj
+
+
+def expand_keys(obj):
+    """inverse of compact_keys"""
+    if isinstance(obj, dict):
+        return {
+            KEY_DICTIONARY[key] if isinstance(key, int) else key:
+                expand_keys(val)
+            for key, val in obj.items()
+        }
+    if isinstance(obj, list):
+        return [expand_keys(item) for item in obj]
+    return obj
+
+
+def deflate(data: bytes) -> bytes:
+    compressor = zlib.compressobj(zdict=DEFLATE_ZDICT)
+    return compressor.compress(data) + compressor.flush()
+
+
+def inflate(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj(zdict=DEFLATE_ZDICT)
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def encode_message(content: dict, encoding: str=DEFAULT_ENCODING) -> dict:
+    """build the channel message to send a json-able dict in an encoding"""
+    if encoding == MSGPACK_ENCODING:
+        compacted = compact_keys(ExtendedEncoder.convert_for_json(content))
+        return {'bytes': msgpack.packb(compacted, use_bin_type=True)}
+
+    if encoding == DEFLATE_ENCODING:
+        return {'bytes': deflate(to_json_str(content).encode())}
+
+    return {'text': to_json_str(content)}
+
+
+def decode_message(message: dict) -> dict:
+    """decode a channel message built by encode_message (for tests & bots)"""
+    if 'text' in message:
+        return json.loads(message['text'])
+
+    data = message['bytes']
+    if data[:1] == b'x':    # zlib header, msgpack maps never start with 0x78
+        return json.loads(inflate(data).decode())
+    try:
+        unpacked = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except TypeError:
+        # msgpack<0.6.1 allows int map keys and has no strict_map_key arg
+        unpacked = msgpack.unpackb(data, raw=False)
+    return expand_keys(unpacked)
@@ -5,12 +5,14 @@ from typing import Tuple
 
 from django.conf import settings
 from django.utils import timezone
+from django.core.cache import cache
 from django.contrib.sessions.models import Session
 from channels.generic.websockets import JsonWebsocketConsumer
 
 from oddslingers.utils import ANSI, debug_print_io, log_io_message
 from oddslingers.models import UserSession
-from .models import Socket
+from .models import Socket, SOCKET_CACHE_KEY
+from .encoding import ENCODINGS, DEFAULT_ENCODING, KEY_DICTIONARY
 from .constants import (
     PING_RESPONSE_TYPE,
     HELLO_TYPE,
@@ -22,6 +24,20 @@ from .constants import (
 
 logger = logging.getLogger('sockets')
 
+# Socket fields kept in the cache between messages on the same connection
+CACHED_SOCKET_FIELDS = (
+    'id',
+    'session_id',
+    'channel_name',
+    'user_id',
+    'path',
+    'active',
+    'created',
+    'last_ping',
+    'user_ip',
+    'encoding',
+)
+
 
 class RoutedSocketHandler(JsonWebsocketConsumer):
     """All the methods and attributes available to every websocket request"""
@@ -47,8 +63,32 @@ class RoutedSocketHandler(JsonWebsocketConsumer):
         (TIME_SYNC_TYPE, 'on_time_sync'),
     )
 
-    def setup_session(self, extra: dict=None):
-        """initialize the socket DB model which persists the socket info"""
+    def setup_session(self, extra: dict=None, force: bool=False):
+        """
+        initialize the socket DB model which persists the socket info
+
+        The Socket row is only written when the socket connects, when the
+        frontend answers a PING, or when the cached copy of the row has
+        expired (every SOCKET_LAST_PING_FLUSH_INTERVAL seconds).  Every
+        other message on the connection reuses the cached socket state,
+        so pushing messages to a busy spectator doesn't write to the DB.
+
+        Marking sockets inactive or purging them drops their cached state
+        (see sockets.models.uncache_sockets), so the next message of a
+        socket that was marked stale or deleted writes the row again.
+        """
+        if self.socket is not None and not (extra or force):
+            return
+
+        if not (extra or force):
+            cached = cache.get(self.socket_cache_key)
+            if (cached and cached['active']
+                    and self._cached_socket_matches(cached)):
+                fields = {k: v for k, v in cached.items() if k != 'user_id'}
+                self.socket = Socket(user=self.user, **fields)
+                self.socket._state.adding = False
+                return
+
         extra = extra or {}
         if self.message.http_session:
             session_key = self.message.http_session.session_key
@@ -64,6 +104,19 @@ class RoutedSocketHandler(JsonWebsocketConsumer):
                 **extra,
             },
         )
+        cache.set(
+            self.socket_cache_key,
+            self.socket.attrs(*CACHED_SOCKET_FIELDS),
+            settings.SOCKET_LAST_PING_FLUSH_INTERVAL,
+        )
+
+    @property
+    def socket_cache_key(self):
+        return SOCKET_CACHE_KEY.format(self.reply_channel.name)
+
+    def _cached_socket_matches(self, cached: dict) -> bool:
+        user_id = self.user.id if self.user else None
+        return cached['path'] == self.path and cached['user_id'] == user_id
 
     @property
     def reply_channel(self):
@@ -110,6 +163,7 @@ class RoutedSocketHandler(JsonWebsocketConsumer):
         last_ping = self.socket.last_ping
         now = timezone.now()
         self.socket.delete()
+        cache.delete(self.socket_cache_key)
 
         disconnect_code = message.content.get('code')
 
@@ -226,7 +280,9 @@ class RoutedSocketHandler(JsonWebsocketConsumer):
     def receive(self, content: dict, **kwargs):
         """pass parsed json message to appropriate handler in self.routes"""
 
-        self.setup_session()
+        # PING responses confirm the socket is alive, so always flush
+        #   active and last_ping to the DB for them
+        self.setup_session(force=content.get(ROUTING_KEY) == PING_RESPONSE_TYPE)
 
         if not self.check_authentication(content):
             return None
@@ -256,10 +312,22 @@ class RoutedSocketHandler(JsonWebsocketConsumer):
         respond to websocket initial HELLO, confirms connection
         and round-trip-time
         """
+        # opt-in binary wire encoding, the GOT_HELLO reply is the first
+        #   message sent using it
+        encoding = content.get('encoding') or DEFAULT_ENCODING
+        if encoding not in ENCODINGS:
+            encoding = DEFAULT_ENCODING
+        if encoding != self.socket.encoding:
+            self.setup_session({'encoding': encoding})
+
         self.send_action(
             GOT_HELLO_TYPE,
             user_id=self.user.id if self.user else None,
             path=self.path,
+            encoding=encoding,
+            key_dictionary=(
+                KEY_DICTIONARY if encoding != DEFAULT_ENCODING else None
+            ),
             # last_ping=self.socket.last_ping,
             # user_ip=self.socket.user_ip,
         )
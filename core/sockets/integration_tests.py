@@ -13,7 +13,7 @@ import threading
 from time import sleep
 from websocket import create_connection
 
-from sockets.models import ROUTING_KEY, HELLO_TYPE, GOT_HELLO_TYPE, PING_TYPE
+from sockets.constants import ROUTING_KEY, HELLO_TYPE, GOT_HELLO_TYPE, PING_TYPE
 from oddslingers.utils import TimeOutException, timeout_handler, to_json_str
 
 
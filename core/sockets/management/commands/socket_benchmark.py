@@ -0,0 +1,505 @@
+"""
+Simulate whole tables over websockets against a running dev server and
+write a machine-readable report, used to compare server changes under load.
+
+./manage.py socket_benchmark --tables 4 --players 3 --spectators 10 -t 60
+"""
+import os
+import json
+import random
+import threading
+
+from time import sleep, perf_counter
+from decimal import Decimal
+from importlib import import_module
+
+import psutil
+from websocket import create_connection, WebSocketTimeoutException
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.contrib.auth import (get_user_model, SESSION_KEY,
+                                 BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+from django.core.management.base import BaseCommand
+
+from banker.mutations import buy_chips
+from oddslingers.mutations import execute_mutations
+from oddslingers.utils import to_json_str
+from poker.models import PokerTable
+from poker.tablebeat import tablebeat_pid, start_tablebeat, stop_tablebeat
+from sockets.constants import ROUTING_KEY, HELLO_TYPE
+from sockets.encoding import ENCODINGS, DEFAULT_ENCODING, decode_message
+
+from .socket_load_test import convert_ws_url
+
+
+User = get_user_model()
+SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+
+DEFAULT_TEST_TARGET = 'http://127.0.0.1:8000'
+DEFAULT_TABLES = 2
+DEFAULT_PLAYERS = 3
+DEFAULT_SPECTATORS = 5
+DEFAULT_TIME = 30
+NAME_PREFIX = 'benchmark'
+GAMESTATE_TYPES = ('SET_GAMESTATE', 'UPDATE_GAMESTATE')
+
+
+def percentiles(samples, points=(50, 90, 95, 99)) -> dict:
+    """nearest-rank percentiles of a list of numbers"""
+    if not samples:
+        return {**{f'p{p}': None for p in points}, 'max': None}
+    ordered = sorted(samples)
+    return {
+        **{
+            f'p{p}': ordered[min(len(ordered) - 1,
+                                 int(round(p / 100 * len(ordered))) - 1)]
+            for p in points
+        },
+        'max': ordered[-1],
+    }
+
+
+def db_activity() -> dict:
+    """transaction and row counters for the current postgres database"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT xact_commit, xact_rollback, tup_returned, tup_fetched, '
+            'tup_inserted, tup_updated, tup_deleted '
+            'FROM pg_stat_database WHERE datname = current_database()'
+        )
+        row = cursor.fetchone()
+        columns = [col[0] for col in cursor.description]
+    return dict(zip(columns, row))
+
+
+def login_cookie(user) -> str:
+    """create a logged-in session for user, returns the cookie to send"""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+class BenchmarkSocket(threading.Thread):
+    """A websocket connected to a table that records what it receives"""
+    keep_running = True
+
+    def __init__(self, url: str, cookie: str=None,
+                 encoding: str=DEFAULT_ENCODING, verbose=False):
+        super().__init__(daemon=True)
+        self.url = url
+        self.cookie = cookie
+        self.encoding = encoding
+        self.verbose = verbose
+        self.started = threading.Event()
+        self.ws = None
+
+        self.msgs_recvd = 0
+        self.bytes_recvd = 0
+        self.msgs_sent = 0
+        self.errors = []
+
+    def connect(self):
+        options = {'timeout': 1}
+        if self.cookie:
+            options['cookie'] = self.cookie
+        if self.url.startswith('wss://') and 'oddslingers.com' not in self.url:
+            options['sslopt'] = {'cert_reqs': 0}
+        self.ws = create_connection(self.url, **options)
+        if self.encoding != DEFAULT_ENCODING:
+            self.send_action(HELLO_TYPE, encoding=self.encoding)
+
+    def send_action(self, action_type: str, **kwargs):
+        self.ws.send(to_json_str({ROUTING_KEY: action_type, **kwargs}))
+        self.msgs_sent += 1
+        if self.verbose:
+            print('sent:', action_type, kwargs)
+
+    def recv(self):
+        try:
+            frame = self.ws.recv()
+        except WebSocketTimeoutException:
+            return None
+        self.msgs_recvd += 1
+        self.bytes_recvd += len(frame)
+        if isinstance(frame, bytes):
+            return decode_message({'bytes': frame})
+        return json.loads(frame)
+
+    def on_message(self, message: dict):
+        pass
+
+    def run(self):
+        try:
+            self.connect()
+        except Exception as e:
+            self.errors.append(f'connect: {e}')
+            self.started.set()
+            return
+        self.started.set()
+
+        while self.keep_running:
+            try:
+                message = self.recv()
+                if message:
+                    self.on_message(message)
+            except Exception as e:
+                if self.keep_running:
+                    self.errors.append(f'{e.__class__.__name__}: {e}')
+                break
+
+    def stop(self):
+        self.keep_running = False
+        self.join(timeout=5)
+        if self.ws:
+            self.ws.close()
+
+    def stats(self) -> dict:
+        return {
+            'msgs_recvd': self.msgs_recvd,
+            'bytes_recvd': self.bytes_recvd,
+            'msgs_sent': self.msgs_sent,
+            'errors': self.errors,
+        }
+
+
+class ScriptedPlayer(BenchmarkSocket):
+    """Takes a seat, then plays whatever it's offered when it's its turn"""
+
+    def __init__(self, url: str, user, position: int, buyin: Decimal,
+                 **kwargs):
+        super().__init__(url, cookie=login_cookie(user), **kwargs)
+        self.username = user.username
+        self.position = position
+        self.buyin = buyin
+        self.action_sent_at = None
+        self.acted_after_ts = None
+        self.sat_in_after_ts = None
+        self.latencies = []
+        self.actions = {}
+        self.rejected = 0
+
+    def connect(self):
+        super().connect()
+        self.send_action('JOIN_TABLE', position=self.position,
+                         buyin_amt=str(self.buyin))
+
+    def on_message(self, message: dict):
+        if message.get(ROUTING_KEY) == 'ERROR' and self.action_sent_at:
+            self.rejected += 1
+            self.action_sent_at = None
+            return
+
+        if message.get(ROUTING_KEY) not in GAMESTATE_TYPES:
+            return
+
+        table = message.get('table') or {}
+        last_action_ts = table.get('last_action_timestamp')
+        if self.action_sent_at is not None:
+            if last_action_ts == self.acted_after_ts:
+                # broadcast from before our action was processed
+                return
+            self.latencies.append(perf_counter() - self.action_sent_at)
+            self.action_sent_at = None
+
+        player_id, me = next(
+            ((player_id, plyr)
+             for player_id, plyr in (message.get('players') or {}).items()
+             if plyr.get('username') == self.username),
+            (None, None),
+        )
+        if not me:
+            return
+
+        available = me.get('available_actions') or ()
+        if me.get('sitting_out') and 'SIT_IN' in available:
+            if last_action_ts != self.sat_in_after_ts:
+                self.sat_in_after_ts = last_action_ts
+                self.send_action('SIT_IN')
+            return
+
+        if table.get('to_act_id') != player_id:
+            return
+
+        action, kwargs = self.choose_action(me)
+        if action:
+            self.actions[action] = self.actions.get(action, 0) + 1
+            self.acted_after_ts = last_action_ts
+            self.action_sent_at = perf_counter()
+            self.send_action(action, **kwargs)
+
+    def choose_action(self, me: dict):
+        available = me.get('available_actions') or ()
+        min_bet = me.get('min_bet')
+        roll = random.random()
+
+        if 'CHECK' in available:
+            if 'BET' in available and min_bet and roll < 0.3:
+                return 'BET', {'amt': min_bet}
+            return 'CHECK', {}
+        if 'CALL' in available:
+            return ('CALL', {}) if roll < 0.8 else ('FOLD', {})
+        if 'FOLD' in available:
+            return 'FOLD', {}
+        return None, {}
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            'actions': self.actions,
+            'rejected': self.rejected,
+            'latencies': self.latencies,
+        }
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the server with M tables of K scripted players and S '
+            'spectators each, and write a json report')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-H', '--host', type=str,
+                            default=DEFAULT_TEST_TARGET)
+        parser.add_argument('-m', '--tables', type=int,
+                            default=DEFAULT_TABLES)
+        parser.add_argument('-k', '--players', type=int,
+                            default=DEFAULT_PLAYERS)
+        parser.add_argument('-s', '--spectators', type=int,
+                            default=DEFAULT_SPECTATORS)
+        parser.add_argument('-t', '--time', type=int, default=DEFAULT_TIME)
+        parser.add_argument('--encoding', type=str, choices=ENCODINGS,
+                            default=DEFAULT_ENCODING)
+        parser.add_argument('--bb', type=int, default=2)
+        parser.add_argument('-o', '--output', type=str, default=None)
+        parser.add_argument('--keep', action='store_true',
+                            help="don't archive the benchmark tables & users")
+
+    def handle(self, *args, host=DEFAULT_TEST_TARGET, tables=DEFAULT_TABLES,
+               players=DEFAULT_PLAYERS, spectators=DEFAULT_SPECTATORS,
+               time=DEFAULT_TIME, encoding=DEFAULT_ENCODING, bb=2,
+               output=None, keep=False, verbosity=1, **options):
+        if not settings.DEBUG:
+            print('Cannot be run on production! (DEBUG=False)')
+            raise SystemExit(1)
+
+        assert 2 <= players <= 6, 'Tables need between 2 and 6 players'
+
+        ws_base = convert_ws_url(host).rstrip('/')
+        run_id = timezone.now().strftime('%Y%m%d%H%M%S')
+        bench_tables, bench_users = self.setup_tables(run_id, tables,
+                                                      players, bb)
+        # start the tablebeats up front, otherwise every socket that
+        #   connects before the first one is up will try to start one
+        heartbeats = {
+            table: self.wait_for_tablebeat(table)
+            for table, _ in bench_tables
+        }
+
+        print(f'Connecting {tables} tables x ({players} players + '
+              f'{spectators} spectators) to {ws_base}')
+        table_sockets = {}
+        for table, users in bench_tables:
+            url = ws_base + table.path
+            table_sockets[table] = {
+                'players': [
+                    ScriptedPlayer(url, user, position=idx, buyin=bb * 50,
+                                   encoding=encoding,
+                                   verbose=verbosity > 1)
+                    for idx, user in enumerate(users)
+                ],
+                'spectators': [
+                    BenchmarkSocket(url, encoding=encoding,
+                                    verbose=verbosity > 1)
+                    for _ in range(spectators)
+                ],
+            }
+
+        all_sockets = [
+            sock
+            for socks in table_sockets.values()
+            for sock in socks['players'] + socks['spectators']
+        ]
+        for sock in all_sockets:
+            sock.start()
+        for sock in all_sockets:
+            sock.started.wait()
+
+        cpu_before = {
+            table: self.cpu_seconds(pid)
+            for table, pid in heartbeats.items()
+        }
+        db_before = db_activity()
+        msgs_before = sum(s.msgs_recvd for s in all_sockets)
+        bytes_before = sum(s.bytes_recvd for s in all_sockets)
+
+        print(f'Playing for {time} seconds...')
+        start = perf_counter()
+        sleep(time)
+        elapsed = perf_counter() - start
+
+        db_after = db_activity()
+        cpu_after = {
+            table: self.cpu_seconds(pid)
+            for table, pid in heartbeats.items()
+        }
+        msgs = sum(s.msgs_recvd for s in all_sockets) - msgs_before
+        nbytes = sum(s.bytes_recvd for s in all_sockets) - bytes_before
+
+        for sock in all_sockets:
+            sock.stop()
+
+        report = self.build_report(
+            table_sockets, heartbeats, cpu_before, cpu_after,
+            db_before, db_after, msgs, nbytes, elapsed,
+            config={
+                'host': host,
+                'tables': tables,
+                'players': players,
+                'spectators': spectators,
+                'time': time,
+                'encoding': encoding,
+                'bb': bb,
+                'git_sha': settings.GIT_SHA,
+                'started': run_id,
+            },
+        )
+
+        if not keep:
+            self.teardown(bench_tables, bench_users)
+
+        output = output or os.path.join(
+            settings.DEBUG_DUMP_DIR,
+            f'socket_benchmark_{run_id}.json',
+        )
+        with open(output, 'w') as f:
+            f.write(to_json_str(report, indent=4, sort_keys=True))
+
+        summary = report['summary']
+        print(f'[√] Done, {summary["msgs_per_sec"]} msgs/s, '
+              f'{summary["bytes_per_sec"]} bytes/s, action latency '
+              f'p50={summary["latency_ms"]["p50"]}ms '
+              f'p99={summary["latency_ms"]["p99"]}ms')
+        print(f'Report saved to {output}')
+
+    def setup_tables(self, run_id: str, num_tables: int, num_players: int,
+                     bb: int):
+        bench_tables, bench_users = [], []
+        for table_idx in range(num_tables):
+            table = PokerTable.objects.create_table(
+                name=f'{NAME_PREFIX} {run_id} #{table_idx}',
+                sb=Decimal(bb) / 2,
+                bb=bb,
+                num_seats=6,
+                min_buyin=bb * 40,
+                max_buyin=bb * 100,
+                is_private=True,
+            )
+            users = []
+            for player_idx in range(num_players):
+                username = f'{NAME_PREFIX}_{run_id}_{table_idx}_{player_idx}'
+                user = User.objects.create_user(
+                    username=username,
+                    email=f'{username}@example.com',
+                    password=None,
+                )
+                execute_mutations(buy_chips(user, Decimal(bb * 1000)))
+                users.append(user)
+            bench_tables.append((table, users))
+            bench_users += users
+        return bench_tables, bench_users
+
+    def wait_for_tablebeat(self, table, timeout: int=10):
+        start_tablebeat(table)
+        for _ in range(timeout * 10):
+            pid = tablebeat_pid(table)
+            if pid:
+                return pid
+            sleep(0.1)
+        print(f'[X] Tablebeat did not start for {table}')
+        return None
+
+    def teardown(self, bench_tables, bench_users):
+        for table, _ in bench_tables:
+            stop_tablebeat(table)
+            table.is_archived = True
+            table.save()
+        for user in bench_users:
+            user.is_active = False
+            user.save()
+
+    def cpu_seconds(self, pid) -> float:
+        if not pid:
+            return None
+        try:
+            times = psutil.Process(pid).cpu_times()
+        except psutil.NoSuchProcess:
+            return None
+        return times.user + times.system
+
+    def build_report(self, table_sockets, heartbeats, cpu_before, cpu_after,
+                     db_before, db_after, msgs, nbytes, elapsed, config):
+        latencies = []
+        tables_report = []
+        for table, socks in table_sockets.items():
+            table_latencies = [
+                lat
+                for plyr in socks['players']
+                for lat in plyr.latencies
+            ]
+            latencies += table_latencies
+
+            cpu = None
+            if cpu_before[table] is not None and cpu_after[table] is not None:
+                cpu = cpu_after[table] - cpu_before[table]
+
+            tables_report.append({
+                'table_id': str(table.id),
+                'path': table.path,
+                'tablebeat_pid': heartbeats[table],
+                'tablebeat_cpu_seconds': cpu,
+                'tablebeat_cpu_pct': (
+                    round(100 * cpu / elapsed, 2) if cpu is not None else None
+                ),
+                'latency_ms': {
+                    k: round(v * 1000, 2) if v is not None else None
+                    for k, v in percentiles(table_latencies).items()
+                },
+                'players': [
+                    {**plyr.stats(), 'latencies': len(plyr.latencies)}
+                    for plyr in socks['players']
+                ],
+                'spectators': [spec.stats() for spec in socks['spectators']],
+            })
+
+        db_delta = {
+            key: db_after[key] - db_before[key]
+            for key in db_before.keys()
+        }
+        return {
+            'config': config,
+            'summary': {
+                'elapsed_seconds': round(elapsed, 3),
+                'actions': len(latencies),
+                'latency_ms': {
+                    k: round(v * 1000, 2) if v is not None else None
+                    for k, v in percentiles(latencies).items()
+                },
+                'msgs_recvd': msgs,
+                'bytes_recvd': nbytes,
+                'msgs_per_sec': round(msgs / elapsed, 2),
+                'bytes_per_sec': round(nbytes / elapsed, 2),
+                'db': db_delta,
+                'db_transactions_per_sec': round(
+                    db_delta['xact_commit'] / elapsed, 2
+                ),
+                'errors': sum(
+                    len(sock.errors)
+                    for socks in table_sockets.values()
+                    for sock in socks['players'] + socks['spectators']
+                ),
+            },
+            'tables': tables_report,
+        }
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.11 on 2026-10-19 05:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sockets', '0008_auto_20180730_2303'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socket',
+            name='encoding',
+            field=models.CharField(default='json', max_length=16),
+        ),
+    ]
@@ -2,15 +2,17 @@ import datetime
 import logging
 
 from hashlib import md5
+from collections import defaultdict
 from channels import Channel, Group
 
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.contrib.gis.geoip2 import GeoIP2
 from django.contrib.sessions.models import Session
 
-from oddslingers.utils import (to_json_str, debug_print_io, log_io_message,
+from oddslingers.utils import (debug_print_io, log_io_message,
                           add_timestamp_and_hash)
 from oddslingers.model_utils import BaseModel
 
@@ -18,9 +20,21 @@ from .constants import (
     PING_TYPE,
     ROUTING_KEY,
 )
+from .encoding import DEFAULT_ENCODING, encode_message
 
 logger = logging.getLogger('sockets')
 
+# socket fields cached by the handlers between messages on a connection
+SOCKET_CACHE_KEY = 'socket-session-{0}'
+
+
+def uncache_sockets(channel_names):
+    """
+    drop the cached state of sockets that were marked inactive or deleted,
+    so their next message writes the row again
+    """
+    cache.delete_many([SOCKET_CACHE_KEY.format(name) for name in channel_names])
+
 
 class SocketQuerySet(models.QuerySet):
     """
@@ -29,12 +43,14 @@ class SocketQuerySet(models.QuerySet):
     """
     _channel_names = ()
 
-    def group(self):
+    def group(self, channel_names=None):
         """
         get a django channels Group consisting of all the
         reply_channels in the QuerySet
         """
-        self._channel_names = self.values_list('channel_name', flat=True)
+        if channel_names is None:
+            channel_names = self.values_list('channel_name', flat=True)
+        self._channel_names = channel_names
 
         if not self._channel_names:
             empty_group = Group('emptyname')
@@ -56,13 +72,17 @@ class SocketQuerySet(models.QuerySet):
         return combined_group
 
     def send_str(self, content: str):
-        group = self.group()
+        return self.send_message({'text': content})
+
+    def send_message(self, message: dict, channel_names=None):
+        """send a raw {'text': ...} or {'bytes': ...} channel message"""
+        group = self.group(channel_names)
         # Group.send and group.empty check is necessary to prevent
         #   ChannelFull errors caused by sending to empty group or
         #   group with dead Channels. do not replace this with a for
         #   loop that sends to each channel separately
         if not getattr(group, 'empty', False):
-            group.send({'text': content}, immediately=True)
+            group.send(message, immediately=True)
             return len(self._channel_names)
         return 0
 
@@ -72,8 +92,16 @@ class SocketQuerySet(models.QuerySet):
         debug_print_io(out=True, content=content)
         log_io_message(self, direction='out', content=content)
 
-        encoded_json = to_json_str(content)
-        return self.send_str(encoded_json)
+        # one group send per wire encoding the sockets negotiated
+        channels_by_encoding = defaultdict(list)
+        for channel_name, encoding in self.values_list('channel_name',
+                                                       'encoding'):
+            channels_by_encoding[encoding].append(channel_name)
+
+        return sum(
+            self.send_message(encode_message(content, encoding), channels)
+            for encoding, channels in channels_by_encoding.items()
+        )
 
     def send_action(self, action_type: str, **kwargs):
         """send an action to the entire QuerySet of Sockets"""
@@ -83,6 +111,7 @@ class SocketQuerySet(models.QuerySet):
         return self.update(active=True)
 
     def mark_inactive(self):
+        uncache_sockets(self.values_list('channel_name', flat=True))
         return self.update(active=False)
 
     def cleanup_stale(self):
@@ -92,7 +121,7 @@ class SocketQuerySet(models.QuerySet):
         """
         # print(f'Asking {self.count()} potentially stale sockets for '\
         #        'a PING back.')
-        self.filter(active=True).update(active=False)
+        self.filter(active=True).mark_inactive()
         # ask the frontend to PING us back to confirm they're still active
         self.send_action(PING_TYPE)
         self.purge_inactive()
@@ -102,6 +131,7 @@ class SocketQuerySet(models.QuerySet):
         n_mins_ago = timezone.now() - datetime.timedelta(minutes=in_last_mins)
 
         inactives = self.filter(active=False, last_ping__lt=n_mins_ago)
+        uncache_sockets(inactives.values_list('channel_name', flat=True))
         num_deleted, _ = inactives.delete()
 
         # if num_deleted and settings.DEBUG:
@@ -132,6 +162,8 @@ class Socket(BaseModel):
     created = models.DateTimeField(auto_now_add=True)
     last_ping = models.DateTimeField(null=True)
     user_ip = models.GenericIPAddressField(null=True, blank=True)
+    # wire encoding negotiated in the HELLO handshake, see sockets.encoding
+    encoding = models.CharField(max_length=16, default=DEFAULT_ENCODING)
 
     def __repr__(self):
         """<Socket username@/table/1234 (inactive)>"""
@@ -169,9 +201,8 @@ class Socket(BaseModel):
         content = add_timestamp_and_hash(content)
         self.log_message(out=True, content=content)
         log_io_message(self, direction='out', content=content)
-        
-        encoded_json = to_json_str(content)
-        self.reply_channel.send({'text': encoded_json})
+
+        self.reply_channel.send(encode_message(content, self.encoding))
 
     def send_action(self, action_type: str, **kwargs):
         self.send_json({**kwargs, ROUTING_KEY: action_type})
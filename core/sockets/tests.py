@@ -6,6 +6,7 @@ from datetime import timedelta
 from channels import route_class
 from channels.test import ChannelTestCase, WSClient, Client, apply_routes
 
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 from oddslingers.utils import to_json_str
@@ -13,6 +14,13 @@ from oddslingers.utils import to_json_str
 from .models import Socket
 from .handlers import RoutedSocketHandler
 from .router import SocketRouter
+from .encoding import (
+    ENCODINGS,
+    MSGPACK_ENCODING,
+    KEY_DICTIONARY,
+    encode_message,
+    decode_message,
+)
 
 from .constants import (
     PING_RESPONSE_TYPE,
@@ -133,6 +141,48 @@ class RoutedSocketHandlerTests(ChannelTestCase):
 
             assert all(key in reply for key in expected_keys)
 
+    def test_hello_negotiates_encoding(self):
+        with apply_routes([route_class(RoutedSocketHandler, path='/t/.*/')]):
+            ws = Client()
+            message = {
+                'path': '/t/1/',
+                'text': to_json_str({
+                    ROUTING_KEY: HELLO_TYPE,
+                    'encoding': MSGPACK_ENCODING,
+                }),
+            }
+            ws.send_and_consume('websocket.receive', message)
+
+            raw_reply = ws.receive()
+            assert 'bytes' in raw_reply, (
+                'GOT_HELLO was not sent using the negotiated encoding')
+            reply = decode_message(raw_reply)
+            assert reply[ROUTING_KEY] == GOT_HELLO_TYPE
+            assert reply['encoding'] == MSGPACK_ENCODING
+            assert tuple(reply['key_dictionary']) == KEY_DICTIONARY
+
+            # broadcasts to the socket's path use the encoding as well
+            Socket.objects.filter(path='/t/1/').send_action(
+                'UPDATE_GAMESTATE',
+                players={'abc': {'username': 'bob', 'stack': 100}},
+            )
+            reply = decode_message(ws.receive())
+            assert reply[ROUTING_KEY] == 'UPDATE_GAMESTATE'
+            assert reply['players'] == {
+                'abc': {'username': 'bob', 'stack': 100},
+            }
+
+    def test_encodings_roundtrip(self):
+        content = {
+            ROUTING_KEY: 'UPDATE_GAMESTATE',
+            'players': {'1': {'username': 'bob', 'cards': ['Ah', 'Kd']}},
+            'unknown_key': [{'table': None}],
+        }
+        for encoding in ENCODINGS:
+            message = encode_message(content, encoding)
+            assert decode_message(message) == content, (
+                f'{encoding} message did not decode to the original')
+
     def test_ping(self):
         with apply_routes([route_class(RoutedSocketHandler, path='/t/.*/')]):
             ws = Client()
@@ -307,6 +357,61 @@ class SocketModelTests(ChannelTestCase):
             assert handler.socket.id is None, (
                 'Socket was not deleted on disconnect')
 
+    def test_socket_row_only_written_on_ping(self):
+        with apply_routes([route_class(RoutedSocketHandler, path='/t/.*/')]):
+            ws = Client()
+            handler = ws.send_and_consume(
+                'websocket.connect',
+                {'path': '/t/1/'}
+            )
+            socket = handler.socket
+            an_hour_ago = timezone.now() - timedelta(hours=1)
+            Socket.objects.filter(id=socket.id).update(last_ping=an_hour_ago)
+
+            handler = ws.send_and_consume(
+                'websocket.receive',
+                build_msg('XYZabc123')
+            )
+            assert handler.socket.id == socket.id
+            socket.refresh_from_db()
+            assert socket.last_ping == an_hour_ago, (
+                'Socket row was written for a message that was not a PING')
+
+            ws.send_and_consume(
+                'websocket.receive',
+                build_msg(PING_RESPONSE_TYPE)
+            )
+            socket.refresh_from_db()
+            assert socket.last_ping > an_hour_ago, (
+                'Socket last_ping was not flushed on a PING response')
+
+    def test_stale_and_purged_sockets_are_rewritten(self):
+        with apply_routes([route_class(RoutedSocketHandler, path='/t/.*/')]):
+            ws = Client()
+            handler = ws.send_and_consume(
+                'websocket.connect',
+                {'path': '/t/1/'}
+            )
+            socket = handler.socket
+
+            # any message re-activates a socket that was marked stale
+            Socket.objects.filter(id=socket.id).cleanup_stale()
+            ws.send_and_consume('websocket.receive', build_msg('XYZabc123'))
+            socket.refresh_from_db()
+            assert socket.active, (
+                'Stale socket was not re-activated by a message')
+
+            # and re-creates the row of a socket that was purged
+            Socket.objects.filter(id=socket.id).update(active=False)
+            Socket.objects.filter(id=socket.id).purge_inactive(in_last_mins=0)
+            handler = ws.send_and_consume(
+                'websocket.receive',
+                build_msg('XYZabc123')
+            )
+            assert Socket.objects.filter(id=handler.socket.id,
+                                         active=True).exists(), (
+                'Purged socket was not re-created by a message')
+
     def test_cleanup_stale(self):
         with apply_routes([route_class(RoutedSocketHandler, path='/t/.*/')]):
             ws = Client()
@@ -10,9 +10,10 @@ from typing import Union, Optional, List
 from django.conf import settings
 from django.contrib.auth import get_user_model
 
-from oddslingers.utils import to_json_str
+from oddslingers.utils import to_json_str, flush_io_log
 from poker.models import PokerTable
 from poker.replayer import EventReplayer
+from poker.dispatch_timing import dispatch_timing_histograms
 from poker.controllers import controller_for_table
 
 from .models import SupportTicket
@@ -27,6 +28,7 @@ USER_INFO_PATH = 'user.json'
 TABLE_INFO_PATH = 'table.json'
 NOTES_PATH = 'notes.txt'
 TABLEBEAT_INFO_PATH = 'tablebeat_info.json'
+DISPATCH_TIMING_PATH = 'dispatch_timing.json'
 BOTBEAT_INFO_PATH = 'botbeat_info.json'
 FRONTEND_LOG_PATH = 'frontend_log.json'
 CURRENT_HAND_HISTORY_PATH = 'current_hand.json'
@@ -234,6 +236,23 @@ def read_tablebeat_info(ticket: SupportTicket) -> Optional[dict]:
 
 
 
+### Dispatch Timing
+def save_dispatch_timing(ticket: SupportTicket, table: PokerTable):
+    save_artifact(ticket, DISPATCH_TIMING_PATH, {
+        'table': dispatch_timing_histograms(table.id),
+        'all_tables': dispatch_timing_histograms(),
+    })
+
+def read_dispatch_timing(ticket: SupportTicket) -> Optional[dict]:
+    dispatch_timing = read_artifact(ticket, DISPATCH_TIMING_PATH)
+    if dispatch_timing is None: return None
+
+    # to tell mypy info is always dict
+    assert isinstance(dispatch_timing, dict)
+    return dispatch_timing
+
+
+
 ### Botbeat info
 def assemble_botbeat_info(queued_tables: List[PokerTable],
                           failing_table: PokerTable,
@@ -321,9 +340,17 @@ def read_frontend_log(ticket: SupportTicket) -> Optional[dict]:
 def save_socket_log(ticket: SupportTicket, socket_path: str):
     path = '-'.join(socket_path.split('/')[1:-1])
 
+    # every process writes its lines from its own background thread, this
+    #   only flushes the ones queued here.  Lines just queued by the views
+    #   & tablebeats in other processes may not be on disk yet
+    flush_io_log()
+
     src = settings.SOCKET_IO_LOG.format(path, 'in')
     artifact_path = SOCKET_IO_LOG_PATH.format(path, 'in')
     copy_file(ticket, src, artifact_path)
+    # the lines before the last rotation
+    if os.path.exists(f'{src}.1'):
+        copy_file(ticket, f'{src}.1', f'{artifact_path}.1')
 
     # src = settings.SOCKET_IO_LOG.format(path, 'out')
     # artifact_path = SOCKET_IO_LOG_PATH.format(path, 'out')
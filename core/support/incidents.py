@@ -18,6 +18,7 @@ from .artifacts import (
     save_table_info,
     save_notes,
     save_tablebeat_info,
+    save_dispatch_timing,
     save_botbeat_info,
     save_frontend_log,
     save_hand_history,
@@ -49,6 +50,7 @@ def ticket_from_tablebeat_exception(table: PokerTable,
     save_traceback(ticket, exc, tb)
     save_tablebeat_info(ticket, tablebeat_info)
     save_table_info(ticket, table)
+    save_dispatch_timing(ticket, table)
     save_hand_history(ticket, table)
     save_socket_log(ticket, table.path)
     save_tablebeat_log(ticket, table)
@@ -104,6 +106,7 @@ def ticket_from_table_report_bug(table: PokerTable,
     save_table_info(ticket, table)
     save_hand_history(ticket, table)
     save_frontend_log(ticket, fontend_log)
+    save_dispatch_timing(ticket, table)
     save_socket_log(ticket, table.path)
     save_tablebeat_log(ticket, table)
     save_botbeat_log(ticket)
@@ -369,6 +369,20 @@ class TestLeaderboard(SimpleViewTest):
         )
         save_leaderboard_cache()
 
+    def test_full_leaderboard(self):
+        self.view.get(self.request)
+        user = self.user
+        execute_mutations(
+            create_transfer(self.table, user, 10000)
+        )
+        resp_props = self.view.props(self.request)
+
+        assert [user['username'] for user in resp_props['current_top']] \
+            == [user.username]
+        assert resp_props['current_top'][0]['winnings'] == 10000
+        assert resp_props['past_top'] == []
+        assert len(resp_props['seasons']) == settings.CURRENT_SEASON + 1
+
 
 ### Page View Tests (Page Integration Tests)
 class TestUserProfile(SimpleViewTest):
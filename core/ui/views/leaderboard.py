@@ -3,8 +3,7 @@ import json
 import logging
 from typing import List, Dict, Any
 
-from django.db.models import Q, Sum, QuerySet, Prefetch
-from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, Sum, Count, QuerySet, Prefetch
 from django.utils import timezone
 from django.conf import settings
 
@@ -13,10 +12,9 @@ from oddslingers.models import User
 from oddslingers.mutations import execute_mutations
 
 from rewards.models import Badge
-from banker.utils import get_timing_kwargs
-from banker.models import BalanceTransfer
+from banker.utils import winnings_totals
 
-from poker.models import PokerTable, Freezeout
+from poker.models import PokerTable, Player
 from poker.constants import SEASONS
 
 from rewards.mutations import check_xss_swearing
@@ -60,32 +58,19 @@ class Leaderboard(PublicReactView):
                 ],
             }
 
-        # Full Version, commenteded until optimized to be faster
-        # top_users_tw = top_users_this_week()
-        # top_users_lw = top_users_last_week()
-        # full_leaderboard = {
-        #     **base_response,
-        #     'current_top': [
-        #         leaderboard_user_json(user, ranking)
-        #         for ranking, user in enumerate(top_users_tw)
-        #     ],
-        #     'past_top': [
-        #         leaderboard_user_json(user, ranking)
-        #         for ranking, user in enumerate(top_users_lw)
-        #     ],
-        #     'seasons': [
-        #         [
-        #             leaderboard_user_json(user, ranking)
-        #             for ranking, user in enumerate(season)
-        #         ] for season in top_users_all_seasons()
-        #     ],
-        # }
-
-        cached_info = load_leaderboard_cache()
+        badge_counts = badge_counts_by_season()[settings.CURRENT_SEASON]
+        # past seasons are over, their leaderboards never change
+        past_seasons = load_leaderboard_cache()['seasons']
         return {
             **base_response,
-            **cached_info,
-            'last_top': [],
+            'current_top': leaderboard_json(top_users_this_week(),
+                                            badge_counts),
+            'past_top': leaderboard_json(top_users_last_week(),
+                                         badge_counts),
+            'seasons': [
+                *past_seasons[:settings.CURRENT_SEASON],
+                leaderboard_json(top_users_in_season(), badge_counts),
+            ],
         }
 
 
@@ -95,33 +80,20 @@ def save_leaderboard_cache():
 
     Generate the cache file in advance using ./manage.py save_leaderboard_cache
     """
-    badge_counts = [
-        {
-            str(user.id): user.badge_count(season=season)
-            for user in User.objects.all()
-        }
-        for season in range(settings.CURRENT_SEASON + 1)
-    ]
+    badge_counts = badge_counts_by_season()
     leaderboard_props = {
         'seasons': [
-            [
-                leaderboard_user_json(
-                    user,
-                    ranking,
-                    badge_counts[0],
-                    include_tables=False
-                )
-                for ranking, user in enumerate(top_users_in_season(0))
-            ],
-            [
-                leaderboard_user_json(user, ranking, badge_counts[settings.CURRENT_SEASON])
-                for ranking, user in enumerate(top_users_in_season())
-            ],
-        ],
-        'current_top': [
-            leaderboard_user_json(user, ranking, badge_counts[settings.CURRENT_SEASON])
-            for ranking, user in enumerate(top_users_this_week())
+            leaderboard_json(
+                top_users_in_season(season),
+                badge_counts[season],
+                include_tables=season == settings.CURRENT_SEASON,
+            )
+            for season in range(settings.CURRENT_SEASON + 1)
         ],
+        'current_top': leaderboard_json(
+            top_users_this_week(),
+            badge_counts[settings.CURRENT_SEASON],
+        ),
     }
 
     cache_path = os.path.join(settings.CACHES_DIR,
@@ -176,6 +148,29 @@ def leaderboard_user_json(user: User,
     }
 
 
+def leaderboard_json(users: List[User],
+                     badge_counts: Dict,
+                     include_tables: bool=True) -> List[Dict[str, Any]]:
+    return [
+        leaderboard_user_json(user, ranking, badge_counts, include_tables)
+        for ranking, user in enumerate(users)
+    ]
+
+
+def badge_counts_by_season() -> List[Dict[str, int]]:
+    """[{user_id: number of badges}, ...] for every season, in one query"""
+    badge_counts: List[Dict[str, int]] = [
+        {} for _ in range(settings.CURRENT_SEASON + 1)
+    ]
+    for user_id, season, count in Badge.objects\
+            .filter(season__gte=0, season__lte=settings.CURRENT_SEASON)\
+            .values_list('user_id', 'season')\
+            .annotate(Count('id'))\
+            .order_by():
+        badge_counts[season][str(user_id)] = count
+    return badge_counts
+
+
 def leaderboard_tables_json(user: User) -> List[Dict[str, Any]]:
     leaderboard_expiry = timezone.timedelta(
         days=settings.LEADERBOARD_PAGE_TIME_RANGE
@@ -270,12 +265,8 @@ def top_users_by_winnings(last_days=None,
                           from_date=None,
                           to_date=None,
                           max_users=100) -> dict:
-    tabletype = ContentType.objects.get_for_model(PokerTable)
-    freezeouttype = ContentType.objects.get_for_model(Freezeout)
-    usertype = ContentType.objects.get_for_model(User)
-
     if last_days is None and from_date is None and to_date is None:
-        timing_kwargs = {}
+        credits_by_user, debits_by_user = winnings_totals()
     else:
         now = timezone.now()
         if from_date is None:
@@ -284,29 +275,7 @@ def top_users_by_winnings(last_days=None,
         if to_date is None:
             to_date = now
 
-        timing_kwargs = get_timing_kwargs(from_date, to_date)
-
-    # collect all balance transfers for the week, group and sum by dest/src
-    debits_by_user = {
-        debits['source_id']: debits['total']
-        for debits in BalanceTransfer.objects
-                                     .filter(Q(dest_type=tabletype)
-                                             | Q(dest_type=freezeouttype),
-                                             source_type=usertype,
-                                             **timing_kwargs)
-                                     .values('source_id')
-                                     .annotate(total=Sum('amt'))
-    }
-    credits_by_user = {
-        credits['dest_id']: credits['total']
-        for credits in BalanceTransfer.objects
-                                      .filter(Q(source_type=tabletype)
-                                              | Q(source_type=freezeouttype),
-                                              dest_type=usertype,
-                                              **timing_kwargs)
-                                      .values('dest_id')
-                                      .annotate(total=Sum('amt'))
-    }
+        credits_by_user, debits_by_user = winnings_totals(from_date, to_date)
 
     user_nets = users_current_net(credits_by_user, debits_by_user)
 
@@ -338,21 +307,26 @@ def users_current_net(credits: dict, debits: dict) -> dict:
     """
     Return an object with the current net of users
     """
+    user_ids = list(credits.keys())
+    robot_ids = set(
+        User.objects.filter(id__in=user_ids, is_robot=True)
+                    .values_list('id', flat=True)
+    )
+    # chips users have on the tables they're seated at
+    current_winnings = dict(
+        Player.objects.filter(user_id__in=user_ids, seated=True)
+                      .values_list('user_id')
+                      .annotate(Sum('stack'))
+                      .order_by()
+    )
+
     user_nets = {}
-    for user_id in credits.keys():
-        user = User.objects.get(id=user_id)
-        if user.is_robot:
+    for user_id, user_credits in credits.items():
+        if user_id in robot_ids:
             continue
 
-        user_credits = credits.get(user_id, 0)
-        user_debits = debits.get(user_id, 0)
-
-        current_winnings = user.player_set\
-                               .filter(seated=True)\
-                               .aggregate(Sum('stack'))['stack__sum'] or 0
-
-        user_credits += current_winnings
-        net = user_credits - user_debits
+        user_credits += current_winnings.get(user_id) or 0
+        net = user_credits - debits.get(user_id, 0)
 
         if net > 0:
             user_nets[user_id] = net
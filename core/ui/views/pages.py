@@ -32,7 +32,7 @@ from poker.views.handlers import (
 from poker.game_utils import (
     featured_game, make_game, fuzzy_get_table, fuzzy_get_game,
 )
-from poker.subscribers import json_for_chatline
+from poker.chat import recent_chatlines, render_chatline
 from poker.tablebeat import (
     queue_tablebeat_dispatch, peek_tablebeat_dispatch,
     start_tablebeat, stop_tablebeat,
@@ -263,8 +263,8 @@ class Home(PublicReactView):
 
         target = table.tournament or table
         chat = [
-            json_for_chatline(line, accessor=accessor)
-            for line in target.chat_history.get_last_100()
+            render_chatline(line, accessor=accessor)
+            for line in recent_chatlines(target.chat_history)
         ] if target.chat_history is not None else []
 
         return {
@@ -343,8 +343,8 @@ class Table(PublicReactView):
 
         target = table.tournament or table
         chat = [
-            json_for_chatline(line, accessor=accessor)
-            for line in target.chat_history.get_last_100()
+            render_chatline(line, accessor=accessor)
+            for line in recent_chatlines(target.chat_history)
         ] if target.chat_history is not None else []
 
         has_access = (
@@ -467,11 +467,11 @@ class TournamentSummary(PublicReactView):
         entrants = tournament.get_entrants()
 
         chat = [
-            json_for_chatline(
+            render_chatline(
                 line,
                 tourney_entrants=[e['username']for e in entrants]
             )
-            for line in tournament.chat_history.get_last_100()
+            for line in recent_chatlines(tournament.chat_history)
         ] if tournament.chat_history else []
 
         players = dict()